@@ -0,0 +1,162 @@
+"""
+Absence pattern metrics
+
+Per-employee indicators HR uses to spot patterns of short, frequent
+absences, computed for the whole organisation at once:
+
+- spells: separate periods of absence. Leaves separated only by
+  non-working days (a weekend, a holiday) belong to the same spell
+- days: working days absent
+- Bradford factor: spells squared times days, so many short spells score
+  far higher than one long one
+- longest spell, in working days
+- Monday/Friday spells: spells that start on a Monday or end on a Friday,
+  and their share of all spells
+
+Approved leaves are streamed from one query and every indicator is
+computed with numpy operations grouped by employee.
+"""
+from datetime import date
+
+import numpy as np
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from slmsapp.models import Employee_Leave
+from .calendar_utils import calendar_for_department
+from .leave_utils import calculate_working_days_bulk
+
+
+# Metrics the absence report can be sorted by, with their column headings
+SORT_FIELDS = {
+    'bradford': 'Bradford Factor',
+    'spells': 'Spells',
+    'days': 'Days Absent',
+    'longest_spell': 'Longest Spell',
+    'monday_friday_share': 'Mon/Fri Spells',
+}
+
+MONDAY, FRIDAY = 0, 4
+
+
+def _working_days(starts, ends, calendars):
+    """Working days of each range, counted against its own holiday calendar"""
+    days = np.zeros(len(starts), dtype=np.int64)
+    for calendar_id in np.unique(calendars).tolist():
+        in_calendar = calendars == calendar_id
+        days[in_calendar] = calculate_working_days_bulk(
+            np.column_stack([starts[in_calendar], ends[in_calendar]]), calendar_id or None
+        )
+    return days
+
+
+def _weekday(days):
+    """Monday=0 ... Sunday=6 for datetime64[D] values (1 January 1970 was a Thursday)"""
+    return (days.astype(np.int64) + 3) % 7
+
+
+def _empty_metrics():
+    return {
+        'employee_id': np.zeros(0, dtype=np.int64),
+        'spells': np.zeros(0, dtype=np.int64),
+        'days': np.zeros(0, dtype=np.int64),
+        'bradford': np.zeros(0, dtype=np.int64),
+        'longest_spell': np.zeros(0, dtype=np.int64),
+        'monday_friday_spells': np.zeros(0, dtype=np.int64),
+        'monday_friday_share': np.zeros(0, dtype=np.float64),
+    }
+
+
+def absence_metrics(year, leave_type_id=None, department_id=None):
+    """
+    Absence indicators for every employee with approved leave in a year
+
+    Leaves crossing into the neighbouring years are cut at the year's edges.
+
+    Args:
+        year: Calendar year to measure
+        leave_type_id: Only count leaves of this type (e.g. sick leave)
+        department_id: Only count employees of this department
+
+    Returns:
+        dict: Parallel numpy arrays, one entry per employee in ascending
+            employee_id order: employee_id, spells, days, bradford,
+            longest_spell, monday_friday_spells and monday_friday_share
+            (percentage of spells)
+    """
+    first, last = date(year, 1, 1), date(year, 12, 31)
+    leaves = Employee_Leave.objects.filter(status=1, from_date__lte=last, to_date__gte=first)
+    if leave_type_id:
+        leaves = leaves.filter(leave_type_id=leave_type_id)
+    if department_id:
+        leaves = leaves.filter(employee_id__department_id=department_id)
+
+    employee_ids, department_ids, from_dates, to_dates = [], [], [], []
+    # Dates are read as ISO strings, which numpy parses in bulk
+    for employee_id, leave_department_id, start, end in (
+        leaves.order_by()
+        .annotate(start=Cast('from_date', CharField()), end=Cast('to_date', CharField()))
+        .values_list('employee_id', 'employee_id__department_id', 'start', 'end')
+        .iterator(chunk_size=2000)
+    ):
+        employee_ids.append(employee_id)
+        department_ids.append(leave_department_id)
+        from_dates.append(start)
+        to_dates.append(end)
+    if not employee_ids:
+        return _empty_metrics()
+
+    starts = np.maximum(np.array(from_dates, dtype='datetime64[D]'), np.datetime64(first, 'D'))
+    ends = np.minimum(np.array(to_dates, dtype='datetime64[D]'), np.datetime64(last, 'D'))
+    unique_employees, employees = np.unique(np.array(employee_ids, dtype=np.int64), return_inverse=True)
+    calendar_of = {i: calendar_for_department(i) or 0 for i in set(department_ids)}
+    calendars = np.array([calendar_of[i] for i in department_ids], dtype=np.int64)
+
+    order = np.lexsort((starts, employees))
+    employees, calendars, starts, ends = employees[order], calendars[order], starts[order], ends[order]
+
+    # Latest end so far for the same employee; offsetting by employee keeps
+    # one running maximum per employee in a single accumulate
+    day_numbers = ends.astype(np.int64)
+    offset = employees * (day_numbers.max() - day_numbers.min() + 2)
+    latest_end = (np.maximum.accumulate(day_numbers + offset) - offset).astype('datetime64[D]')
+    same_employee = np.zeros(len(employees), dtype=bool)
+    same_employee[1:] = employees[1:] == employees[:-1]
+    previous_end = np.empty_like(latest_end)
+    previous_end[0] = starts[0]
+    previous_end[1:] = latest_end[:-1]
+
+    # A new spell starts unless the gap since the previous leave has no
+    # working days in it; overlapping leaves leave an empty gap
+    gap_days = _working_days(previous_end + 1, starts - 1, calendars)
+    new_spell = ~same_employee | (gap_days > 0)
+    spell_rows = np.flatnonzero(new_spell)
+    spell_starts = starts[spell_rows]
+    spell_ends = np.maximum.reduceat(ends, spell_rows)
+    spell_employees = employees[spell_rows]
+    spell_days = _working_days(spell_starts, spell_ends, calendars[spell_rows])
+
+    # Leave falling entirely on non-working days is not an absence
+    counted = spell_days > 0
+    spell_starts, spell_ends = spell_starts[counted], spell_ends[counted]
+    spell_employees, spell_days = spell_employees[counted], spell_days[counted]
+    monday_friday = (_weekday(spell_starts) == MONDAY) | (_weekday(spell_ends) == FRIDAY)
+
+    count = len(unique_employees)
+    spells = np.bincount(spell_employees, minlength=count)
+    days = np.bincount(spell_employees, weights=spell_days, minlength=count).astype(np.int64)
+    longest_spell = np.zeros(count, dtype=np.int64)
+    np.maximum.at(longest_spell, spell_employees, spell_days)
+    monday_friday_spells = np.bincount(spell_employees, weights=monday_friday, minlength=count).astype(np.int64)
+
+    absent = spells > 0
+    spells, days = spells[absent], days[absent]
+    monday_friday_spells = monday_friday_spells[absent]
+    return {
+        'employee_id': unique_employees[absent],
+        'spells': spells,
+        'days': days,
+        'bradford': spells * spells * days,
+        'longest_spell': longest_spell[absent],
+        'monday_friday_spells': monday_friday_spells,
+        'monday_friday_share': np.round(monday_friday_spells * 100 / spells, 1),
+    }
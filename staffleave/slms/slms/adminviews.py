@@ -4,14 +4,16 @@ from slmsapp.EmailBackEnd import EmailBackEnd
 from django.contrib.auth import  logout,login
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from slmsapp.models import CustomUser,Employee,Employee_Leave,Department,DepartmentHead,SystemSettings,PublicHoliday,CalendarEvent
+from slmsapp.models import CustomUser,Employee,Employee_Leave,Department,DepartmentHead,SystemSettings,PublicHoliday,CalendarEvent,HolidayCalendar
 from .auth_utils import validate_password, get_int_setting
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.urls import reverse
+from django.db import transaction
 from django.db.models import Q
 from .decorators import admin_required
+from .calendar_utils import get_month_holidays
 from datetime import date, timedelta
 from calendar import monthrange
 
@@ -177,17 +179,20 @@ def STAFF_LEAVE_VIEW(request):
 
 @login_required(login_url='/')
 def STAFF_APPROVE_LEAVE(request,id):
-    leave = Employee_Leave.objects.get(id = id)
-    leave.status = 1
-    leave.save()
-    
-    # Update leave balance automatically
     from .leave_utils import update_leave_balance_on_approval
-    update_leave_balance_on_approval(leave)
-    
-    # Send approval notification to employee
     from .notification_utils import notify_leave_approved
-    notify_leave_approved(leave, approved_by_user=request.user)
+    # The notification is queued with the approval, and only if it commits;
+    # the leave stays locked until then so a rejection cannot interleave
+    with transaction.atomic():
+        leave = Employee_Leave.objects.select_for_update().get(id = id)
+        leave.status = 1
+        leave.save()
+        
+        # Update leave balance automatically
+        update_leave_balance_on_approval(leave, user=request.user)
+        
+        # Send approval notification to employee
+        notify_leave_approved(leave, approved_by_user=request.user)
     
     messages.success(request, 'Leave application approved successfully.')
     return redirect('staff_leave_view_admin')
@@ -195,9 +200,15 @@ def STAFF_APPROVE_LEAVE(request,id):
 @login_required(login_url='/')
 @admin_required
 def STAFF_DISAPPROVE_LEAVE(request,id):
-    leave = Employee_Leave.objects.get(id = id)
-    leave.status = 2
-    leave.save()
+    from .leave_utils import revert_leave_balance_on_rejection
+    # The rejection and the reversal commit together, with the leave locked
+    with transaction.atomic():
+        leave = Employee_Leave.objects.select_for_update().get(id = id)
+        leave.status = 2
+        leave.save()
+        
+        # Return any days already debited for an earlier approval
+        revert_leave_balance_on_rejection(leave, user=request.user)
     messages.success(request, 'Leave application rejected successfully.')
     return redirect('staff_leave_view_admin')
 
@@ -757,11 +768,15 @@ def UPDATE_DEPARTMENT(request, id):
     if request.method == "POST":
         department.name = request.POST.get('name')
         department.description = request.POST.get('description')
+        department.holiday_calendar_id = request.POST.get('holiday_calendar') or None
         department.save()
         messages.success(request, 'Department updated successfully')
         return redirect('admin_manage_departments')
     
-    context = {'department': department}
+    context = {
+        'department': department,
+        'holiday_calendars': HolidayCalendar.objects.filter(is_active=True),
+    }
     return render(request, 'admin/update_department.html', context)
 
 
@@ -966,12 +981,8 @@ def ADMIN_CALENDAR(request):
     year = int(request.GET.get('year', date.today().year))
     month = int(request.GET.get('month', date.today().month))
     
-    # Get public holidays for the month
-    public_holidays = PublicHoliday.objects.filter(
-        date__year=year,
-        date__month=month,
-        is_active=True
-    )
+    # Get public holidays for the month (recurring holidays expanded)
+    public_holidays = get_month_holidays(year, month)
     
     # Get calendar events for the month (all active events created by admins)
     calendar_events = CalendarEvent.objects.filter(
@@ -1038,14 +1049,15 @@ def MANAGE_HOLIDAYS(request):
                 name=name,
                 date=holiday_date,
                 description=description,
-                is_recurring=is_recurring
+                is_recurring=is_recurring,
+                calendar_id=request.POST.get('calendar') or None
             )
             messages.success(request, 'Public holiday added successfully')
         
         return redirect('admin_manage_holidays')
     
     current_year = date.today().year
-    holidays = PublicHoliday.objects.all().order_by('date')
+    holidays = PublicHoliday.objects.select_related('calendar').order_by('date')
     
     # Statistics
     total_holidays = holidays.count()
@@ -1058,6 +1070,7 @@ def MANAGE_HOLIDAYS(request):
         'total_holidays': total_holidays,
         'upcoming_holidays': upcoming_holidays,
         'recurring_holidays': recurring_holidays,
+        'holiday_calendars': HolidayCalendar.objects.filter(is_active=True),
     }
     return render(request, 'admin/manage_holidays.html', context)
 
@@ -1074,11 +1087,15 @@ def UPDATE_HOLIDAY(request, id):
         holiday.description = request.POST.get('description', '')
         holiday.is_recurring = request.POST.get('is_recurring') == 'on'
         holiday.is_active = request.POST.get('is_active') == 'on'
+        holiday.calendar_id = request.POST.get('calendar') or None
         holiday.save()
         messages.success(request, 'Holiday updated successfully')
         return redirect('admin_manage_holidays')
     
-    context = {'holiday': holiday}
+    context = {
+        'holiday': holiday,
+        'holiday_calendars': HolidayCalendar.objects.filter(is_active=True),
+    }
     return render(request, 'admin/update_holiday.html', context)
 
 
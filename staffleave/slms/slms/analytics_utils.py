@@ -0,0 +1,552 @@
+"""
+Leave analytics
+
+Builds the KPIs and chart series shown on the analytics dashboards from a
+fixed handful of grouped queries. Counts and day totals are read from
+LeaveMonthlyRollup, which holds one row per month, department, leave type
+and status, so the dashboards do not slow down as the leave table grows;
+only the figures that cannot be summed across rows (distinct employees,
+who is on leave today) are counted from the leaves themselves. The daily
+headcount on leave is built from one read of the approved leaves with a
+difference array.
+
+The rollups are kept current by the Employee_Leave and Employee signals
+calling the functions below, and rebuild_leave_rollups recomputes them
+from scratch. Queryset update() calls on leaves or employees bypass the
+signals and leave the rollups behind until it is run. Deleting a
+department or leave type also clears foreign keys without signals, so
+its rollup rows are merged into the unassigned ones beforehand
+(merge_rollups), which gives the counts a rebuild would.
+
+Both dashboards read through get_dashboard_analytics(), which caches the
+figures per year and scope ('hr' or 'admin') under a version token held in
+the shared cache, the same way compiled holiday calendars are cached. Any
+change to leaves, employees, users, departments, leave types or holidays
+replaces the token, so the next dashboard load recomputes. The token
+starts with the time it was issued, which doubles as the Last-Modified
+date of the JSON chart endpoints.
+"""
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Count, DateField, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Cast, Coalesce, TruncMonth
+from django.utils import timezone
+from slmsapp.models import (
+    CustomUser, Department, Employee, Employee_Leave, LeaveMonthlyRollup, LeaveType, PublicHoliday
+)
+
+
+ANALYTICS_VERSION_KEY = 'slms_analytics_version'
+
+# Cached figures include who is on leave today, so entries are also keyed by
+# date; the timeout only clears out entries nothing will ask for again
+ANALYTICS_CACHE_TIMEOUT = 24 * 60 * 60
+
+PENDING, APPROVED, REJECTED = 0, 1, 2
+
+STATUS_LABELS = ['Approved', 'Pending', 'Rejected']
+STATUS_COLORS = ['#10b981', '#f59e0b', '#ef4444']
+
+USER_TYPE_LABELS = ['Admin', 'Employee', 'Department Head', 'HR']
+USER_TYPE_COLORS = ['#3b82f6', '#10b981', '#f59e0b', '#ef4444']
+
+# Series of each chart endpoint: JSON key -> dashboard figure
+CHART_SERIES = {
+    'monthly': {'labels': 'monthly_labels', 'data': 'monthly_data'},
+    'status': {'labels': 'status_labels', 'data': 'status_data', 'colors': 'status_colors'},
+    'leave-types': {'labels': 'leave_type_labels', 'data': 'leave_type_data'},
+    'departments': {
+        'labels': 'dept_labels', 'total': 'dept_data',
+        'approved': 'dept_approved', 'pending': 'dept_pending', 'rejected': 'dept_rejected',
+    },
+    'user-types': {'labels': 'user_type_labels', 'data': 'user_type_data', 'colors': 'user_type_colors'},
+}
+
+# Label of employees without a department in per-department series
+NO_DEPARTMENT = 'No department'
+
+
+class LeaveTypeCount:
+    """Leave type name and number of applications, as listed in top_leave_types"""
+
+    def __init__(self, id, name, count):
+        self.id = id
+        self.name = name
+        self.count = count
+
+
+def _percentage(part, whole):
+    if whole > 0:
+        return round((part / whole) * 100, 1)
+    return 0
+
+
+def rollup_month(created_at):
+    """First day of the month, in the current time zone, a leave applied at created_at belongs to"""
+    if timezone.is_aware(created_at):
+        created_at = timezone.localtime(created_at)
+    return created_at.date().replace(day=1)
+
+
+def rollup_entry(month, department_id, leave_type_id, status, from_date, to_date, working_days):
+    """((month, department, leave type, status), (calendar days, working days)) a leave counts towards"""
+    from_date = Employee_Leave._meta.get_field('from_date').to_python(from_date)
+    to_date = Employee_Leave._meta.get_field('to_date').to_python(to_date)
+    return (month, department_id, leave_type_id, int(status)), ((to_date - from_date).days + 1, working_days or 0)
+
+
+def leave_rollup_entry(leave):
+    """Rollup entry of a leave instance as it is about to be, or has just been, saved"""
+    return rollup_entry(
+        rollup_month(leave.created_at), leave.employee_id.department_id, leave.leave_type_id,
+        leave.status, leave.from_date, leave.to_date, leave.working_days
+    )
+
+
+def stored_rollup_row(leave_id):
+    """
+    Fields of a leave as currently stored that its rollup entry depends on
+
+    Returns:
+        tuple: (created_at, department, leave type, status, from_date,
+            to_date, working_days), or None if the leave is not stored
+    """
+    return Employee_Leave.objects.filter(pk=leave_id).values_list(
+        'created_at', 'employee_id__department_id', 'leave_type_id', 'status', 'from_date', 'to_date', 'working_days'
+    ).first()
+
+
+def stored_rollup_entry(row):
+    """Rollup entry of a leave from its stored_rollup_row, or None if it is not stored"""
+    if row is None:
+        return None
+    created_at, *fields = row
+    return rollup_entry(rollup_month(created_at), *fields)
+
+
+def add_to_rollup(key, leaves, days, working_days):
+    """
+    Move one rollup row by the given deltas in a single UPDATE statement
+
+    The row is created on first use; concurrent callers never overwrite each
+    other because the database computes the new values from the ones it
+    currently holds, and a caller that loses the race to create the row
+    updates the one the other created.
+    """
+    month, department_id, leave_type_id, status = key
+    row = LeaveMonthlyRollup.objects.filter(
+        month=month, department_id=department_id, leave_type_id=leave_type_id, status=status
+    )
+    deltas = {
+        'leaves': F('leaves') + leaves,
+        'days': F('days') + days,
+        'working_days': F('working_days') + working_days,
+    }
+    if row.update(**deltas):
+        return
+    try:
+        with transaction.atomic():
+            LeaveMonthlyRollup.objects.create(
+                month=month, department_id=department_id, leave_type_id=leave_type_id, status=status,
+                leaves=leaves, days=days, working_days=working_days
+            )
+    except IntegrityError:
+        row.update(**deltas)
+
+
+def merge_rollups(rollups, department=False, leave_type=False):
+    """
+    Fold rollup rows into the ones without a department and/or leave type
+
+    Called before a department or leave type is deleted, in place of
+    letting the foreign key be set to NULL, which would leave two rows for
+    the same unassigned key.
+    """
+    for month, department_id, leave_type_id, status, leaves, days, working_days in rollups.values_list(
+        'month', 'department_id', 'leave_type_id', 'status', 'leaves', 'days', 'working_days'
+    ):
+        key = (month, None if department else department_id, None if leave_type else leave_type_id, status)
+        add_to_rollup(key, leaves, days, working_days)
+    rollups.delete()
+
+
+def move_rollup_entry(previous, current):
+    """Take a leave out of its previous rollup row and count it in the current one"""
+    if previous == current:
+        return
+    if previous is not None:
+        key, (days, working_days) = previous
+        add_to_rollup(key, -1, -days, -working_days)
+    if current is not None:
+        key, (days, working_days) = current
+        add_to_rollup(key, 1, days, working_days)
+
+
+def move_employee_rollups(employee_id, old_department_id, new_department_id):
+    """Move an employee's leaves to another department's rollup rows"""
+    for key, (leaves, days, working_days) in compute_leave_rollups(
+        Employee_Leave.objects.filter(employee_id=employee_id)
+    ).items():
+        month, _, leave_type_id, status = key
+        add_to_rollup((month, old_department_id, leave_type_id, status), -leaves, -days, -working_days)
+        add_to_rollup((month, new_department_id, leave_type_id, status), leaves, days, working_days)
+
+
+def compute_leave_rollups(leaves_qs):
+    """
+    Count leaves into rollup rows with one grouped query
+
+    Returns:
+        dict: {(month, department_id, leave_type_id, status): (leaves, days, working_days)}
+    """
+    rows = (
+        leaves_qs.order_by()
+        .annotate(
+            month=TruncMonth('created_at', output_field=DateField()),
+            department=F('employee_id__department_id'),
+        )
+        .values_list('month', 'department', 'leave_type_id', 'status')
+        .annotate(
+            leaves=Count('id'),
+            span=Sum(ExpressionWrapper(F('to_date') - F('from_date'), output_field=DurationField())),
+            working=Coalesce(Sum('working_days'), 0),
+        )
+    )
+    # Calendar days, inclusive of both ends: the date span plus one per leave
+    return {
+        (month, department_id, leave_type_id, status): (leaves, span.days + leaves, working)
+        for month, department_id, leave_type_id, status, leaves, span, working in rows
+    }
+
+
+def leave_totals(year, today):
+    """Status counts and day totals for leaves applied for in a year"""
+    totals = LeaveMonthlyRollup.objects.filter(month__year=year).aggregate(
+        total=Coalesce(Sum('leaves'), 0),
+        approved=Coalesce(Sum('leaves', filter=Q(status=APPROVED)), 0),
+        pending=Coalesce(Sum('leaves', filter=Q(status=PENDING)), 0),
+        rejected=Coalesce(Sum('leaves', filter=Q(status=REJECTED)), 0),
+        leave_days=Coalesce(Sum('days', filter=Q(status=APPROVED)), 0),
+        working_days=Coalesce(Sum('working_days', filter=Q(status=APPROVED)), 0),
+    )
+    # Distinct employees and who is on leave today cannot be added up from
+    # the rollups; both are index range scans over approved leaves
+    approved = Employee_Leave.objects.filter(status=APPROVED).order_by()
+    totals['employees_with_leave'] = (
+        approved.filter(created_at__year=year).values('employee_id').distinct().count()
+    )
+    totals['on_leave_today'] = approved.filter(to_date__gte=today, from_date__lte=today).count()
+    return totals
+
+
+def monthly_counts(year):
+    """Applications per month of the year, January first"""
+    rows = (
+        LeaveMonthlyRollup.objects.filter(month__year=year)
+        .values('month')
+        .annotate(count=Sum('leaves'))
+        .order_by()
+    )
+    data = [0] * 12
+    for row in rows:
+        data[row['month'].month - 1] += row['count']
+    return data
+
+
+def leave_type_counts(year):
+    """(id, name, applications this year, applications ever) per leave type"""
+    return list(
+        LeaveType.objects.annotate(
+            year_count=Coalesce(Sum('leave_rollups__leaves', filter=Q(leave_rollups__month__year=year)), 0),
+            total_count=Coalesce(Sum('leave_rollups__leaves'), 0),
+        ).order_by('id').values_list('id', 'name', 'year_count', 'total_count')
+    )
+
+
+def department_counts(year):
+    """(name, total, approved, pending, rejected) per department for leaves applied for in a year"""
+    in_year = Q(leave_rollups__month__year=year)
+    return list(
+        Department.objects.annotate(
+            total=Coalesce(Sum('leave_rollups__leaves', filter=in_year), 0),
+            approved=Coalesce(Sum('leave_rollups__leaves', filter=in_year & Q(leave_rollups__status=APPROVED)), 0),
+            pending=Coalesce(Sum('leave_rollups__leaves', filter=in_year & Q(leave_rollups__status=PENDING)), 0),
+            rejected=Coalesce(Sum('leave_rollups__leaves', filter=in_year & Q(leave_rollups__status=REJECTED)), 0),
+        ).order_by('id').values_list('name', 'total', 'approved', 'pending', 'rejected')
+    )
+
+
+def build_leave_analytics(year, today=None):
+    """KPIs and chart series for the analytics dashboards, keyed as in their templates"""
+    today = today or date.today()
+
+    total_employees = Employee.objects.count()
+    totals = leave_totals(year, today)
+    monthly_data = monthly_counts(year)
+    leave_types = leave_type_counts(year)
+    departments = department_counts(year)
+
+    total_leaves_applied = totals['total']
+    approved_leaves = totals['approved']
+    pending_leaves = totals['pending']
+    rejected_leaves = totals['rejected']
+    employees_with_leave = totals['employees_with_leave']
+    total_leave_days = totals['leave_days']
+    total_working_days = totals['working_days']
+
+    avg_leaves_per_employee = 0
+    avg_working_days_per_employee = 0
+    if employees_with_leave > 0:
+        avg_leaves_per_employee = round(approved_leaves / employees_with_leave, 1)
+        avg_working_days_per_employee = round(total_working_days / employees_with_leave, 1)
+
+    # Leave types by applications ever made; ties keep the lowest id first
+    ranked = sorted(leave_types, key=lambda row: -row[3])
+    top_leave_types = [LeaveTypeCount(pk, name, count) for pk, name, _, count in ranked[:5]]
+
+    active_departments = [row for row in departments if row[1] > 0]
+
+    return {
+        # KPIs
+        'total_employees': total_employees,
+        'total_leaves_applied': total_leaves_applied,
+        'approved_leaves': approved_leaves,
+        'pending_leaves': pending_leaves,
+        'rejected_leaves': rejected_leaves,
+        'approval_rate': _percentage(approved_leaves, total_leaves_applied),
+        'pending_percentage': _percentage(pending_leaves, total_leaves_applied),
+        'rejection_rate': _percentage(rejected_leaves, total_leaves_applied),
+        'employees_on_leave_today': totals['on_leave_today'],
+        'total_leave_days': total_leave_days,
+        'total_working_days': total_working_days,
+        'employees_with_leave': employees_with_leave,
+        'avg_leaves_per_employee': avg_leaves_per_employee,
+        'avg_working_days_per_employee': avg_working_days_per_employee,
+        'total_departments': len(departments),
+        'most_common_leave_type': top_leave_types[0] if top_leave_types else None,
+        'active_leave_types_year': sum(1 for row in leave_types if row[2] > 0),
+        'utilization_rate': _percentage(employees_with_leave, total_employees),
+
+        # Chart data
+        'monthly_labels': [date(year, month, 1).strftime('%b') for month in range(1, 13)],
+        'monthly_data': monthly_data,
+        'leave_type_labels': [row[1] for row in leave_types if row[2] > 0],
+        'leave_type_data': [row[2] for row in leave_types if row[2] > 0],
+        'dept_labels': [row[0][:15] for row in active_departments],  # Truncate long names
+        'dept_data': [row[1] for row in active_departments],
+        'dept_approved': [row[2] for row in active_departments],
+        'dept_pending': [row[3] for row in active_departments],
+        'dept_rejected': [row[4] for row in active_departments],
+        'status_labels': STATUS_LABELS,
+        'status_data': [approved_leaves, pending_leaves, rejected_leaves],
+        'status_colors': STATUS_COLORS,
+        'top_leave_types': top_leave_types,
+    }
+
+
+def headcount_on_leave(year):
+    """
+    Number of employees on approved leave on every day of a year, per department
+
+    All approved leaves touching the year are read with one query. Leaves of
+    the same employee that overlap are trimmed so nobody is counted twice on
+    a day, then every leave adds +1 on its first day and -1 after its last
+    in a per-department difference array whose running sum is the headcount.
+
+    Returns:
+        dict: 'labels' (ISO dates), 'total' (headcount per day) and
+        'departments' ([{'name', 'data'}] for departments with anyone on leave)
+    """
+    first, last = date(year, 1, 1), date(year, 12, 31)
+    days = (last - first).days + 1
+    departments = list(Department.objects.order_by('name').values_list('id', 'name'))
+    names = [name for _, name in departments] + [NO_DEPARTMENT]
+    department_index = {department_id: i for i, (department_id, _) in enumerate(departments)}
+    # Dates are read as ISO strings: numpy parses them far faster than the
+    # database driver builds date objects
+    rows = list(
+        Employee_Leave.objects.filter(status=APPROVED, from_date__lte=last, to_date__gte=first)
+        .order_by()
+        .annotate(start=Cast('from_date', CharField()), end=Cast('to_date', CharField()))
+        .values_list('employee_id', 'employee_id__department_id', 'start', 'end')
+    )
+
+    counts = np.zeros((len(names), days), dtype=np.int64)
+    if rows:
+        employee_ids, department_ids, from_dates, to_dates = zip(*rows)
+        origin = np.datetime64(first, 'D')
+        starts = np.clip((np.array(from_dates, dtype='datetime64[D]') - origin).astype(np.int64), 0, days - 1)
+        ends = np.clip((np.array(to_dates, dtype='datetime64[D]') - origin).astype(np.int64), 0, days - 1)
+        _, employees = np.unique(np.array(employee_ids, dtype=np.int64), return_inverse=True)
+        groups = np.array([department_index.get(i, len(departments)) for i in department_ids], dtype=np.int64)
+
+        # Per employee, start each leave after the latest end seen so far.
+        # Offsetting ends by employee keeps one running maximum per employee
+        order = np.lexsort((starts, employees))
+        employees, groups, starts, ends = employees[order], groups[order], starts[order], ends[order]
+        offset = employees * (days + 1)
+        latest_end = np.maximum.accumulate(ends + offset) - offset
+        previous_end = np.full(len(ends), -1, dtype=np.int64)
+        same_employee = employees[1:] == employees[:-1]
+        previous_end[1:][same_employee] = latest_end[:-1][same_employee]
+        starts = np.maximum(starts, previous_end + 1)
+        keep = starts <= ends
+        groups, starts, ends = groups[keep], starts[keep], ends[keep]
+
+        width = days + 1
+        size = len(names) * width
+        diff = (
+            np.bincount(groups * width + starts, minlength=size)
+            - np.bincount(groups * width + ends + 1, minlength=size)
+        )
+        counts = np.cumsum(diff.reshape(len(names), width), axis=1)[:, :days]
+
+    return {
+        'labels': [(first + timedelta(days=day)).isoformat() for day in range(days)],
+        'total': counts.sum(axis=0).tolist(),
+        'departments': [
+            {'name': name, 'data': row.tolist()}
+            for name, row in zip(names, counts) if row.any()
+        ],
+    }
+
+
+def build_admin_analytics(year, today=None):
+    """The HR figures plus the user and configuration counts shown to admins"""
+    analytics = build_leave_analytics(year, today)
+
+    users = CustomUser.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        admin=Count('id', filter=Q(user_type='1')),
+        employee=Count('id', filter=Q(user_type='2')),
+        department_head=Count('id', filter=Q(user_type='3')),
+        hr=Count('id', filter=Q(user_type='4')),
+    )
+    leave_types = LeaveType.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+    )
+    # Admins count employee accounts only, not staff records of other roles
+    total_employees = Employee.objects.filter(admin__user_type='2').count()
+    user_type_data = [users['admin'], users['employee'], users['department_head'], users['hr']]
+
+    analytics.update({
+        # KPIs - User Management
+        'total_employees': total_employees,
+        'total_users': users['total'],
+        'active_users': users['active'],
+        'inactive_users': users['total'] - users['active'],
+        'active_user_rate': _percentage(users['active'], users['total']),
+        'utilization_rate': _percentage(analytics['employees_with_leave'], total_employees),
+
+        # System Configuration
+        'total_leave_types': leave_types['total'],
+        'active_leave_types': leave_types['active'],
+        'total_holidays': PublicHoliday.objects.count(),
+        'admin_count': users['admin'],
+        'employee_count': users['employee'],
+        'dh_count': users['department_head'],
+        'hr_count': users['hr'],
+
+        # Chart data
+        'user_type_labels': USER_TYPE_LABELS,
+        'user_type_data': user_type_data,
+        'user_type_colors': USER_TYPE_COLORS,
+    })
+    return analytics
+
+
+ANALYTICS_BUILDERS = {
+    'hr': build_leave_analytics,
+    'admin': build_admin_analytics,
+}
+
+
+def _new_version():
+    return f'{time.time():.6f}-{uuid.uuid4().hex[:8]}'
+
+
+def get_analytics_version():
+    """Return the current analytics version token, creating one if missing"""
+    version = cache.get(ANALYTICS_VERSION_KEY)
+    if version is None:
+        cache.add(ANALYTICS_VERSION_KEY, _new_version(), None)
+        version = cache.get(ANALYTICS_VERSION_KEY)
+    return version
+
+
+def get_analytics_last_modified():
+    """When the figures behind the current version token last changed"""
+    issued = float(get_analytics_version().split('-', 1)[0])
+    return datetime.fromtimestamp(issued, tz=dt_timezone.utc)
+
+
+def invalidate_analytics():
+    """Discard the cached dashboard figures of every year and scope"""
+    cache.set(ANALYTICS_VERSION_KEY, _new_version(), None)
+
+
+def schedule_analytics_invalidation():
+    """Invalidate now and again once the surrounding transaction commits"""
+    invalidate_analytics()
+    transaction.on_commit(invalidate_analytics)
+
+
+def cached_analytics(name, build):
+    """Return build() for name, computed once per version token and then served from the cache"""
+    key = f'slms_analytics:{get_analytics_version()}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, ANALYTICS_CACHE_TIMEOUT)
+    return value
+
+
+def get_dashboard_analytics(year, scope='hr'):
+    """
+    Dashboard figures for a year, computed once and then served from the cache
+
+    Args:
+        year: Year the leaves were applied in
+        scope: 'hr' or 'admin'
+
+    Returns:
+        dict: Template context keys and values for the dashboard
+    """
+    today = date.today()
+    return cached_analytics(f'{scope}:{year}:{today.isoformat()}', lambda: ANALYTICS_BUILDERS[scope](year, today))
+
+
+def get_headcount_on_leave(year):
+    """headcount_on_leave(), computed once per version token and then served from the cache"""
+    return cached_analytics(f'headcount:{year}', lambda: headcount_on_leave(year))
+
+
+def get_chart_etag(year, scope, chart):
+    """Entity tag of one chart's data; it changes whenever the version token does"""
+    return f'{get_analytics_version()}-{scope}-{year}-{chart}'
+
+
+def get_chart_data(year, scope, chart):
+    """
+    Series of one dashboard chart, ready to be sent as JSON
+
+    Returns:
+        dict or None: None when the chart is not part of the scope's dashboard
+    """
+    if chart == 'headcount':
+        data = dict(get_headcount_on_leave(year))
+    else:
+        series = CHART_SERIES.get(chart)
+        analytics = get_dashboard_analytics(year, scope)
+        if series is None or any(name not in analytics for name in series.values()):
+            return None
+        data = {key: analytics[name] for key, name in series.items()}
+    data['version'] = get_analytics_version()
+    return data
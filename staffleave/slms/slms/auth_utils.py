@@ -16,12 +16,16 @@ def get_int_setting(key, default=0):
         return default
 
 
-def validate_password(password):
+def validate_password(password, min_len=None):
     """Validate password against system rules: minimum length and complexity.
 
+    min_len overrides the password_min_length setting, so callers checking
+    many passwords can read it once.
+
     Returns: (is_valid: bool, message: str)
     """
-    min_len = get_int_setting('password_min_length', 8)
+    if min_len is None:
+        min_len = get_int_setting('password_min_length', 8)
     if not password or len(password) < min_len:
         return False, f'Password must be at least {min_len} characters long.'
 
@@ -0,0 +1,378 @@
+"""
+Compiled working-day calendars
+
+Every holiday calendar (plus the default calendar used by departments
+without one) is compiled once per year into a per-day working bitmap and
+its prefix sums, so counting the working days between two dates is a pair
+of array lookups regardless of how long the range is or how many calendars
+exist. A calendar's holidays are the ones assigned to it plus the ones
+observed everywhere, and its work week comes from its own
+working_days_per_week or the system-wide setting.
+
+Recurring holidays are expanded into every year they apply to while
+compiling, and the expanded holidays are what the calendar pages display.
+Compiled years are memoised per process and tagged with a version token
+held in the shared cache; any change to holidays, calendars, department
+assignments or the work-week setting replaces the token so every worker
+recompiles lazily on its next lookup.
+"""
+import uuid
+from array import array
+from collections import namedtuple
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from slmsapp.models import Department, HolidayCalendar, PublicHoliday, SystemSettings
+
+
+CALENDAR_VERSION_KEY = 'slms_holiday_calendar_version'
+
+# Monday to Friday unless the working_days_per_week setting says otherwise
+DEFAULT_WORKING_DAYS_PER_WEEK = 5
+
+# Process-local memo, valid for _memo_version only:
+#   _compiled_years: {(calendar_id, year): CompiledYear}
+#   _rules: work weeks and department assignments, see _get_rules()
+_compiled_years = {}
+_rules = None
+_memo_version = None
+
+
+# A holiday as it falls in one particular year. Recurring holidays produce
+# one occurrence per year; templates read .name and .date as on the model.
+HolidayOccurrence = namedtuple(
+    'HolidayOccurrence', ['date', 'name', 'description', 'is_recurring', 'holiday_id']
+)
+
+
+class CompiledYear:
+    """Working-day bitmap, prefix sums and expanded holidays for one calendar year"""
+
+    def __init__(self, year, occurrences, weekend_days):
+        self.year = year
+        self.occurrences = occurrences
+        self.holidays = frozenset(occurrences)
+        self.start = date(year, 1, 1)
+        length = (date(year + 1, 1, 1) - self.start).days
+
+        self.flags = bytearray(length)
+        self.prefix = array('l', [0]) * (length + 1)
+
+        weekday = self.start.weekday()
+        running = 0
+        for offset in range(length):
+            if weekday not in weekend_days and (self.start + timedelta(days=offset)) not in self.holidays:
+                self.flags[offset] = 1
+                running += 1
+            self.prefix[offset + 1] = running
+            weekday = (weekday + 1) % 7
+
+        self.total = running
+
+    def is_working_day(self, day):
+        return bool(self.flags[(day - self.start).days])
+
+    def count(self, from_date, to_date):
+        """Working days from from_date to to_date inclusive (both within this year)"""
+        return self.prefix[(to_date - self.start).days + 1] - self.prefix[(from_date - self.start).days]
+
+
+def get_calendar_version():
+    """Return the current calendar version token, creating one if missing"""
+    version = cache.get(CALENDAR_VERSION_KEY)
+    if version is None:
+        cache.add(CALENDAR_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CALENDAR_VERSION_KEY)
+    return version
+
+
+def invalidate_holiday_calendar():
+    """
+    Discard every compiled calendar in every process
+
+    Called whenever holidays or calendar rules change. The local memo is
+    dropped straight away and other processes notice the new token on their
+    next lookup.
+    """
+    global _rules, _memo_version
+    cache.set(CALENDAR_VERSION_KEY, uuid.uuid4().hex, None)
+    _compiled_years.clear()
+    _rules = None
+    _memo_version = None
+
+
+def schedule_calendar_invalidation():
+    """Invalidate now and again once the surrounding transaction commits"""
+    invalidate_holiday_calendar()
+    transaction.on_commit(invalidate_holiday_calendar)
+
+
+def _sync_memo():
+    global _rules, _memo_version
+    version = get_calendar_version()
+    if version != _memo_version:
+        _compiled_years.clear()
+        _rules = None
+        _memo_version = version
+
+
+def _parse_working_days(value):
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_WORKING_DAYS_PER_WEEK
+    return days if 0 <= days <= 7 else DEFAULT_WORKING_DAYS_PER_WEEK
+
+
+def _get_rules():
+    """
+    Work weeks per calendar and calendar per department, loaded once per version
+
+    Returns:
+        dict: {'working_days': {calendar_id or None: int},
+               'departments': {department_id: calendar_id}}
+    """
+    global _rules
+    _sync_memo()
+    if _rules is None:
+        default_days = _parse_working_days(
+            SystemSettings.objects.filter(key='working_days_per_week').values_list('value', flat=True).first()
+        )
+        working_days = {None: default_days}
+        for calendar_id, days in HolidayCalendar.objects.filter(is_active=True).values_list('id', 'working_days_per_week'):
+            working_days[calendar_id] = default_days if days is None else _parse_working_days(days)
+
+        departments = dict(
+            Department.objects.filter(
+                holiday_calendar__is_active=True
+            ).values_list('id', 'holiday_calendar_id')
+        )
+        _rules = {'working_days': working_days, 'departments': departments}
+    return _rules
+
+
+def _resolve_calendar(calendar_id):
+    """Fall back to the default calendar for unknown or inactive calendars"""
+    return calendar_id if calendar_id in _get_rules()['working_days'] else None
+
+
+def get_weekend_days(calendar_id=None):
+    """Weekday numbers (Monday=0) that are not working days in a calendar"""
+    working_days = _get_rules()['working_days'][_resolve_calendar(calendar_id)]
+    return frozenset(range(working_days, 7))
+
+
+def get_weekmask(calendar_id=None):
+    """A calendar's work week in numpy busday form, Monday first"""
+    weekend_days = get_weekend_days(calendar_id)
+    return ''.join('0' if day in weekend_days else '1' for day in range(7))
+
+
+def calendar_for_department(department_id):
+    """
+    Holiday calendar id used by a department
+
+    Args:
+        department_id: Department primary key or None
+
+    Returns:
+        int or None: Calendar id, None for the default calendar
+    """
+    if department_id is None:
+        return None
+    return _get_rules()['departments'].get(department_id)
+
+
+def calendar_for_employee(employee):
+    """
+    Holiday calendar id that applies to an employee, via their department
+
+    Args:
+        employee: Employee instance or None
+
+    Returns:
+        int or None: Calendar id, None for the default calendar
+    """
+    if employee is None:
+        return None
+    return calendar_for_department(employee.department_id)
+
+
+def _recurrence_in(holiday_date, year):
+    """The date a recurring holiday falls on in a given year, or None"""
+    try:
+        return holiday_date.replace(year=year)
+    except ValueError:
+        # 29 February has no occurrence in common years
+        return None
+
+
+def _load_holidays(first_year, last_year, calendar_id):
+    """
+    Active holidays of a calendar for a span of years in one query, expanded per year
+
+    Recurring holidays repeat on the same day and month in every year from
+    the year they were entered. A dated holiday wins over a recurring one
+    that lands on the same day.
+
+    Returns:
+        dict: {year: {date: HolidayOccurrence}}
+    """
+    in_calendar = Q(calendar__isnull=True)
+    if calendar_id is not None:
+        in_calendar |= Q(calendar_id=calendar_id)
+
+    by_year = {year: {} for year in range(first_year, last_year + 1)}
+    holidays = PublicHoliday.objects.filter(
+        Q(date__year__gte=first_year, date__year__lte=last_year) |
+        Q(is_recurring=True, date__year__lt=first_year),
+        in_calendar,
+        is_active=True
+    ).values_list('id', 'date', 'name', 'description', 'is_recurring').order_by('-is_recurring', 'date')
+
+    for holiday_id, holiday_date, name, description, is_recurring in holidays:
+        if is_recurring:
+            years = range(max(first_year, holiday_date.year), last_year + 1)
+        else:
+            years = (holiday_date.year,)
+        for year in years:
+            occurs_on = _recurrence_in(holiday_date, year)
+            if occurs_on is not None:
+                by_year[year][occurs_on] = HolidayOccurrence(
+                    occurs_on, name, description, is_recurring, holiday_id
+                )
+    return by_year
+
+
+def compile_years(first_year, last_year, calendar_id=None):
+    """
+    Make sure every year in a span is compiled, loading missing years at once
+
+    Args:
+        first_year: First calendar year (int)
+        last_year: Last calendar year (int), inclusive
+        calendar_id: HolidayCalendar id, None for the default calendar
+
+    Returns:
+        list: CompiledYear objects in year order
+    """
+    calendar_id = _resolve_calendar(calendar_id)
+    missing = [
+        year for year in range(first_year, last_year + 1)
+        if (calendar_id, year) not in _compiled_years
+    ]
+    if missing:
+        weekend_days = get_weekend_days(calendar_id)
+        for year, occurrences in _load_holidays(missing[0], missing[-1], calendar_id).items():
+            if (calendar_id, year) not in _compiled_years:
+                _compiled_years[(calendar_id, year)] = CompiledYear(year, occurrences, weekend_days)
+    return [_compiled_years[(calendar_id, year)] for year in range(first_year, last_year + 1)]
+
+
+def get_compiled_year(year, calendar_id=None):
+    """
+    Get the compiled calendar for a year, building it on first use
+
+    Args:
+        year: Calendar year (int)
+        calendar_id: HolidayCalendar id, None for the default calendar
+
+    Returns:
+        CompiledYear: Bitmap, prefix sums and holidays for the year
+    """
+    calendar_id = _resolve_calendar(calendar_id)
+    compiled = _compiled_years.get((calendar_id, year))
+    if compiled is None:
+        compiled = compile_years(year, year, calendar_id)[0]
+    return compiled
+
+
+def get_holiday_dates(first_year, last_year, calendar_id=None):
+    """
+    Sorted list of a calendar's holiday dates for a span of years
+
+    Args:
+        first_year: First calendar year (int)
+        last_year: Last calendar year (int), inclusive
+        calendar_id: HolidayCalendar id, None for the default calendar
+
+    Returns:
+        list: date objects in ascending order
+    """
+    holidays = []
+    for compiled in compile_years(first_year, last_year, calendar_id):
+        holidays.extend(compiled.holidays)
+    return sorted(holidays)
+
+
+def get_month_holidays(year, month, calendar_id=None):
+    """
+    Holidays falling in a month, with recurring holidays expanded
+
+    Args:
+        year: Calendar year (int)
+        month: Month number (1-12)
+        calendar_id: HolidayCalendar id, None for the default calendar
+
+    Returns:
+        list: HolidayOccurrence objects ordered by date
+    """
+    occurrences = get_compiled_year(year, calendar_id).occurrences
+    return sorted(
+        (occurrence for day, occurrence in occurrences.items() if day.month == month),
+        key=lambda occurrence: occurrence.date
+    )
+
+
+def count_working_days(from_date, to_date, calendar_id=None):
+    """
+    Count working days between two dates inclusive in constant time
+
+    Args:
+        from_date: Start date
+        to_date: End date
+        calendar_id: HolidayCalendar id, None for the default calendar
+
+    Returns:
+        int: Number of working days (0 if the range is empty)
+    """
+    if from_date > to_date:
+        return 0
+
+    if from_date.year == to_date.year:
+        return get_compiled_year(from_date.year, calendar_id).count(from_date, to_date)
+
+    years = compile_years(from_date.year, to_date.year, calendar_id)
+    total = years[0].count(from_date, date(from_date.year, 12, 31))
+    for compiled in years[1:-1]:
+        total += compiled.total
+    total += years[-1].count(date(to_date.year, 1, 1), to_date)
+    return total
+
+
+def count_working_days_by_year(from_date, to_date, calendar_id=None):
+    """
+    Count working days between two dates inclusive, split by calendar year
+
+    Args:
+        from_date: Start date
+        to_date: End date
+        calendar_id: HolidayCalendar id, None for the default calendar
+
+    Returns:
+        dict: {year: working days}, only years with at least one working day
+    """
+    if from_date > to_date:
+        return {}
+
+    by_year = {}
+    for compiled in compile_years(from_date.year, to_date.year, calendar_id):
+        days = compiled.count(
+            max(from_date, date(compiled.year, 1, 1)),
+            min(to_date, date(compiled.year, 12, 31))
+        )
+        if days:
+            by_year[compiled.year] = days
+    return by_year
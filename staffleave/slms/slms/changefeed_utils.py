@@ -0,0 +1,155 @@
+"""
+Change feed for payroll and warehouse sync
+
+Rows of leave applications, leave balances and employees that changed
+since a cursor, oldest change first. A cursor is the updated_at time (in
+microseconds since the epoch) and primary key of the last row a consumer
+has seen, e.g. '1760745600000000-42'; every page is a keyset query on the
+(updated_at, id) indexes, so reading the next page costs the same however
+far into the table the consumer is.
+
+Rows changed in the last CHANGE_FEED_SETTLE_TIME are held back until
+then: a transaction that is still open may commit rows stamped before
+others that are already visible, and a cursor must never move past them.
+
+Deleted rows are not part of the feed; consumers needing deletions should
+reconcile ids with a full export from time to time.
+"""
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from slmsapp.models import Employee, Employee_Leave, LeaveBalance
+
+
+CHANGE_FEED_SETTLE_TIME = timedelta(seconds=30)
+
+CHANGE_FEED_PAGE_SIZE = 1000
+CHANGE_FEED_MAX_PAGE_SIZE = 5000
+
+# Feed name -> (model, {output field: field lookup or expression})
+CHANGE_FEEDS = {
+    'leaves': (Employee_Leave, {
+        'id': 'id',
+        'employee': 'employee_id',
+        'employee_code': 'employee_id__employee_id',
+        'leave_type': 'leave_type_id',
+        'leave_type_name': Coalesce('leave_type__name', 'leave_type_name'),
+        'from_date': 'from_date',
+        'to_date': 'to_date',
+        'working_days': 'working_days',
+        'status': 'status',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }),
+    'balances': (LeaveBalance, {
+        'id': 'id',
+        'employee': 'employee_id',
+        'employee_code': 'employee__employee_id',
+        'leave_type': 'leave_type_id',
+        'leave_type_name': 'leave_type__name',
+        'year': 'year',
+        'days_entitled': 'days_entitled',
+        'days_used': 'days_used',
+        'days_remaining': 'days_remaining',
+        'updated_at': 'updated_at',
+    }),
+    'employees': (Employee, {
+        'id': 'id',
+        'employee_code': 'employee_id',
+        'username': 'admin__username',
+        'first_name': 'admin__first_name',
+        'last_name': 'admin__last_name',
+        'email': 'admin__email',
+        'is_active': 'admin__is_active',
+        'department': 'department_id',
+        'department_name': 'department__name',
+        'employee_type': 'employee_type',
+        'date_of_joining': 'date_of_joining',
+        'updated_at': 'updated_at',
+    }),
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(updated_at, pk):
+    """Cursor pointing just past the row with this updated_at and primary key"""
+    delta = updated_at - _EPOCH
+    return f'{(delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds}-{pk}'
+
+
+def decode_cursor(cursor):
+    """
+    (updated_at, pk) of a cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    microseconds, _, pk = cursor.partition('-')
+    if not microseconds.isdigit() or not pk.isdigit():
+        raise ValueError(f'Invalid change feed cursor "{cursor}"')
+    return _EPOCH + timedelta(microseconds=int(microseconds)), int(pk)
+
+
+def read_changes(feed, cursor=None, limit=CHANGE_FEED_PAGE_SIZE, until=None):
+    """
+    One page of rows changed after a cursor
+
+    Args:
+        feed: Name in CHANGE_FEEDS
+        cursor: Cursor returned with the previous page, None to start from
+            the beginning
+        limit: Maximum number of rows
+        until: Latest updated_at to include; defaults to now less
+            CHANGE_FEED_SETTLE_TIME
+
+    Returns:
+        tuple: (rows as dicts, cursor to pass for the next page, whether
+            more rows are waiting). The cursor is the one passed in when
+            the page is empty.
+
+    Raises:
+        KeyError: If the feed does not exist
+        ValueError: If the cursor is malformed
+    """
+    model, fields = CHANGE_FEEDS[feed]
+    if until is None:
+        until = timezone.now() - CHANGE_FEED_SETTLE_TIME
+
+    rows = model.objects.filter(updated_at__lte=until)
+    if cursor:
+        updated_at, pk = decode_cursor(cursor)
+        # One range scan of the index in order, rather than an OR the
+        # database would have to merge and sort before applying the limit
+        rows = rows.filter(updated_at__gte=updated_at).exclude(updated_at=updated_at, pk__lte=pk)
+    rows = [
+        dict(zip(fields, values))
+        for values in rows.order_by('updated_at', 'pk').values_list(*fields.values())[:limit + 1]
+    ]
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        cursor = encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+    return rows, cursor, has_more
+
+
+def iter_changes(feed, cursor=None, page_size=CHANGE_FEED_PAGE_SIZE, until=None):
+    """Yield (row, cursor after it) for every change after a cursor, one page per query"""
+    # The cut-off is fixed up front so a long export ends
+    until = until or timezone.now() - CHANGE_FEED_SETTLE_TIME
+    while True:
+        rows, next_cursor, has_more = read_changes(feed, cursor, page_size, until)
+        for row in rows:
+            yield row, encode_cursor(row['updated_at'], row['id'])
+        if not has_more:
+            return
+        cursor = next_cursor
+
+
+def change_line(feed, row, cursor):
+    """A change as one line of JSONL"""
+    return json.dumps({'feed': feed, 'cursor': cursor, 'data': row}, cls=DjangoJSONEncoder) + '\n'
@@ -21,6 +21,26 @@ def no_cache(view_func):
         return response
     return wrapper
 
+def allow_revalidation(view_func):
+    """
+    Decorator to let browsers keep a copy of the response and revalidate it.
+    Meant for views that answer conditional requests (ETag/Last-Modified) with
+    304 Not Modified. The response is still private and checked with the
+    server on every use, so it is never shown after logout.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        response.allow_revalidation = True
+        return response
+    return wrapper
+
+def revalidation_headers(response):
+    """Set the headers of a response marked by allow_revalidation"""
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Cookie'
+    return response
+
 def role_required(*allowed_roles):
     """
     Decorator to check if user has required role(s)
@@ -40,6 +60,8 @@ def role_required(*allowed_roles):
                 return redirect('login')
             
             response = view_func(request, *args, **kwargs)
+            if getattr(response, 'allow_revalidation', False):
+                return revalidation_headers(response)
             # Apply aggressive no-cache headers to prevent browser caching
             response['Cache-Control'] = 'no-cache, no-store, must-revalidate, private, max-age=0, post-check=0, pre-check=0'
             response['Pragma'] = 'no-cache'
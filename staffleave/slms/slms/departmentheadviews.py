@@ -1,13 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.db.models import Q
 from datetime import datetime, date, timedelta
 from calendar import monthrange
 from slmsapp.models import (
-    CustomUser, Employee, Employee_Leave, Department, DepartmentHead, LeaveType, PublicHoliday, CalendarEvent
+    CustomUser, Employee, Employee_Leave, Department, DepartmentHead, LeaveType, CalendarEvent
 )
 from .decorators import department_head_required
+from .calendar_utils import calendar_for_department, get_month_holidays
 
 
 @login_required(login_url='/')
@@ -94,37 +96,42 @@ def APPROVE_LEAVE(request, id):
     """Approve a leave application"""
     try:
         dept_head = DepartmentHead.objects.get(admin=request.user)
-        leave = get_object_or_404(Employee_Leave, id=id)
-        
-        # Verify the leave belongs to staff in this department
-        if leave.employee_id.department != dept_head.department:
-            messages.error(request, 'You can only approve leaves from your department.')
-            return redirect('dh_review_leaves')
-        
-        if leave.status != 0:
-            messages.warning(request, 'This leave application has already been processed.')
-            return redirect('dh_review_leaves')
-        
         # Get approval comment if provided
         approval_comment = request.POST.get('approval_comment', '') if request.method == 'POST' else ''
         
-        leave.status = 1
-        leave.approved_by_department_head = request.user
-        if approval_comment:
-            leave.dh_approval_comment = approval_comment
-        leave.save()
-        
-        # Update leave balance automatically
         from .leave_utils import update_leave_balance_on_approval
-        if update_leave_balance_on_approval(leave):
+        from .notification_utils import notify_leave_approved
+        # The notification is queued with the approval, and only if it commits;
+        # the leave stays locked until then so a rejection cannot interleave
+        with transaction.atomic():
+            leave = get_object_or_404(Employee_Leave.objects.select_for_update(), id=id)
+            
+            # Verify the leave belongs to staff in this department
+            if leave.employee_id.department != dept_head.department:
+                messages.error(request, 'You can only approve leaves from your department.')
+                return redirect('dh_review_leaves')
+            
+            if leave.status != 0:
+                messages.warning(request, 'This leave application has already been processed.')
+                return redirect('dh_review_leaves')
+            
+            leave.status = 1
+            leave.approved_by_department_head = request.user
+            if approval_comment:
+                leave.dh_approval_comment = approval_comment
+            leave.save()
+            
+            # Update leave balance automatically
+            balance_updated = update_leave_balance_on_approval(leave, user=request.user)
+            
+            # Send approval notification to employee
+            notify_leave_approved(leave, approved_by_user=request.user)
+        
+        if balance_updated:
             messages.success(request, f'Leave application from {leave.employee_id.admin.get_full_name()} has been approved and leave balance updated.')
         else:
             messages.success(request, f'Leave application from {leave.employee_id.admin.get_full_name()} has been approved.')
         
-        # Send approval notification to employee
-        from .notification_utils import notify_leave_approved
-        notify_leave_approved(leave, approved_by_user=request.user)
-        
         return redirect('dh_review_leaves')
     except DepartmentHead.DoesNotExist:
         messages.error(request, 'Department Head profile not found.')
@@ -183,12 +190,8 @@ def DEPARTMENTAL_CALENDAR(request):
         year = int(request.GET.get('year', date.today().year))
         month = int(request.GET.get('month', date.today().month))
         
-        # Get public holidays for the month
-        public_holidays = PublicHoliday.objects.filter(
-            date__year=year,
-            date__month=month,
-            is_active=True
-        )
+        # Get public holidays for the month from the department's calendar
+        public_holidays = get_month_holidays(year, month, calendar_for_department(department.id))
         
         # Get calendar events for the month (all active events created by admins)
         calendar_events = CalendarEvent.objects.filter(
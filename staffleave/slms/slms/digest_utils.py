@@ -0,0 +1,181 @@
+"""
+Email digests of unread notifications
+
+Users who opt in (CustomUser.digest_frequency) get one email per hour or
+per day listing the notifications they have not read yet, instead of an
+email per notification.
+
+A run covers the period that ended at the last full hour or midnight.
+Subscribers are read DIGEST_BATCH_SIZE at a time by id (keyset
+pagination), together with their notifications for the period, so memory
+stays flat however many users there are. Every digest of the run goes
+out over one mail connection, a page of messages at a time, and each
+page of users is marked with the end of the period once sent: running
+the job twice for the same period sends nothing the second time.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.text import Truncator
+from slmsapp.models import CustomUser, Notification
+
+DIGEST_BATCH_SIZE = 500
+# Notifications listed in one digest; the rest are only counted
+DIGEST_MAX_ITEMS = 20
+
+DIGEST_PERIODS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+}
+
+
+def digest_period(frequency, now=None):
+    """
+    Start and end of the last full period for a digest frequency
+
+    Returns:
+        tuple: (start, end) aware datetimes
+    """
+    now = timezone.localtime(now or timezone.now())
+    end = now.replace(minute=0, second=0, microsecond=0)
+    if frequency == 'daily':
+        end = end.replace(hour=0)
+    elif frequency != 'hourly':
+        raise ValueError(f'Unknown digest frequency "{frequency}"')
+    return end - DIGEST_PERIODS[frequency], end
+
+
+def _subscriber_pages(frequency, end, batch_size):
+    """Subscribers due a digest for the period ending at end, batch_size at a time"""
+    users = (
+        CustomUser.objects
+        .filter(digest_frequency=frequency, is_active=True)
+        .exclude(email='')
+        .exclude(digest_sent_through__gte=end)
+        .order_by('id')
+        .only('id', 'username', 'first_name', 'email', 'digest_sent_through')
+    )
+    last_id = 0
+    while True:
+        page = list(users.filter(id__gt=last_id)[:batch_size])
+        if not page:
+            return
+        yield page
+        last_id = page[-1].id
+
+
+def _unread_by_recipient(users, start, end):
+    """
+    Unread notifications of the period for a page of users, newest first
+
+    Each user's period starts where their last digest ended, or at start
+    if they have not had one.
+    """
+    notifications = (
+        Notification.objects
+        .filter(
+            recipient_id__in=[user.id for user in users],
+            is_read=False,
+            is_active=True,
+            created_at__gte=Coalesce(F('recipient__digest_sent_through'), Value(start)),
+            created_at__lt=end,
+        )
+        .select_related('broadcast', 'sender')
+        .order_by('recipient_id', '-created_at')
+    )
+    by_recipient = {}
+    for notification in notifications:
+        by_recipient.setdefault(notification.recipient_id, []).append(notification)
+    return by_recipient
+
+
+def _period_label(frequency, start, end):
+    start, end = timezone.localtime(start), timezone.localtime(end)
+    if frequency == 'daily':
+        return f"{start:%A, %B} {start.day}"
+    return f"{start:%b} {start.day}, {start:%H:%M} to {end:%H:%M}"
+
+
+def build_digest(user, notifications, period_label):
+    """
+    The digest email for one user
+
+    Args:
+        user: CustomUser receiving the digest
+        notifications: Their unread notifications, newest first
+        period_label: The period covered, as shown in the email
+
+    Returns:
+        EmailMessage: Not yet sent
+    """
+    total = len(notifications)
+    plural = '' if total == 1 else 's'
+    lines = [
+        f"Hello {user.first_name or user.username},",
+        "",
+        f"You have {total} unread notification{plural} from {period_label}:",
+        "",
+    ]
+    for notification in notifications[:DIGEST_MAX_ITEMS]:
+        sender = notification.sender.get_full_name() or notification.sender.username
+        created_at = timezone.localtime(notification.created_at)
+        lines.append(
+            f"- {notification.title} ({notification.get_notification_type_display()}, "
+            f"from {sender}, {created_at:%b} {created_at.day}, {created_at:%H:%M})"
+        )
+        lines.append(f"  {Truncator(notification.message).chars(200)}")
+    if total > DIGEST_MAX_ITEMS:
+        lines.append(f"...and {total - DIGEST_MAX_ITEMS} more.")
+    lines += [
+        "",
+        "Sign in to HarmonyLeave to read them. You can change how often you get this email on your profile page.",
+        "",
+        "This is an automated message. Please do not reply to this email.",
+    ]
+    subject = f"{total} unread notification{plural} - HarmonyLeave (E/SLMS)"
+    return EmailMessage(subject, "\n".join(lines), settings.DEFAULT_FROM_EMAIL, [user.email])
+
+
+def send_digests(frequency, now=None, batch_size=DIGEST_BATCH_SIZE):
+    """
+    Email every subscriber of a frequency their digest for the last period
+
+    Users without unread notifications in the period get no email but are
+    still marked as done for it.
+
+    Args:
+        frequency: 'hourly' or 'daily'
+        now: Current time (for tests)
+        batch_size: Users read, and emails handed to the connection, at a time
+
+    Returns:
+        tuple: (users checked, digests sent)
+    """
+    start, end = digest_period(frequency, now)
+    period_label = _period_label(frequency, start, end)
+    checked = sent = 0
+    connection = None
+    try:
+        for users in _subscriber_pages(frequency, end, batch_size):
+            by_recipient = _unread_by_recipient(users, start, end)
+            messages = []
+            for user in users:
+                notifications = by_recipient.get(user.id)
+                if notifications:
+                    messages.append(build_digest(user, notifications, period_label))
+            if messages:
+                if connection is None:
+                    # One connection for the whole run, like send_mass_mail
+                    connection = get_connection()
+                    connection.open()
+                sent += connection.send_messages(messages) or 0
+            CustomUser.objects.filter(id__in=[user.id for user in users]).update(digest_sent_through=end)
+            checked += len(users)
+    finally:
+        if connection is not None:
+            connection.close()
+    return checked, sent
@@ -0,0 +1,140 @@
+"""
+CSV exports
+
+Leave applications, balances and entitlements are written to CSV as they
+are read. Each export is one query projecting only the columns it needs
+through the joins, read with .iterator() so rows never pile up in memory,
+and streamed to the client with StreamingHttpResponse, so the download
+starts straight away and a million-row export costs no more memory than a
+small one. Rows come out in primary key order, which the database can
+return without sorting first, and dates are formatted by the database so
+no row goes through Django's per-value type converters.
+
+Text that a spreadsheet would read as a formula (starting with =, +, -,
+@, a tab or a carriage return) is written with a leading ' so that names
+typed by users cannot run formulas in whoever opens the export.
+"""
+import csv
+import io
+from datetime import date
+
+from django.db.models import CharField
+from django.db.models.functions import Cast, Coalesce, TruncDate
+from django.http import StreamingHttpResponse
+from slmsapp.models import Employee_Leave, LeaveBalance, LeaveEntitlement
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Values of the status filter on the leave review screens
+STATUS_FILTERS = {'pending': 0, 'approved': 1, 'rejected': 2}
+
+STATUS_NAMES = dict(Employee_Leave.STATUS_CHOICES)
+
+LEAVE_HEADER = [
+    'Leave ID', 'Employee ID', 'First Name', 'Last Name', 'Department', 'Leave Type',
+    'From', 'To', 'Working Days', 'Status', 'Applied On',
+]
+BALANCE_HEADER = [
+    'Employee ID', 'First Name', 'Last Name', 'Department', 'Leave Type', 'Year',
+    'Days Entitled', 'Days Used', 'Days Remaining',
+]
+ENTITLEMENT_HEADER = [
+    'Employee ID', 'First Name', 'Last Name', 'Department', 'Leave Type', 'Year', 'Days Entitled',
+]
+
+# First characters that make a spreadsheet evaluate a cell
+FORMULA_PREFIXES = frozenset('=+-@\t\r')
+
+
+def _escape_formula(value):
+    if isinstance(value, str) and value[:1] in FORMULA_PREFIXES:
+        return "'" + value
+    return value
+
+
+def csv_response(filename, header, rows):
+    """Stream the header and rows as a CSV attachment, one block of rows at a time"""
+    def blocks():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for count, row in enumerate(rows, 1):
+            writer.writerow([_escape_formula(value) for value in row])
+            if count % EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    response = StreamingHttpResponse(blocks(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _stream(queryset, *fields):
+    return queryset.order_by('id').values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def leave_rows(status=None, year=None, department_id=None, leave_type_id=None):
+    """
+    Leave applications as CSV rows
+
+    Args:
+        status: 'pending', 'approved' or 'rejected'; anything else exports all
+        year: Only leaves with a day in this year
+        department_id: Only leaves of employees in this department
+        leave_type_id: Only leaves of this type
+    """
+    leaves = Employee_Leave.objects.all()
+    if status in STATUS_FILTERS:
+        leaves = leaves.filter(status=STATUS_FILTERS[status])
+    if year:
+        leaves = leaves.filter(from_date__lte=date(year, 12, 31), to_date__gte=date(year, 1, 1))
+    if department_id:
+        leaves = leaves.filter(employee_id__department_id=department_id)
+    if leave_type_id:
+        leaves = leaves.filter(leave_type_id=leave_type_id)
+
+    leaves = leaves.annotate(
+        type_name=Coalesce('leave_type__name', 'leave_type_name'),
+        start=Cast('from_date', CharField()),
+        end=Cast('to_date', CharField()),
+        applied_on=Cast(TruncDate('created_at'), CharField()),
+    )
+    for row in _stream(
+        leaves, 'id', 'employee_id__employee_id', 'employee_id__admin__first_name',
+        'employee_id__admin__last_name', 'employee_id__department__name', 'type_name',
+        'start', 'end', 'working_days', 'status', 'applied_on'
+    ):
+        *fields, status, applied_on = row
+        yield [*fields, STATUS_NAMES.get(status, status), applied_on]
+
+
+def _balance_filters(queryset, year, department_id, leave_type_id):
+    if year:
+        queryset = queryset.filter(year=year)
+    if department_id:
+        queryset = queryset.filter(employee__department_id=department_id)
+    if leave_type_id:
+        queryset = queryset.filter(leave_type_id=leave_type_id)
+    return queryset
+
+
+def balance_rows(year=None, department_id=None, leave_type_id=None):
+    """Leave balances as CSV rows, filtered like the entitlements screen"""
+    return _stream(
+        _balance_filters(LeaveBalance.objects.all(), year, department_id, leave_type_id),
+        'employee__employee_id', 'employee__admin__first_name', 'employee__admin__last_name',
+        'employee__department__name', 'leave_type__name', 'year',
+        'days_entitled', 'days_used', 'days_remaining'
+    )
+
+
+def entitlement_rows(year=None, department_id=None, leave_type_id=None):
+    """Leave entitlements as CSV rows, filtered like the entitlements screen"""
+    return _stream(
+        _balance_filters(LeaveEntitlement.objects.all(), year, department_id, leave_type_id),
+        'employee__employee_id', 'employee__admin__first_name', 'employee__admin__last_name',
+        'employee__department__name', 'leave_type__name', 'year', 'days_entitled'
+    )
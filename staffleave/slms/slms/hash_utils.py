@@ -0,0 +1,36 @@
+"""
+Password hashing across processes
+
+Password hashers are deliberately slow, so hashing thousands of passwords
+for a bulk import is spread over a process pool. This module imports no
+models, so worker processes started with "spawn" can load it before
+Django is set up.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+
+
+def _setup_worker():
+    import django
+    django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hash many passwords, in parallel where more than one CPU is available
+
+    Args:
+        passwords: Raw passwords; None gives an unusable password
+        workers: Number of worker processes (default: one per CPU)
+
+    Returns:
+        list: Encoded passwords, in the order given
+    """
+    passwords = list(passwords)
+    workers = min(workers or os.cpu_count() or 1, len(passwords))
+    if workers <= 1:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_setup_worker) as pool:
+        return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
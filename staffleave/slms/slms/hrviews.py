@@ -1,17 +1,32 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Sum, Count
-from django.http import HttpResponse, JsonResponse
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, Http404
+from django.views.decorators.http import condition
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from datetime import datetime, date, timedelta
 from calendar import monthrange
-import csv
 from slmsapp.models import (
     CustomUser, Employee, Employee_Leave, Department, LeaveType, 
-    LeaveEntitlement, LeaveBalance, PublicHoliday, SystemSettings, CalendarEvent
+    LeaveEntitlement, LeaveBalance, PublicHoliday, SystemSettings, CalendarEvent,
+    HolidayCalendar
 )
 from .auth_utils import validate_password
-from .decorators import hr_required, admin_or_hr_required, admin_required
+from .decorators import hr_required, admin_or_hr_required, admin_required, allow_revalidation
+from .calendar_utils import get_month_holidays
+from .analytics_utils import (
+    cached_analytics, get_analytics_last_modified, get_chart_data, get_chart_etag, get_dashboard_analytics
+)
+from .absence_utils import SORT_FIELDS, absence_metrics
+from .changefeed_utils import (
+    CHANGE_FEED_MAX_PAGE_SIZE, CHANGE_FEED_PAGE_SIZE, CHANGE_FEEDS, change_line, encode_cursor, read_changes
+)
+from .import_utils import IMPORT_COLUMNS, REQUIRED_COLUMNS, import_employees, read_import_file
+from .export_utils import (
+    BALANCE_HEADER, ENTITLEMENT_HEADER, LEAVE_HEADER, balance_rows, csv_response, entitlement_rows, leave_rows
+)
 
 
 @login_required(login_url='/')
@@ -165,6 +180,42 @@ def ADD_STAFF(request):
     return render(request, 'hr/add_staff.html', context)
 
 
+@login_required(login_url='/')
+@admin_or_hr_required
+def IMPORT_STAFF(request):
+    """Create many employees from a CSV or JSON file, reporting the problems of each rejected row"""
+    context = {
+        'columns': IMPORT_COLUMNS,
+        'required_columns': REQUIRED_COLUMNS,
+        'dry_run': request.method == "POST" and request.POST.get('dry_run') == 'on',
+    }
+    if request.method == "POST":
+        import_file = request.FILES.get('import_file')
+        if not import_file:
+            messages.error(request, 'Please choose a CSV or JSON file to import.')
+            return redirect('hr_import_staff')
+        if import_file.size > 10 * 1024 * 1024:
+            messages.error(request, 'File size exceeds 10MB limit. Please split the file.')
+            return redirect('hr_import_staff')
+        
+        try:
+            rows = read_import_file(import_file.read(), import_file.name)
+        except ValueError as e:
+            messages.error(request, f'Could not read the file: {str(e)}')
+            return redirect('hr_import_staff')
+        
+        # Passwords are hashed in this process: a pool per upload would fork the
+        # web worker. Large files go through manage.py import_employees instead
+        result = import_employees(rows, dry_run=context['dry_run'], workers=1)
+        context['result'] = result
+        if result.created and not context['dry_run']:
+            messages.success(request, f'{len(result.created)} employee(s) imported successfully.')
+        if result.errors:
+            messages.warning(request, f'{len(result.errors)} row(s) were rejected; see the report below.')
+    
+    return render(request, 'hr/import_staff.html', context)
+
+
 @login_required(login_url='/')
 @admin_or_hr_required
 def UPDATE_STAFF(request, id):
@@ -259,6 +310,7 @@ def MANAGE_LEAVE_TYPES(request):
         name = request.POST.get('name')
         description = request.POST.get('description')
         max_days = request.POST.get('max_days_per_year', 0)
+        max_carryover = request.POST.get('max_carryover_days', '')
         requires_approval = request.POST.get('requires_approval') == 'on'
         
         if LeaveType.objects.filter(name=name).exists():
@@ -268,6 +320,7 @@ def MANAGE_LEAVE_TYPES(request):
                 name=name,
                 description=description,
                 max_days_per_year=int(max_days) if max_days else 0,
+                max_carryover_days=int(max_carryover) if max_carryover else None,
                 requires_approval=requires_approval
             )
             messages.success(request, 'Leave type added successfully')
@@ -288,6 +341,8 @@ def UPDATE_LEAVE_TYPE(request, id):
         leave_type.name = request.POST.get('name')
         leave_type.description = request.POST.get('description')
         leave_type.max_days_per_year = int(request.POST.get('max_days_per_year', 0))
+        max_carryover = request.POST.get('max_carryover_days', '')
+        leave_type.max_carryover_days = int(max_carryover) if max_carryover else None
         leave_type.requires_approval = request.POST.get('requires_approval') == 'on'
         leave_type.is_active = request.POST.get('is_active') == 'on'
         leave_type.save()
@@ -324,16 +379,8 @@ def SET_LEAVE_ENTITLEMENTS(request):
                 entitlement.save()
             
             # Update or create leave balance
-            balance, created = LeaveBalance.objects.get_or_create(
-                employee=employee,
-                leave_type=leave_type,
-                year=int(year),
-                defaults={'days_entitled': float(entitlement_days), 'days_used': 0}
-            )
-            
-            if not created:
-                balance.days_entitled = float(entitlement_days)
-                balance.save()
+            from .leave_utils import set_balance_entitlement
+            set_balance_entitlement(employee, leave_type, int(year), float(entitlement_days), user=request.user)
             
             messages.success(request, 'Leave entitlement set successfully')
         except Exception as e:
@@ -345,22 +392,51 @@ def SET_LEAVE_ENTITLEMENTS(request):
     leave_types = LeaveType.objects.filter(is_active=True)
     current_year = date.today().year
     
-    # Get all entitlements with related data
-    entitlements = LeaveEntitlement.objects.all().select_related(
+    # Filters
+    year_filter = request.GET.get('year', '')
+    department_filter = request.GET.get('department', '')
+    leave_type_filter = request.GET.get('leave_type', '')
+    
+    entitlements = LeaveEntitlement.objects.select_related(
         'employee__admin', 'leave_type'
-    ).order_by('-year', 'employee__admin__first_name')
+    ).order_by('-year', 'employee__admin__first_name', 'id')
     
-    # Add calculated fields for each entitlement
-    for entitlement in entitlements:
-        # Calculate used days from approved leaves
-        approved_leaves = Employee_Leave.objects.filter(
-            employee_id=entitlement.employee,
-            leave_type=entitlement.leave_type,
-            from_date__year=entitlement.year,
-            status=1
+    if year_filter.isdigit():
+        entitlements = entitlements.filter(year=int(year_filter))
+    if department_filter.isdigit():
+        entitlements = entitlements.filter(employee__department_id=int(department_filter))
+    if leave_type_filter.isdigit():
+        entitlements = entitlements.filter(leave_type_id=int(leave_type_filter))
+    
+    # Pagination
+    paginator = Paginator(entitlements, 25)
+    page = request.GET.get('page')
+    
+    try:
+        entitlements_page = paginator.page(page)
+    except PageNotAnInteger:
+        entitlements_page = paginator.page(1)
+    except EmptyPage:
+        entitlements_page = paginator.page(paginator.num_pages)
+    
+    # Working days used for the entitlements on this page, from one query
+    # over their approved leaves
+    from .leave_utils import working_days_by_balance
+    page_entitlements = list(entitlements_page)
+    used_by_balance = working_days_by_balance(
+        Employee_Leave.objects.filter(
+            status=1,
+            employee_id__in={entitlement.employee_id for entitlement in page_entitlements},
+            leave_type_id__in={entitlement.leave_type_id for entitlement in page_entitlements},
+            from_date__lte=date(max(entitlement.year for entitlement in page_entitlements), 12, 31),
+            to_date__gte=date(min(entitlement.year for entitlement in page_entitlements), 1, 1)
+        )
+    ) if page_entitlements else {}
+    
+    for entitlement in page_entitlements:
+        used_days = used_by_balance.get(
+            (entitlement.employee_id, entitlement.leave_type_id, entitlement.year), 0
         )
-        used_days = sum([(leave.to_date - leave.from_date).days + 1 for leave in approved_leaves])
-        
         entitlement.used_days = used_days
         entitlement.total_days = entitlement.days_entitled
         entitlement.remaining_days = entitlement.days_entitled - used_days
@@ -368,8 +444,13 @@ def SET_LEAVE_ENTITLEMENTS(request):
     context = {
         'employee_list': employee_list,
         'leave_types': leave_types,
+        'departments': Department.objects.all().order_by('name'),
+        'years': LeaveEntitlement.objects.values_list('year', flat=True).distinct().order_by('-year'),
         'current_year': current_year,
-        'entitlements': entitlements,
+        'entitlements': entitlements_page,
+        'year_filter': year_filter,
+        'department_filter': department_filter,
+        'leave_type_filter': leave_type_filter,
     }
     return render(request, 'hr/set_entitlements.html', context)
 
@@ -423,32 +504,37 @@ def APPROVE_OVERRIDE_LEAVE(request):
 def HR_APPROVE_LEAVE(request, id):
     """HR approve leave"""
     if request.method == 'POST':
-        leave = get_object_or_404(Employee_Leave, id=id)
-        
-        if leave.status == 2:
-            messages.warning(request, 'Cannot approve a rejected leave application.')
-            return redirect('hr_approve_leave')
-        
         # Get approval comment if provided
         approval_comment = request.POST.get('approval_comment', '')
         
-        leave.status = 1
-        leave.approved_by_hr = request.user
-        if approval_comment:
-            leave.hr_approval_comment = approval_comment
-        leave.save()
-        
-        # Update leave balance automatically
         from .leave_utils import update_leave_balance_on_approval
-        if update_leave_balance_on_approval(leave):
+        from .notification_utils import notify_leave_approved
+        # The notification is queued with the approval, and only if it commits;
+        # the leave stays locked until then so a rejection cannot interleave
+        with transaction.atomic():
+            leave = get_object_or_404(Employee_Leave.objects.select_for_update(), id=id)
+            
+            if leave.status == 2:
+                messages.warning(request, 'Cannot approve a rejected leave application.')
+                return redirect('hr_approve_leave')
+            
+            leave.status = 1
+            leave.approved_by_hr = request.user
+            if approval_comment:
+                leave.hr_approval_comment = approval_comment
+            leave.save()
+            
+            # Update leave balance automatically
+            balance_updated = update_leave_balance_on_approval(leave, user=request.user)
+            
+            # Send approval notification to employee
+            notify_leave_approved(leave, approved_by_user=request.user)
+        
+        if balance_updated:
             messages.success(request, 'Leave application approved successfully and leave balance updated.')
         else:
             messages.success(request, 'Leave application approved successfully.')
         
-        # Send approval notification to employee
-        from .notification_utils import notify_leave_approved
-        notify_leave_approved(leave, approved_by_user=request.user)
-        
         return redirect('hr_approve_leave')
     
     return redirect('hr_approve_leave')
@@ -459,14 +545,20 @@ def HR_APPROVE_LEAVE(request, id):
 def HR_REJECT_LEAVE(request, id):
     """HR reject leave"""
     if request.method == 'POST':
-        leave = get_object_or_404(Employee_Leave, id=id)
         rejection_reason = request.POST.get('rejection_reason', '')
         approval_comment = request.POST.get('approval_comment', '')
-        leave.status = 2
-        leave.rejection_reason = rejection_reason
-        if approval_comment:
-            leave.hr_approval_comment = approval_comment
-        leave.save()
+        from .leave_utils import revert_leave_balance_on_rejection
+        # The rejection and the reversal commit together, with the leave locked
+        with transaction.atomic():
+            leave = get_object_or_404(Employee_Leave.objects.select_for_update(), id=id)
+            leave.status = 2
+            leave.rejection_reason = rejection_reason
+            if approval_comment:
+                leave.hr_approval_comment = approval_comment
+            leave.save()
+            
+            # Return any days already debited for an earlier approval
+            revert_leave_balance_on_rejection(leave, user=request.user)
         messages.success(request, 'Leave application rejected.')
         return redirect('hr_approve_leave')
     
@@ -492,14 +584,15 @@ def MANAGE_PUBLIC_HOLIDAYS(request):
                 name=name,
                 date=holiday_date,
                 description=description,
-                is_recurring=is_recurring
+                is_recurring=is_recurring,
+                calendar_id=request.POST.get('calendar') or None
             )
             messages.success(request, 'Public holiday added successfully')
         
         return redirect('hr_manage_holidays')
     
     current_year = date.today().year
-    holidays = PublicHoliday.objects.all().order_by('date')
+    holidays = PublicHoliday.objects.select_related('calendar').order_by('date')
     
     # Statistics
     total_holidays = holidays.count()
@@ -512,6 +605,7 @@ def MANAGE_PUBLIC_HOLIDAYS(request):
         'total_holidays': total_holidays,
         'upcoming_holidays': upcoming_holidays,
         'recurring_holidays': recurring_holidays,
+        'holiday_calendars': HolidayCalendar.objects.filter(is_active=True),
     }
     return render(request, 'hr/manage_holidays.html', context)
 
@@ -521,184 +615,15 @@ def MANAGE_PUBLIC_HOLIDAYS(request):
 def ANALYTICS_DASHBOARD(request):
     """Analytics Dashboard with KPIs and charts"""
     current_year = date.today().year
-    current_date = date.today()
     
     # Get year from request, default to current year
     year = int(request.GET.get('year', current_year))
     
-    # KPI Metrics
-    total_employees = Employee.objects.count()
-    total_leaves_applied = Employee_Leave.objects.filter(created_at__year=year).count()
-    approved_leaves = Employee_Leave.objects.filter(status=1, created_at__year=year).count()
-    pending_leaves = Employee_Leave.objects.filter(status=0, created_at__year=year).count()
-    rejected_leaves = Employee_Leave.objects.filter(status=2, created_at__year=year).count()
-    
-    # Additional metrics
-    from datetime import timedelta
-    total_leave_days = sum([
-        (leave.to_date - leave.from_date).days + 1 
-        for leave in Employee_Leave.objects.filter(status=1, created_at__year=year)
-    ])
-    
-    # Employees who took leave
-    employees_with_leave = Employee_Leave.objects.filter(status=1, created_at__year=year).values('employee_id').distinct().count()
-    
-    # Average leaves per employee
-    avg_leaves_per_employee = 0
-    if employees_with_leave > 0:
-        avg_leaves_per_employee = round(approved_leaves / employees_with_leave, 1)
-    
-    # Departments count
-    total_departments = Department.objects.count()
-    
-    # Most common leave type
-    most_common_leave_type = LeaveType.objects.annotate(
-        count=Count('employee_leave')
-    ).order_by('-count').first() if LeaveType.objects.exists() else None
-    
-    # Active leave types this year
-    active_leave_types_year = LeaveType.objects.filter(
-        employee_leave__created_at__year=year
-    ).distinct().count()
-    
-    # Calculate percentages
-    approval_rate = 0
-    if total_leaves_applied > 0:
-        approval_rate = round((approved_leaves / total_leaves_applied) * 100, 1)
-    
-    pending_percentage = 0
-    if total_leaves_applied > 0:
-        pending_percentage = round((pending_leaves / total_leaves_applied) * 100, 1)
-    
-    rejection_rate = 0
-    if total_leaves_applied > 0:
-        rejection_rate = round((rejected_leaves / total_leaves_applied) * 100, 1)
-    
-    # Utilization rate
-    utilization_rate = 0
-    if total_employees > 0:
-        utilization_rate = round((employees_with_leave / total_employees) * 100, 1)
-    
-    # Monthly trend data for line chart
-    monthly_data = []
-    monthly_labels = []
-    for month in range(1, 13):
-        month_leaves = Employee_Leave.objects.filter(
-            created_at__year=year,
-            created_at__month=month
-        ).count()
-        monthly_data.append(month_leaves)
-        month_name = date(year, month, 1).strftime('%b')
-        monthly_labels.append(month_name)
-    
-    # Leave type distribution (pie chart)
-    leave_types = LeaveType.objects.all()
-    leave_type_data = []
-    leave_type_labels = []
-    leave_type_colors = [
-        '#3b82f6', '#10b981', '#f59e0b', '#ef4444', '#8b5cf6',
-        '#ec4899', '#14b8a6', '#f97316', '#6366f1', '#06b6d4'
-    ]
-    
-    for idx, lt in enumerate(leave_types):
-        count = Employee_Leave.objects.filter(
-            leave_type=lt,
-            created_at__year=year
-        ).count()
-        if count > 0:
-            leave_type_data.append(count)
-            leave_type_labels.append(lt.name)
-    
-    # Department wise distribution (bar chart)
-    departments = Department.objects.all()
-    dept_data = []
-    dept_labels = []
-    dept_approved = []
-    dept_pending = []
-    dept_rejected = []
-    
-    for dept in departments:
-        total = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            created_at__year=year
-        ).count()
-        approved = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            status=1,
-            created_at__year=year
-        ).count()
-        pending = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            status=0,
-            created_at__year=year
-        ).count()
-        rejected = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            status=2,
-            created_at__year=year
-        ).count()
-        
-        if total > 0:
-            dept_data.append(total)
-            dept_labels.append(dept.name[:15])  # Truncate long names
-            dept_approved.append(approved)
-            dept_pending.append(pending)
-            dept_rejected.append(rejected)
-    
-    # Status distribution
-    status_labels = ['Approved', 'Pending', 'Rejected']
-    status_data = [approved_leaves, pending_leaves, rejected_leaves]
-    status_colors = ['#10b981', '#f59e0b', '#ef4444']
-    
-    # Employee leave balance summary
-    employees_on_leave_today = Employee_Leave.objects.filter(
-        from_date__lte=current_date,
-        to_date__gte=current_date,
-        status=1
-    ).count()
-    
-    # Top leave types
-    top_leave_types = LeaveType.objects.annotate(
-        count=Count('employee_leave')
-    ).order_by('-count')[:5]
-    
     context = {
         'current_year': current_year,
         'year': year,
-        
-        # KPIs
-        'total_employees': total_employees,
-        'total_leaves_applied': total_leaves_applied,
-        'approved_leaves': approved_leaves,
-        'pending_leaves': pending_leaves,
-        'rejected_leaves': rejected_leaves,
-        'approval_rate': approval_rate,
-        'pending_percentage': pending_percentage,
-        'rejection_rate': rejection_rate,
-        'employees_on_leave_today': employees_on_leave_today,
-        'total_leave_days': total_leave_days,
-        'employees_with_leave': employees_with_leave,
-        'avg_leaves_per_employee': avg_leaves_per_employee,
-        'total_departments': total_departments,
-        'most_common_leave_type': most_common_leave_type,
-        'active_leave_types_year': active_leave_types_year,
-        'utilization_rate': utilization_rate,
-        
-        # Chart data (JSON)
-        'monthly_labels': monthly_labels,
-        'monthly_data': monthly_data,
-        'leave_type_labels': leave_type_labels,
-        'leave_type_data': leave_type_data,
-        'dept_labels': dept_labels,
-        'dept_data': dept_data,
-        'dept_approved': dept_approved,
-        'dept_pending': dept_pending,
-        'dept_rejected': dept_rejected,
-        'status_labels': status_labels,
-        'status_data': status_data,
-        'status_colors': status_colors,
-        'top_leave_types': top_leave_types,
     }
+    context.update(get_dashboard_analytics(year, scope='hr'))
     
     return render(request, 'hr/analytics_dashboard.html', context)
 
@@ -708,198 +633,175 @@ def ANALYTICS_DASHBOARD(request):
 def ADMIN_ANALYTICS_DASHBOARD(request):
     """Admin Analytics Dashboard with KPIs and charts"""
     current_year = date.today().year
-    current_date = date.today()
     
     # Get year from request, default to current year
     year = int(request.GET.get('year', current_year))
     
-    # KPI Metrics
-    # Count employees who are CustomUser type '2' (employees)
-    total_employees = Employee.objects.filter(admin__user_type='2').count()
-    total_users = CustomUser.objects.count()
-    active_users = CustomUser.objects.filter(is_active=True).count()
-    total_departments = Department.objects.count()
-    total_leaves_applied = Employee_Leave.objects.filter(created_at__year=year).count()
-    approved_leaves = Employee_Leave.objects.filter(status=1, created_at__year=year).count()
-    pending_leaves = Employee_Leave.objects.filter(status=0, created_at__year=year).count()
-    rejected_leaves = Employee_Leave.objects.filter(status=2, created_at__year=year).count()
-    
-    # Additional admin metrics
-    inactive_users = total_users - active_users
-    
-    # Total leave days
-    total_leave_days = sum([
-        (leave.to_date - leave.from_date).days + 1 
-        for leave in Employee_Leave.objects.filter(status=1, created_at__year=year)
-    ])
-    
-    # Employees with leave
-    employees_with_leave = Employee_Leave.objects.filter(status=1, created_at__year=year).values('employee_id').distinct().count()
-    
-    # Average leaves per employee
-    avg_leaves_per_employee = 0
-    if employees_with_leave > 0:
-        avg_leaves_per_employee = round(approved_leaves / employees_with_leave, 1)
-    
-    # Employee count by department
-    dept_employee_counts = {}
-    for dept in Department.objects.all():
-        dept_employee_counts[dept.name] = Employee.objects.filter(department=dept).count()
-    
-    # User type counts
-    admin_count = CustomUser.objects.filter(user_type='1').count()
-    employee_count = CustomUser.objects.filter(user_type='2').count()
-    dh_count = CustomUser.objects.filter(user_type='3').count()
-    hr_count = CustomUser.objects.filter(user_type='4').count()
-    
-    # System settings info
-    total_leave_types = LeaveType.objects.count()
-    active_leave_types = LeaveType.objects.filter(is_active=True).count()
-    total_holidays = PublicHoliday.objects.count()
-    
-    # Calculate percentages
-    approval_rate = 0
-    if total_leaves_applied > 0:
-        approval_rate = round((approved_leaves / total_leaves_applied) * 100, 1)
-    
-    active_user_rate = 0
-    if total_users > 0:
-        active_user_rate = round((active_users / total_users) * 100, 1)
-    
-    # Utilization rate
-    utilization_rate = 0
-    if total_employees > 0:
-        utilization_rate = round((employees_with_leave / total_employees) * 100, 1)
-    
-    # Monthly trend data for line chart
-    monthly_data = []
-    monthly_labels = []
-    for month in range(1, 13):
-        month_leaves = Employee_Leave.objects.filter(
-            created_at__year=year,
-            created_at__month=month
-        ).count()
-        monthly_data.append(month_leaves)
-        month_name = date(year, month, 1).strftime('%b')
-        monthly_labels.append(month_name)
-    
-    # Leave type distribution (pie chart)
-    leave_types = LeaveType.objects.all()
-    leave_type_data = []
-    leave_type_labels = []
-    
-    for lt in leave_types:
-        count = Employee_Leave.objects.filter(
-            leave_type=lt,
-            created_at__year=year
-        ).count()
-        if count > 0:
-            leave_type_data.append(count)
-            leave_type_labels.append(lt.name)
-    
-    # Department wise distribution (bar chart)
-    departments = Department.objects.all()
-    dept_data = []
-    dept_labels = []
-    dept_approved = []
-    dept_pending = []
-    dept_rejected = []
+    context = {
+        'current_year': current_year,
+        'year': year,
+    }
+    context.update(get_dashboard_analytics(year, scope='admin'))
     
-    for dept in departments:
-        total = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            created_at__year=year
-        ).count()
-        approved = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            status=1,
-            created_at__year=year
-        ).count()
-        pending = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            status=0,
-            created_at__year=year
-        ).count()
-        rejected = Employee_Leave.objects.filter(
-            employee_id__department=dept,
-            status=2,
-            created_at__year=year
-        ).count()
-        
-        if total > 0:
-            dept_data.append(total)
-            dept_labels.append(dept.name[:15])  # Truncate long names
-            dept_approved.append(approved)
-            dept_pending.append(pending)
-            dept_rejected.append(rejected)
+    return render(request, 'admin/admin_analytics_dashboard.html', context)
+
+
+def _chart_year(request):
+    year = request.GET.get('year', '')
+    return int(year) if year.isdigit() else date.today().year
+
+
+def _hr_chart_etag(request, chart):
+    return get_chart_etag(_chart_year(request), 'hr', chart)
+
+
+def _admin_chart_etag(request, chart):
+    return get_chart_etag(_chart_year(request), 'admin', chart)
+
+
+def _chart_last_modified(request, chart):
+    return get_analytics_last_modified()
+
+
+def _chart_response(request, scope, chart):
+    data = get_chart_data(_chart_year(request), scope, chart)
+    if data is None:
+        raise Http404('Unknown chart')
+    return JsonResponse(data)
+
+
+@login_required(login_url='/')
+@hr_required
+def ABSENCE_REPORT(request):
+    """Absence pattern report: Bradford factor, spells and Monday/Friday skew per employee"""
+    current_year = date.today().year
+    year_filter = request.GET.get('year', '')
+    department_filter = request.GET.get('department', '')
+    leave_type_filter = request.GET.get('leave_type', '')
+    sort = request.GET.get('sort', 'bradford')
+    if sort not in SORT_FIELDS:
+        sort = 'bradford'
+    
+    year = int(year_filter) if year_filter.isdigit() else current_year
+    leave_type_id = int(leave_type_filter) if leave_type_filter.isdigit() else None
+    department_id = int(department_filter) if department_filter.isdigit() else None
+    metrics = cached_analytics(
+        f'absence:{year}:{leave_type_id}:{department_id}',
+        lambda: absence_metrics(year, leave_type_id, department_id)
+    )
     
-    # Status distribution
-    status_labels = ['Approved', 'Pending', 'Rejected']
-    status_data = [approved_leaves, pending_leaves, rejected_leaves]
-    status_colors = ['#10b981', '#f59e0b', '#ef4444']
+    # Highest first; ties keep employee order
+    order = (-metrics[sort]).argsort(kind='stable').tolist()
     
-    # User type distribution
-    from django.db.models import Q
-    admin_count = CustomUser.objects.filter(user_type='1').count()
-    employee_count = CustomUser.objects.filter(user_type='2').count()
-    dh_count = CustomUser.objects.filter(user_type='3').count()
-    hr_count = CustomUser.objects.filter(user_type='4').count()
+    # Pagination
+    paginator = Paginator(order, 25)
+    page = request.GET.get('page')
     
-    user_type_labels = ['Admin', 'Employee', 'Department Head', 'HR']
-    user_type_data = [admin_count, employee_count, dh_count, hr_count]
-    user_type_colors = ['#3b82f6', '#10b981', '#f59e0b', '#ef4444']
+    try:
+        rows_page = paginator.page(page)
+    except PageNotAnInteger:
+        rows_page = paginator.page(1)
+    except EmptyPage:
+        rows_page = paginator.page(paginator.num_pages)
+    
+    # Names only for the employees shown on this page
+    employees = Employee.objects.select_related('admin', 'department').in_bulk(
+        [int(metrics['employee_id'][index]) for index in rows_page]
+    )
+    rows = []
+    for index in rows_page:
+        row = {field: values[index].item() for field, values in metrics.items()}
+        row['employee'] = employees.get(row['employee_id'])
+        rows.append(row)
     
     context = {
-        'current_year': current_year,
+        'rows': rows,
+        'page_obj': rows_page,
         'year': year,
-        
-        # KPIs - User Management
-        'total_employees': total_employees,
-        'total_users': total_users,
-        'active_users': active_users,
-        'inactive_users': inactive_users,
-        'total_departments': total_departments,
-        'active_user_rate': active_user_rate,
-        
-        # KPIs - Leave Management
-        'total_leaves_applied': total_leaves_applied,
-        'approved_leaves': approved_leaves,
-        'pending_leaves': pending_leaves,
-        'rejected_leaves': rejected_leaves,
-        'approval_rate': approval_rate,
-        'total_leave_days': total_leave_days,
-        'employees_with_leave': employees_with_leave,
-        'avg_leaves_per_employee': avg_leaves_per_employee,
-        'utilization_rate': utilization_rate,
-        
-        # System Configuration
-        'total_leave_types': total_leave_types,
-        'active_leave_types': active_leave_types,
-        'total_holidays': total_holidays,
-        'admin_count': admin_count,
-        'employee_count': employee_count,
-        'dh_count': dh_count,
-        'hr_count': hr_count,
-        
-        # Chart data (JSON)
-        'monthly_labels': monthly_labels,
-        'monthly_data': monthly_data,
-        'leave_type_labels': leave_type_labels,
-        'leave_type_data': leave_type_data,
-        'dept_labels': dept_labels,
-        'dept_data': dept_data,
-        'dept_approved': dept_approved,
-        'dept_pending': dept_pending,
-        'dept_rejected': dept_rejected,
-        'status_labels': status_labels,
-        'status_data': status_data,
-        'status_colors': status_colors,
-        'user_type_labels': user_type_labels,
-        'user_type_data': user_type_data,
-        'user_type_colors': user_type_colors,
+        'current_year': current_year,
+        'departments': Department.objects.all().order_by('name'),
+        'leave_types': LeaveType.objects.all().order_by('name'),
+        'department_filter': department_filter,
+        'leave_type_filter': leave_type_filter,
+        'sort': sort,
+        'sort_fields': SORT_FIELDS,
+    }
+    return render(request, 'hr/absence_report.html', context)
+
+
+def _export_filters(request):
+    """Year, department and leave type picked in a review screen's filter form"""
+    return {
+        field: int(value) if value.isdigit() else None
+        for field, value in (
+            ('year', request.GET.get('year', '')),
+            ('department_id', request.GET.get('department', '')),
+            ('leave_type_id', request.GET.get('leave_type', '')),
+        )
     }
+
+
+@login_required(login_url='/')
+@hr_required
+def EXPORT_LEAVES(request):
+    """Download leave applications as CSV, with the review screen filters plus status"""
+    rows = leave_rows(status=request.GET.get('status', 'all'), **_export_filters(request))
+    return csv_response('leave_applications.csv', LEAVE_HEADER, rows)
+
+
+@login_required(login_url='/')
+@hr_required
+def EXPORT_BALANCES(request):
+    """Download leave balances as CSV, with the entitlement screen filters"""
+    return csv_response('leave_balances.csv', BALANCE_HEADER, balance_rows(**_export_filters(request)))
+
+
+@login_required(login_url='/')
+@hr_required
+def EXPORT_ENTITLEMENTS(request):
+    """Download leave entitlements as CSV, with the entitlement screen filters"""
+    return csv_response('leave_entitlements.csv', ENTITLEMENT_HEADER, entitlement_rows(**_export_filters(request)))
+
+
+@login_required(login_url='/')
+@admin_or_hr_required
+def CHANGE_FEED(request, feed):
+    """One page of changed rows as JSONL; X-Next-Cursor gives the cursor for the next page"""
+    if feed not in CHANGE_FEEDS:
+        raise Http404('Unknown feed')
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), CHANGE_FEED_MAX_PAGE_SIZE) if limit.isdigit() and int(limit) else CHANGE_FEED_PAGE_SIZE
     
-    return render(request, 'admin/admin_analytics_dashboard.html', context)
+    try:
+        rows, cursor, has_more = read_changes(feed, request.GET.get('cursor') or None, limit)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    response = HttpResponse(
+        ''.join(change_line(feed, row, encode_cursor(row['updated_at'], row['id'])) for row in rows),
+        content_type='application/x-ndjson'
+    )
+    response['X-Next-Cursor'] = cursor or ''
+    response['X-Has-More'] = 'true' if has_more else 'false'
+    return response
+
+
+@login_required(login_url='/')
+@hr_required
+@allow_revalidation
+@condition(etag_func=_hr_chart_etag, last_modified_func=_chart_last_modified)
+def ANALYTICS_CHART(request, chart):
+    """JSON series of one HR analytics chart; repeat requests get 304 Not Modified"""
+    return _chart_response(request, 'hr', chart)
+
+
+@login_required(login_url='/')
+@admin_required
+@allow_revalidation
+@condition(etag_func=_admin_chart_etag, last_modified_func=_chart_last_modified)
+def ADMIN_ANALYTICS_CHART(request, chart):
+    """JSON series of one admin analytics chart; repeat requests get 304 Not Modified"""
+    return _chart_response(request, 'admin', chart)
 
 
 @login_required(login_url='/')
@@ -913,11 +815,15 @@ def UPDATE_HOLIDAY(request, id):
         holiday.date = request.POST.get('date')
         holiday.description = request.POST.get('description', '')
         holiday.is_recurring = request.POST.get('is_recurring') == 'on'
+        holiday.calendar_id = request.POST.get('calendar') or None
         holiday.save()
         messages.success(request, 'Holiday updated successfully')
         return redirect('hr_manage_holidays')
     
-    context = {'holiday': holiday}
+    context = {
+        'holiday': holiday,
+        'holiday_calendars': HolidayCalendar.objects.filter(is_active=True),
+    }
     return render(request, 'hr/update_holiday.html', context)
 
 
@@ -958,15 +864,15 @@ def EDIT_ENTITLEMENT(request, id):
             entitlement.save()
             
             # Update associated balance
-            balance = LeaveBalance.objects.filter(
+            if LeaveBalance.objects.filter(
                 employee=entitlement.employee,
                 leave_type=entitlement.leave_type,
                 year=entitlement.year
-            ).first()
-            
-            if balance:
-                balance.days_entitled = new_days
-                balance.save()
+            ).exists():
+                from .leave_utils import set_balance_entitlement
+                set_balance_entitlement(
+                    entitlement.employee, entitlement.leave_type, entitlement.year, new_days, user=request.user
+                )
             
             messages.success(request, 'Leave entitlement updated successfully')
         except Exception as e:
@@ -991,12 +897,8 @@ def HR_CALENDAR(request):
     year = int(request.GET.get('year', date.today().year))
     month = int(request.GET.get('month', date.today().month))
     
-    # Get public holidays for the month
-    public_holidays = PublicHoliday.objects.filter(
-        date__year=year,
-        date__month=month,
-        is_active=True
-    )
+    # Get public holidays for the month (recurring holidays expanded)
+    public_holidays = get_month_holidays(year, month)
     
     # Get calendar events for the month (all active events created by admins)
     calendar_events = CalendarEvent.objects.filter(
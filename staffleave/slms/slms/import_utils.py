@@ -0,0 +1,245 @@
+"""
+Bulk employee import
+
+Creates many employee accounts from a CSV or JSON file at once. Every row
+is checked in memory against the emails, usernames and employee IDs that
+already exist (each fetched with one query) and against the rest of the
+file, so a row's errors are all reported together and nothing is written
+for it. Passwords of the valid rows are hashed in a process pool, then
+users and employee records are inserted with bulk_create, one transaction
+per chunk; if a chunk fails, for example because someone added the same
+username meanwhile, its rows are reported and the other chunks still go in.
+
+Rows without a password get an unusable one; those employees set their
+password through the password reset page.
+
+bulk_create sends no pre_save/post_save signals and skips Model.save().
+Importing therefore does by hand what those do for a new employee added
+with ADD_STAFF: Employee.save() allocating the employee ID, and the
+analytics_source_changed receiver dropping the cached dashboards. The
+other receivers do nothing for new rows: leave rollups only move when an
+existing employee changes department, and leave balances are created
+when entitlements are set or leaves approved, not with the account. A
+receiver that starts setting up new users or employees must be called
+for each chunk here too; EmployeeImportTests checks that an import and
+ADD_STAFF leave the same rows behind.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from django.db import DatabaseError, transaction
+from slmsapp.models import CustomUser, Department, Employee
+from .auth_utils import get_int_setting, validate_password
+from .hash_utils import hash_passwords
+
+
+IMPORT_COLUMNS = [
+    'first_name', 'last_name', 'email', 'username', 'password', 'gender', 'department',
+    'employee_type', 'employee_id', 'phone_number', 'date_of_joining', 'address',
+]
+REQUIRED_COLUMNS = ['first_name', 'last_name', 'email', 'username', 'gender']
+
+IMPORT_CHUNK_SIZE = 500
+
+EMPLOYEE_TYPES = {value for value, _ in Employee.EMPLOYEE_TYPE_CHOICES}
+
+
+class ImportResult:
+    """Outcome of an import: rows created and {row number: [error messages]}"""
+
+    def __init__(self):
+        self.created = []
+        self.errors = {}
+
+    def add_error(self, row_number, message):
+        self.errors.setdefault(row_number, []).append(message)
+
+    @property
+    def error_rows(self):
+        """(row number, messages) sorted by row number"""
+        return sorted(self.errors.items())
+
+
+def read_import_file(content, filename=''):
+    """
+    Rows of a CSV or JSON import file as dicts of strings
+
+    JSON files hold a list of objects; anything not ending in .json is read
+    as CSV with a header row.
+
+    Raises:
+        ValueError: If the file cannot be read
+    """
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ValueError('The file must be UTF-8 encoded')
+
+    if filename.lower().endswith('.json'):
+        try:
+            rows = json.loads(content)
+        except ValueError as e:
+            raise ValueError(f'Invalid JSON: {e}')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('The JSON file must hold a list of objects')
+    else:
+        rows = list(csv.DictReader(io.StringIO(content)))
+
+    return [
+        {column: str(row.get(column) or '').strip() for column in IMPORT_COLUMNS}
+        for row in rows
+    ]
+
+
+def _department_lookup():
+    """Departments by lower-cased name and by id"""
+    lookup = {}
+    for department_id, name in Department.objects.values_list('id', 'name'):
+        lookup[name.lower()] = department_id
+        lookup[str(department_id)] = department_id
+    return lookup
+
+
+def validate_import_rows(rows, result):
+    """
+    Check every row and turn the valid ones into unsaved users and employees
+
+    Row numbers count the header as row 1, as a spreadsheet shows them.
+    Employees without an ID in the file are left without one; IDs are
+    only allocated when they are saved.
+
+    Returns:
+        list: (row number, CustomUser, Employee, raw password) per valid row
+    """
+    emails = {email.lower() for email in CustomUser.objects.exclude(email='').values_list('email', flat=True)}
+    usernames = set(CustomUser.objects.values_list('username', flat=True))
+    employee_ids = set(Employee.objects.exclude(employee_id=None).values_list('employee_id', flat=True))
+    departments = _department_lookup()
+    min_password_length = get_int_setting('password_min_length', 8)
+
+    seen_emails, seen_usernames, seen_ids = set(), set(), set()
+    valid = []
+    for row_number, row in enumerate(rows, 2):
+        errors = [f'{column} is required' for column in REQUIRED_COLUMNS if not row[column]]
+
+        email = row['email'].lower()
+        for value, label, existing, seen in (
+            (email, f'Email {row["email"]}', emails, seen_emails),
+            (row['username'], f'Username {row["username"]}', usernames, seen_usernames),
+            (row['employee_id'], f'Employee ID {row["employee_id"]}', employee_ids, seen_ids),
+        ):
+            if not value:
+                continue
+            if value in existing:
+                errors.append(f'{label} already exists')
+            elif value in seen:
+                errors.append(f'{label} appears earlier in the file')
+            seen.add(value)
+
+        if row['password']:
+            ok, message = validate_password(row['password'], min_password_length)
+            if not ok:
+                errors.append(message)
+
+        department_id = None
+        if row['department']:
+            department_id = departments.get(row['department'].lower())
+            if department_id is None:
+                errors.append(f'Department {row["department"]} does not exist')
+
+        employee_type = row['employee_type'] or 'Full-time'
+        if employee_type not in EMPLOYEE_TYPES:
+            errors.append(f'Employee type must be one of {", ".join(sorted(EMPLOYEE_TYPES))}')
+
+        date_of_joining = None
+        if row['date_of_joining']:
+            try:
+                date_of_joining = datetime.strptime(row['date_of_joining'], '%Y-%m-%d').date()
+            except ValueError:
+                errors.append('date_of_joining must be a date in YYYY-MM-DD format')
+
+        if errors:
+            for message in errors:
+                result.add_error(row_number, message)
+            continue
+
+        user = CustomUser(
+            first_name=row['first_name'],
+            last_name=row['last_name'],
+            email=row['email'],
+            username=row['username'],
+            user_type='2',
+        )
+        employee = Employee(
+            address=row['address'] or 'Not provided',
+            gender=row['gender'],
+            employee_type=employee_type,
+            department_id=department_id,
+            employee_id=row['employee_id'] or None,
+            phone_number=row['phone_number'] or None,
+            date_of_joining=date_of_joining,
+        )
+        valid.append((row_number, user, employee, row['password'] or None))
+    return valid
+
+
+def import_employees(rows, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE, workers=None):
+    """
+    Validate and create employee accounts in bulk
+
+    Args:
+        rows: Rows as returned by read_import_file
+        dry_run: Only validate; nothing is written
+        chunk_size: Rows inserted per transaction
+        workers: Password hashing processes (default: one per CPU)
+
+    Returns:
+        ImportResult: Employees created (or, on a dry run, that would be)
+            and the errors of every rejected row
+    """
+    result = ImportResult()
+    valid = validate_import_rows(rows, result)
+    if dry_run or not valid:
+        result.created = [employee for _, _, employee, _ in valid]
+        return result
+
+    for (_, user, _, _), encoded in zip(valid, hash_passwords((row[3] for row in valid), workers)):
+        user.password = encoded
+
+    # One block of IDs for the whole file, skipping the IDs it gives itself
+    missing_ids = [employee for _, _, employee, _ in valid if not employee.employee_id]
+    generated_ids = Employee.generate_employee_ids(
+        len(missing_ids), taken=[employee.employee_id for _, _, employee, _ in valid if employee.employee_id]
+    )
+    for employee, employee_id in zip(missing_ids, generated_ids):
+        employee.employee_id = employee_id
+
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            with transaction.atomic():
+                users = CustomUser.objects.bulk_create([user for _, user, _, _ in chunk])
+                if any(user.pk is None for user in users):
+                    # Databases that cannot return ids from a bulk insert
+                    ids = dict(CustomUser.objects.filter(
+                        username__in=[user.username for user in users]
+                    ).values_list('username', 'id'))
+                    for user in users:
+                        user.pk = ids[user.username]
+                for _, user, employee, _ in chunk:
+                    employee.admin = user
+                Employee.objects.bulk_create([employee for _, _, employee, _ in chunk])
+        except DatabaseError as e:
+            for row_number, _, _, _ in chunk:
+                result.add_error(row_number, f'Not saved: {e}')
+            continue
+        result.created.extend(employee for _, _, employee, _ in chunk)
+
+    # bulk_create sends no post_save signals; see the module docstring
+    if result.created:
+        from .analytics_utils import schedule_analytics_invalidation
+        schedule_analytics_invalidation()
+    return result
@@ -1,14 +1,26 @@
 """
 Utility functions for leave management
 """
-from datetime import date, timedelta
-from django.db.models import Q
-from slmsapp.models import LeaveBalance, Employee_Leave, PublicHoliday
+from datetime import date
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from slmsapp.models import LeaveBalance, LeaveLedgerEntry, Employee_Leave
+from .calendar_utils import (
+    calendar_for_department, calendar_for_employee, count_working_days, count_working_days_by_year,
+    get_holiday_dates, get_weekmask
+)
 
 
 def calculate_working_days(from_date, to_date, employee=None):
     """
     Calculate working days between two dates, excluding weekends and public holidays
+
+    Backed by the compiled calendar in calendar_utils, so the cost does not
+    depend on the length of the range. The employee's department decides
+    which holiday calendar and work week apply.
     
     Args:
         from_date: Start date
@@ -18,36 +30,287 @@ def calculate_working_days(from_date, to_date, employee=None):
     Returns:
         int: Number of working days
     """
-    if from_date > to_date:
-        return 0
-    
-    working_days = 0
-    current_date = from_date
-    
-    # Get public holidays in the date range
-    holidays = PublicHoliday.objects.filter(
-        date__gte=from_date,
-        date__lte=to_date,
-        is_active=True
-    ).values_list('date', flat=True)
-    
-    while current_date <= to_date:
-        # Check if not weekend (Saturday=5, Sunday=6)
-        if current_date.weekday() < 5:
-            # Check if not a holiday
-            if current_date not in holidays:
-                working_days += 1
-        current_date += timedelta(days=1)
-    
-    return working_days
+    return count_working_days(from_date, to_date, calendar_for_employee(employee))
+
+
+def calculate_working_days_by_year(from_date, to_date, employee=None):
+    """
+    Calculate working days between two dates, split by the year they fall in
 
+    Args:
+        from_date: Start date
+        to_date: End date
+        employee: Employee object (optional, for department-specific holidays)
 
-def update_leave_balance_on_approval(leave):
+    Returns:
+        dict: {year: working days}, only years with at least one working day
+    """
+    return count_working_days_by_year(from_date, to_date, calendar_for_employee(employee))
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _as_day_array(ranges):
+    """Convert date pairs to an (N, 2) datetime64[D] array"""
+    if isinstance(ranges, np.ndarray):
+        return ranges.astype('datetime64[D]').reshape(-1, 2)
+    # Going through ordinals is an order of magnitude faster than letting
+    # numpy parse date objects one by one
+    ranges = list(ranges)
+    ordinals = np.fromiter(
+        (day.toordinal() for pair in ranges for day in pair),
+        dtype=np.int64,
+        count=2 * len(ranges)
+    )
+    return (ordinals - _EPOCH_ORDINAL).astype('datetime64[D]').reshape(-1, 2)
+
+
+def calculate_working_days_bulk(ranges, calendar_id=None):
+    """
+    Calculate working days for many date ranges in one vectorized pass
+
+    Holidays for every year the ranges touch are loaded once, then numpy's
+    busday arithmetic counts all ranges together. Empty or inverted ranges
+    count as 0, matching calculate_working_days.
+
+    Args:
+        ranges: Sequence of (from_date, to_date) pairs, or an (N, 2) array
+            of datetime64 values
+        calendar_id: HolidayCalendar id the ranges are counted against,
+            None for the default calendar
+
+    Returns:
+        numpy.ndarray: Working day counts (int64), one per range
+    """
+    ranges = _as_day_array(ranges)
+    if not len(ranges):
+        return np.zeros(0, dtype=np.int64)
+
+    starts = ranges[:, 0]
+    ends = ranges[:, 1]
+    first_year = int(starts.min().astype('datetime64[Y]').astype(int)) + 1970
+    last_year = int(ends.max().astype('datetime64[Y]').astype(int)) + 1970
+
+    holidays = np.array(
+        get_holiday_dates(first_year, max(first_year, last_year), calendar_id),
+        dtype='datetime64[D]'
+    )
+    counts = np.busday_count(starts, ends + 1, weekmask=get_weekmask(calendar_id), holidays=holidays)
+    return np.maximum(counts, 0).astype(np.int64)
+
+
+def working_days_by_leave(leaves):
+    """
+    Count the working days of many leaves at once
+
+    Args:
+        leaves: Employee_Leave queryset
+
+    Returns:
+        dict: {leave id: working days}, each leave counted against its
+            employee's holiday calendar
+    """
+    rows = list(leaves.values_list('id', 'from_date', 'to_date', 'employee_id__department_id'))
+    if not rows:
+        return {}
+
+    leave_ids, from_dates, to_dates, department_ids = zip(*rows)
+    ranges = _as_day_array(zip(from_dates, to_dates))
+    calendars = np.array(
+        [calendar_for_department(department_id) or 0 for department_id in department_ids],
+        dtype=np.int64
+    )
+    days = np.zeros(len(rows), dtype=np.int64)
+    for calendar_id in np.unique(calendars).tolist():
+        in_calendar = calendars == calendar_id
+        days[in_calendar] = calculate_working_days_bulk(ranges[in_calendar], calendar_id or None)
+    return dict(zip(leave_ids, days.tolist()))
+
+
+def working_days_by_balance(leaves):
+    """
+    Sum the working days of many leaves per balance row
+
+    The leaves are read in one query, cut into one segment per calendar
+    year they touch, counted with the bulk calculator once per holiday
+    calendar and grouped with numpy, so the cost grows with the number of
+    leaves rather than with the number of balances.
+
+    Args:
+        leaves: Employee_Leave queryset
+
+    Returns:
+        dict: {(employee_id, leave_type_id, year): working days}, with a
+            leave spanning New Year counted in both years
+    """
+    rows = list(
+        leaves.filter(leave_type__isnull=False).values_list(
+            'employee_id', 'leave_type_id', 'from_date', 'to_date', 'employee_id__department_id'
+        )
+    )
+    if not rows:
+        return {}
+
+    employee_ids, leave_type_ids, from_dates, to_dates, department_ids = zip(*rows)
+    ranges = _as_day_array(zip(from_dates, to_dates))
+    calendars = np.array(
+        [calendar_for_department(department_id) or 0 for department_id in department_ids],
+        dtype=np.int64
+    )
+
+    # One segment per leave and year, clipped to that year
+    start_years = ranges[:, 0].astype('datetime64[Y]')
+    segments = np.maximum((ranges[:, 1].astype('datetime64[Y]') - start_years).astype(np.int64) + 1, 1)
+    row_of_segment = np.repeat(np.arange(len(rows)), segments)
+    offsets = np.arange(len(row_of_segment)) - np.repeat(np.cumsum(segments) - segments, segments)
+    years = start_years[row_of_segment] + offsets
+    starts = np.maximum(ranges[row_of_segment, 0], years.astype('datetime64[D]'))
+    ends = np.minimum(ranges[row_of_segment, 1], (years + 1).astype('datetime64[D]') - 1)
+    segment_ranges = np.column_stack([starts, ends])
+    segment_calendars = calendars[row_of_segment]
+
+    days = np.zeros(len(row_of_segment), dtype=np.int64)
+    for calendar_id in np.unique(segment_calendars).tolist():
+        in_calendar = segment_calendars == calendar_id
+        days[in_calendar] = calculate_working_days_bulk(segment_ranges[in_calendar], calendar_id or None)
+
+    keys = np.column_stack([
+        np.array(employee_ids, dtype=np.int64)[row_of_segment],
+        np.array(leave_type_ids, dtype=np.int64)[row_of_segment],
+        years.astype(np.int64) + 1970,
+    ])
+    groups, group_of_segment = np.unique(keys, axis=0, return_inverse=True)
+    totals = np.bincount(group_of_segment.ravel(), weights=days, minlength=len(groups)).astype(np.int64)
+    return {tuple(group): total for group, total in zip(groups.tolist(), totals.tolist())}
+
+
+def apply_balance_change(employee_id, leave_type_id, year, days_used=0, days_entitled=0):
+    """
+    Move a leave balance by the given deltas in a single UPDATE statement
+
+    The row is created on first use. Concurrent callers never overwrite each
+    other because the database computes the new values from the ones it
+    currently holds.
+
+    Args:
+        employee_id: Employee primary key
+        leave_type_id: LeaveType primary key
+        year: Balance year
+        days_used: Change to days_used
+        days_entitled: Change to days_entitled
+    """
+    balance, _ = LeaveBalance.objects.get_or_create(
+        employee_id=employee_id,
+        leave_type_id=leave_type_id,
+        year=year
+    )
+    # days_remaining goes first so it is computed from the old values on
+    # databases that apply SET clauses left to right
+    LeaveBalance.objects.filter(pk=balance.pk).update(
+        days_remaining=Greatest(
+            F('days_entitled') + days_entitled - F('days_used') - days_used,
+            Value(0)
+        ),
+        days_entitled=F('days_entitled') + days_entitled,
+        days_used=F('days_used') + days_used,
+        updated_at=timezone.now()
+    )
+
+
+def post_ledger_entries(entries):
+    """
+    Append ledger entries and apply them to their balances atomically
+
+    Args:
+        entries: Unsaved LeaveLedgerEntry instances
+
+    Returns:
+        bool: False if one of the entry keys was already posted, in which
+            case nothing is written
+    """
+    try:
+        with transaction.atomic():
+            for entry in entries:
+                entry.save()
+                if entry.entry_type == LeaveLedgerEntry.ACCRUAL:
+                    apply_balance_change(entry.employee_id, entry.leave_type_id, entry.year, days_entitled=entry.days)
+                else:
+                    apply_balance_change(entry.employee_id, entry.leave_type_id, entry.year, days_used=entry.days)
+    except IntegrityError:
+        return False
+    return True
+
+
+def set_balance_entitlement(employee, leave_type, year, days, user=None):
+    """
+    Set the days entitled on a balance, recording the change as an accrual
+
+    Args:
+        employee: Employee instance
+        leave_type: LeaveType instance
+        year: Balance year
+        days: New number of days entitled
+        user: CustomUser making the change (optional)
+    """
+    with transaction.atomic():
+        balance, _ = LeaveBalance.objects.get_or_create(
+            employee=employee,
+            leave_type=leave_type,
+            year=year
+        )
+        current = LeaveBalance.objects.select_for_update().values_list(
+            'days_entitled', flat=True
+        ).get(pk=balance.pk)
+        change = int(days) - current
+        if change:
+            post_ledger_entries([LeaveLedgerEntry(
+                employee=employee,
+                leave_type=leave_type,
+                year=year,
+                entry_type=LeaveLedgerEntry.ACCRUAL,
+                days=change,
+                created_by=user
+            )])
+
+
+def _latest_debits(leave):
+    """
+    Debit entries of a leave's latest approval and whether they were reversed
+
+    Returns:
+        tuple: (cycle, debit entries, reversed) with cycle 0 if never debited
+    """
+    entries = list(
+        LeaveLedgerEntry.objects.filter(
+            leave=leave,
+            entry_type__in=[LeaveLedgerEntry.DEBIT, LeaveLedgerEntry.REVERSAL]
+        )
+    )
+    cycle = max((entry.cycle for entry in entries), default=0)
+    debits = [
+        entry for entry in entries
+        if entry.cycle == cycle and entry.entry_type == LeaveLedgerEntry.DEBIT
+    ]
+    reversed_ = any(
+        entry.cycle == cycle and entry.entry_type == LeaveLedgerEntry.REVERSAL
+        for entry in entries
+    )
+    return cycle, debits, reversed_
+
+
+def update_leave_balance_on_approval(leave, user=None):
     """
     Update leave balance when leave is approved
     
+    Posts a debit to the leave ledger for every year the leave's working
+    days fall in, against that year's balance. Debits are keyed by the leave
+    and its approval round, so approving the same leave twice (for example
+    by the department head and HR at the same time) only debits once.
+    
     Args:
         leave: Employee_Leave instance
+        user: CustomUser approving the leave (optional)
     
     Returns:
         bool: True if balance was updated, False otherwise
@@ -55,43 +318,43 @@ def update_leave_balance_on_approval(leave):
     if not leave.leave_type:
         return False
     
-    # Calculate working days
-    working_days = calculate_working_days(leave.from_date, leave.to_date, leave.employee_id)
+    # Working days taken in each year the leave touches
+    days_by_year = calculate_working_days_by_year(leave.from_date, leave.to_date, leave.employee_id)
     
-    if working_days <= 0:
+    if not days_by_year:
         return False
     
-    # Get or create leave balance for current year
-    current_year = date.today().year
-    leave_balance, created = LeaveBalance.objects.get_or_create(
-        employee=leave.employee_id,
-        leave_type=leave.leave_type,
-        year=current_year,
-        defaults={
-            'days_entitled': 0,
-            'days_used': working_days,
-            # Store a non-negative default; model save will recalc precisely
-            'days_remaining': 0
-        }
-    )
-    
-    # Update days used
-    if not created:
-        leave_balance.days_used += working_days
-        leave_balance.save()  # This will recalculate days_remaining
-    else:
-        # Ensure model-level recalculation is applied after creation
-        leave_balance.save()
+    cycle, debits, reversed_ = _latest_debits(leave)
+    if debits and not reversed_:
+        return False
     
-    return True
+    cycle += 1
+    return post_ledger_entries([
+        LeaveLedgerEntry(
+            employee_id=leave.employee_id_id,
+            leave_type_id=leave.leave_type_id,
+            year=year,
+            leave=leave,
+            entry_type=LeaveLedgerEntry.DEBIT,
+            days=working_days,
+            cycle=cycle,
+            key=f'leave:{leave.pk}:debit:{cycle}:{year}',
+            created_by=user
+        )
+        for year, working_days in days_by_year.items()
+    ])
 
 
-def revert_leave_balance_on_rejection(leave):
+def revert_leave_balance_on_rejection(leave, user=None):
     """
     Revert leave balance when leave is rejected (if it was previously approved)
     
+    Posts reversals mirroring the debits of the leave's latest approval, so
+    the exact amounts debited are returned even if holidays changed since.
+    
     Args:
         leave: Employee_Leave instance
+        user: CustomUser rejecting the leave (optional)
     
     Returns:
         bool: True if balance was reverted, False otherwise
@@ -103,30 +366,24 @@ def revert_leave_balance_on_rejection(leave):
     if leave.status != 2:  # Only if currently rejected
         return False
     
-    # Calculate working days
-    working_days = calculate_working_days(leave.from_date, leave.to_date, leave.employee_id)
-    
-    if working_days <= 0:
+    cycle, debits, reversed_ = _latest_debits(leave)
+    if not debits or reversed_:
         return False
     
-    # Get leave balance for current year
-    current_year = date.today().year
-    try:
-        leave_balance = LeaveBalance.objects.get(
-            employee=leave.employee_id,
-            leave_type=leave.leave_type,
-            year=current_year
+    return post_ledger_entries([
+        LeaveLedgerEntry(
+            employee_id=debit.employee_id,
+            leave_type_id=debit.leave_type_id,
+            year=debit.year,
+            leave=leave,
+            entry_type=LeaveLedgerEntry.REVERSAL,
+            days=-debit.days,
+            cycle=cycle,
+            key=f'leave:{leave.pk}:reversal:{cycle}:{debit.year}',
+            created_by=user
         )
-        
-        # Revert days used (only if it was previously approved)
-        if leave_balance.days_used >= working_days:
-            leave_balance.days_used -= working_days
-            leave_balance.save()  # This will recalculate days_remaining
-            return True
-    except LeaveBalance.DoesNotExist:
-        pass
-    
-    return False
+        for debit in debits
+    ])
 
 
 def check_overlapping_leave(employee, from_date, to_date, exclude_leave_id=None):
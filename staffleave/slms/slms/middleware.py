@@ -1,6 +1,8 @@
 """
 Middleware for cache control and security headers
 """
+from .decorators import revalidation_headers
+
 
 class NoCacheMiddleware:
     """
@@ -15,7 +17,9 @@ class NoCacheMiddleware:
     5. Private directive (only for user)
     
     Applies to all authenticated requests to prevent browser caching of 
-    sensitive pages containing user data.
+    sensitive pages containing user data. Responses marked with the
+    allow_revalidation decorator keep their ETag and Last-Modified headers
+    so browsers can revalidate them instead.
     """
     
     def __init__(self, get_response):
@@ -24,6 +28,10 @@ class NoCacheMiddleware:
     def __call__(self, request):
         response = self.get_response(request)
         
+        # Conditional GET responses (chart data) may be revalidated
+        if getattr(response, 'allow_revalidation', False):
+            return revalidation_headers(response)
+        
         # Apply aggressive no-cache headers to all authenticated requests
         if request.user.is_authenticated:
             # Cache-Control: Most important - tells browsers and proxies not to cache
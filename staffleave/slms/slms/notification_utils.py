@@ -1,8 +1,35 @@
 """
 Utility functions for notification management
 """
+import uuid
+from collections import defaultdict
 from datetime import date
-from slmsapp.models import Notification, Employee_Leave, CustomUser
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from slmsapp.models import Broadcast, Notification, Employee_Leave, CustomUser, DepartmentHead, Employee
+
+# Notifications inserted per INSERT statement by send_notifications
+NOTIFICATION_CHUNK_SIZE = 2000
+
+# Unread counts are cached per user; CustomUser.unread_notifications is the
+# durable copy the cache is refilled from. A cached count is stored under
+# the user's current generation, which every change replaces: a count read
+# from the database before a change lands under the old generation and is
+# never served. The timeout bounds how late the badge can be in a process
+# whose cache did not see the change (see CACHES in settings).
+UNREAD_COUNT_CACHE_KEY = 'slms_unread_notifications_{}_{}'
+UNREAD_COUNT_GENERATION_KEY = 'slms_unread_notifications_generation_{}'
+UNREAD_COUNT_TIMEOUT = 60
+
+AUDIENCE_CHOICES = [
+    ('selected', 'Selected users'),
+    ('everyone', 'Everyone'),
+    ('role', 'Everyone with a role'),
+    ('department', 'Everyone in a department'),
+]
 
 
 def send_notification(sender, recipient, title, message, notification_type='info'):
@@ -19,27 +46,234 @@ def send_notification(sender, recipient, title, message, notification_type='info
     Returns:
         Notification: Created notification instance
     """
-    notification = Notification.objects.create(
-        sender=sender,
-        recipient=recipient,
-        title=title,
-        message=message,
-        notification_type=notification_type,
-        is_active=True
-    )
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(
+            sender=sender,
+            title=title,
+            message=message,
+            notification_type=notification_type
+        )
+        notification = Notification.objects.create(
+            broadcast=broadcast,
+            sender=sender,
+            recipient=recipient,
+            notification_type=notification_type,
+            is_active=True
+        )
+        change_unread_counts([recipient.pk], 1)
     return notification
 
 
+def audience_recipients(audience, sender=None, role=None, department=None, recipients=None):
+    """
+    Active users in an audience, as a queryset resolved by the database
+
+    Args:
+        audience: One of AUDIENCE_CHOICES
+        sender: User left out of the audience
+        role: user_type, for the 'role' audience
+        department: Department, for the 'department' audience; its
+            employees and department heads
+        recipients: Users (or their ids), for the 'selected' audience
+
+    Returns:
+        QuerySet: CustomUser
+    """
+    users = CustomUser.objects.filter(is_active=True)
+    if audience == 'role':
+        users = users.filter(user_type=role)
+    elif audience == 'department':
+        users = users.filter(
+            Q(id__in=Employee.objects.filter(department=department).values('admin_id'))
+            | Q(id__in=DepartmentHead.objects.filter(department=department).values('admin_id'))
+        )
+    elif audience == 'selected':
+        users = users.filter(id__in=[getattr(user, 'pk', user) for user in recipients or []])
+    elif audience != 'everyone':
+        raise ValueError(f'Unknown audience "{audience}"')
+    if sender:
+        users = users.exclude(id=sender.id)
+    return users
+
+
+def send_notifications(sender, recipients, title, message, notification_type='info', chunk_size=NOTIFICATION_CHUNK_SIZE):
+    """
+    Send the same notification to many users at once
+
+    The title and message are stored once, in a Broadcast. Recipient ids
+    are read with one query and a slim Notification per recipient is
+    inserted with bulk_create, chunk_size rows per statement, in one
+    transaction: everybody gets the notification or nobody does.
+
+    Args:
+        sender: CustomUser instance (sender)
+        recipients: QuerySet of CustomUser, e.g. from audience_recipients
+        title: Notification title
+        message: Notification message
+        notification_type: Type of notification (info, warning, success, error, reminder)
+        chunk_size: Rows per INSERT statement
+
+    Returns:
+        int: Number of notifications sent
+    """
+    recipient_ids = list(recipients.order_by().values_list('id', flat=True).distinct())
+    if not recipient_ids:
+        return 0
+    with transaction.atomic():
+        broadcast = Broadcast.objects.create(
+            sender=sender,
+            title=title,
+            message=message,
+            notification_type=notification_type
+        )
+        for start in range(0, len(recipient_ids), chunk_size):
+            Notification.objects.bulk_create([
+                Notification(
+                    broadcast_id=broadcast.id,
+                    sender_id=sender.id,
+                    recipient_id=recipient_id,
+                    notification_type=notification_type,
+                    is_active=True
+                )
+                for recipient_id in recipient_ids[start:start + chunk_size]
+            ])
+        change_unread_counts(
+            recipient_ids, 1,
+            users=CustomUser.objects.filter(id__in=Notification.objects.filter(broadcast=broadcast).values('recipient_id'))
+        )
+    return len(recipient_ids)
+
+
+def unread_count(user):
+    """
+    Number of unread notifications of a user, without counting them
+
+    Read from the cache, or from CustomUser.unread_notifications when the
+    cache does not have it.
+    """
+    generation_key = UNREAD_COUNT_GENERATION_KEY.format(user.pk)
+    generation = cache.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, uuid.uuid4().hex, None)
+        generation = cache.get(generation_key)
+    key = UNREAD_COUNT_CACHE_KEY.format(user.pk, generation)
+    count = cache.get(key)
+    if count is None:
+        count = CustomUser.objects.filter(pk=user.pk).values_list('unread_notifications', flat=True).first() or 0
+        cache.add(key, count, UNREAD_COUNT_TIMEOUT)
+    return count
+
+
+def _new_unread_generations(user_ids):
+    """Stop serving the cached counts of some users, once the transaction commits"""
+    generation_keys = [UNREAD_COUNT_GENERATION_KEY.format(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in generation_keys}, None))
+
+
+def change_unread_counts(user_ids, delta, users=None):
+    """
+    Add delta to the unread count of some users
+
+    The column is updated in the database (never below zero) and the
+    cached counts are replaced once the surrounding transaction commits,
+    so a rolled back change is never seen.
+
+    Args:
+        user_ids: Ids of the users
+        delta: Added to each count
+        users: QuerySet of the same users, to update them with one
+            statement instead of listing user_ids in it
+    """
+    user_ids = list(user_ids)
+    if not user_ids or not delta:
+        return
+    value = F('unread_notifications') + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    if users is not None:
+        users.update(unread_notifications=value)
+    else:
+        for start in range(0, len(user_ids), NOTIFICATION_CHUNK_SIZE):
+            CustomUser.objects.filter(id__in=user_ids[start:start + NOTIFICATION_CHUNK_SIZE]).update(unread_notifications=value)
+    _new_unread_generations(user_ids)
+
+
+def set_notifications_read(recipient, notifications, is_read=True):
+    """
+    Mark some of a user's notifications read, or unread again
+
+    Args:
+        recipient: CustomUser (or id) the notifications were sent to
+        notifications: QuerySet of Notification; others' are left alone
+        is_read: False to mark them unread
+
+    Returns:
+        int: Number of notifications that changed
+    """
+    recipient_id = getattr(recipient, 'pk', recipient)
+    now = timezone.now()
+    with transaction.atomic():
+        # The UPDATE only matches rows still in the other state, so two
+        # requests marking the same notification cannot count it twice
+        changed = notifications.filter(recipient_id=recipient_id, is_read=not is_read).update(
+            is_read=is_read, read_at=now if is_read else None, updated_at=now
+        )
+        change_unread_counts([recipient_id], -changed if is_read else changed)
+    return changed
+
+
+def delete_notifications(notifications):
+    """
+    Delete notifications, taking the unread ones off their recipients' counts
+
+    Returns:
+        int: Number of notifications deleted
+    """
+    with transaction.atomic():
+        unread = notifications.filter(is_read=False).select_for_update()
+        per_recipient = defaultdict(int)
+        for recipient_id in unread.values_list('recipient_id', flat=True):
+            per_recipient[recipient_id] += 1
+        deleted, _ = notifications.delete()
+        by_count = defaultdict(list)
+        for recipient_id, count in per_recipient.items():
+            by_count[count].append(recipient_id)
+        for count, recipient_ids in by_count.items():
+            change_unread_counts(recipient_ids, -count)
+    return deleted
+
+
+def rebuild_unread_counts():
+    """
+    Recount every user's unread notifications, e.g. after notifications
+    were removed outside these functions (deleting a sender, the admin site)
+
+    Returns:
+        int: Number of users updated
+    """
+    unread = (
+        Notification.objects.filter(recipient=OuterRef('pk'), is_read=False)
+        .order_by().values('recipient').annotate(count=Count('id')).values('count')
+    )
+    with transaction.atomic():
+        updated = CustomUser.objects.update(unread_notifications=Coalesce(Subquery(unread), 0))
+        _new_unread_generations(CustomUser.objects.values_list('id', flat=True).iterator())
+    return updated
+
+
 def notify_leave_approved(leave, approved_by_user=None):
     """
-    Send notification to employee when their leave application is approved
+    Queue a notification to the employee when their leave application is approved
+
+    The notification goes through the outbox, so calling this inside the
+    approval's transaction only sends it if the approval is committed.
     
     Args:
         leave: Employee_Leave instance that was approved
         approved_by_user: CustomUser instance who approved the leave
     
     Returns:
-        Notification: Created notification instance or None
+        OutboxMessage: Queued notification or None
     """
     if not leave.employee_id or not leave.employee_id.admin:
         return None
@@ -63,15 +297,14 @@ def notify_leave_approved(leave, approved_by_user=None):
     title = f"Leave Approved - {leave.leave_type_name or 'Leave'}"
     message = f"Your leave application from {leave.from_date.strftime('%b %d, %Y')} to {leave.to_date.strftime('%b %d, %Y')} has been approved by {approval_stage}. You have {leave.from_date.strftime('%A, %B %d')} to {leave.to_date.strftime('%A, %B %d')} off."
     
-    notification = send_notification(
+    from .outbox_utils import enqueue_notification
+    return enqueue_notification(
         sender=sender,
         recipient=leave.employee_id.admin,
         title=title,
         message=message,
         notification_type='success'
     )
-    
-    return notification
 
 
 def notify_leave_ended(leave):
@@ -3,11 +3,14 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from django.db.models import Count, Q
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from slmsapp.models import Notification, CustomUser
+from slmsapp.models import Broadcast, Notification, CustomUser
 from slmsapp.forms import NotificationForm, BulkNotificationForm
 from .decorators import admin_required, hr_required, department_head_required, role_required
+from . import notification_utils
 import json
 
 
@@ -18,9 +21,13 @@ def send_notification(request):
     if request.method == 'POST':
         form = NotificationForm(request.POST, sender=request.user)
         if form.is_valid():
-            notification = form.save(commit=False)
-            notification.sender = request.user
-            notification.save()
+            notification = notification_utils.send_notification(
+                sender=request.user,
+                recipient=form.cleaned_data['recipient'],
+                title=form.cleaned_data['title'],
+                message=form.cleaned_data['message'],
+                notification_type=form.cleaned_data['notification_type'],
+            )
             messages.success(request, f'Notification sent successfully to {notification.recipient.username}')
             return redirect('notification_sent_list')
     else:
@@ -41,32 +48,26 @@ def send_bulk_notification(request):
     if request.method == 'POST':
         form = BulkNotificationForm(request.POST, sender=request.user)
         if form.is_valid():
-            recipients = form.cleaned_data['recipients']
-            title = form.cleaned_data['title']
-            message = form.cleaned_data['message']
-            notification_type = form.cleaned_data['notification_type']
-
-            # Create notifications for each recipient
-            notifications_created = 0
-            for recipient in recipients:
-                Notification.objects.create(
-                    title=title,
-                    message=message,
-                    notification_type=notification_type,
-                    sender=request.user,
-                    recipient=recipient
-                )
-                notifications_created += 1
-
-            messages.success(request, f'Successfully sent {notifications_created} notifications')
-            return redirect('notification_sent_list')
+            notifications_created = notification_utils.send_notifications(
+                sender=request.user,
+                recipients=form.get_recipients(),
+                title=form.cleaned_data['title'],
+                message=form.cleaned_data['message'],
+                notification_type=form.cleaned_data['notification_type'],
+            )
+            if notifications_created:
+                messages.success(request, f'Successfully sent {notifications_created} notifications')
+                return redirect('notification_sent_list')
+            messages.warning(request, 'Nobody matches the chosen recipients; nothing was sent')
     else:
         form = BulkNotificationForm(sender=request.user)
 
     context = {
         'form': form,
+        # Chosen recipients are shown again when the form has errors
+        'selected_recipients': getattr(form, 'cleaned_data', {}).get('recipients') or [],
         'title': 'Send Bulk Notification',
-        'submit_button': 'Send to All Selected'
+        'submit_button': 'Send Notification'
     }
     return render(request, 'notification/send_bulk_notification.html', context)
 
@@ -81,7 +82,7 @@ def notification_list(request):
     # Base queryset
     notifications = Notification.objects.filter(
         recipient=request.user
-    ).select_related('sender')
+    ).select_related('sender', 'broadcast')
 
     # Apply filters
     if filter_type != 'all':
@@ -103,10 +104,7 @@ def notification_list(request):
         notifications_page = paginator.page(paginator.num_pages)
 
     # Count for badges
-    unread_count = Notification.objects.filter(
-        recipient=request.user,
-        is_read=False
-    ).count()
+    unread_count = notification_utils.unread_count(request.user)
 
     # Type counts
     type_counts = notifications.aggregate(
@@ -130,21 +128,22 @@ def notification_list(request):
 
 @login_required(login_url='/')
 def sent_notifications(request):
-    """View to display sent notifications"""
+    """View to display sent notifications, one line per broadcast with its read receipts"""
     # Get filter parameters
     filter_type = request.GET.get('type', 'all')
+    sort = request.GET.get('sort', 'recent')
 
     # Base queryset
-    notifications = Notification.objects.filter(
-        sender=request.user
-    ).select_related('recipient')
+    broadcasts = Broadcast.objects.filter(sender=request.user)
 
     # Apply filters
     if filter_type != 'all':
-        notifications = notifications.filter(notification_type=filter_type)
+        broadcasts = broadcasts.filter(notification_type=filter_type)
+    if sort == 'oldest':
+        broadcasts = broadcasts.order_by('created_at')
 
     # Pagination
-    paginator = Paginator(notifications, 20)
+    paginator = Paginator(broadcasts, 20)
     page = request.GET.get('page')
 
     try:
@@ -154,19 +153,45 @@ def sent_notifications(request):
     except EmptyPage:
         notifications_page = paginator.page(paginator.num_pages)
 
+    # Read receipts of the broadcasts on this page, in one grouped query
+    page_ids = [broadcast.id for broadcast in notifications_page]
+    receipts = {
+        row['broadcast']: row
+        for row in Notification.objects.filter(broadcast__in=page_ids).values('broadcast').annotate(
+            recipient_count=Count('id'),
+            read_count=Count('id', filter=Q(is_read=True)),
+            first_recipient=Min('recipient'),
+        )
+    }
+    single_recipients = CustomUser.objects.in_bulk([
+        row['first_recipient'] for row in receipts.values() if row['recipient_count'] == 1
+    ])
+    for broadcast in notifications_page:
+        row = receipts.get(broadcast.id, {})
+        broadcast.recipient_count = row.get('recipient_count', 0)
+        broadcast.read_count = row.get('read_count', 0)
+        broadcast.unread_count = broadcast.recipient_count - broadcast.read_count
+        broadcast.recipient = single_recipients.get(row.get('first_recipient')) if broadcast.recipient_count == 1 else None
+
     # Type counts
-    type_counts = notifications.aggregate(
+    type_counts = broadcasts.aggregate(
         info_count=Count('id', filter=Q(notification_type='info')),
         warning_count=Count('id', filter=Q(notification_type='warning')),
         success_count=Count('id', filter=Q(notification_type='success')),
         error_count=Count('id', filter=Q(notification_type='error')),
         reminder_count=Count('id', filter=Q(notification_type='reminder')),
     )
+    delivery_counts = Notification.objects.filter(broadcast__in=broadcasts).aggregate(
+        recipient_count=Count('id'),
+        read_count=Count('id', filter=Q(is_read=True)),
+    )
 
     context = {
         'notifications': notifications_page,
         'type_counts': type_counts,
+        'delivery_counts': delivery_counts,
         'filter_type': filter_type,
+        'sort': sort,
         'title': 'Sent Notifications'
     }
     return render(request, 'notification/sent_notifications.html', context)
@@ -176,7 +201,7 @@ def sent_notifications(request):
 def notification_detail(request, pk):
     """View to display notification detail and mark as read"""
     notification = get_object_or_404(
-        Notification,
+        Notification.objects.select_related('sender', 'broadcast'),
         pk=pk,
         recipient=request.user
     )
@@ -222,12 +247,9 @@ def mark_multiple_as_read(request):
         notification_ids = request.POST.getlist('notification_ids[]')
 
         if notification_ids:
-            notifications = Notification.objects.filter(
-                id__in=notification_ids,
-                recipient=request.user,
-                is_read=False
+            count = notification_utils.set_notifications_read(
+                request.user, Notification.objects.filter(id__in=notification_ids)
             )
-            count = notifications.update(is_read=True)
 
             return JsonResponse({
                 'status': 'success',
@@ -248,35 +270,48 @@ def mark_multiple_as_read(request):
 @login_required(login_url='/')
 @require_POST
 def delete_notification(request, pk):
-    """AJAX view to soft delete a notification"""
-    try:
-        notification = Notification.objects.get(
-            pk=pk,
-            recipient=request.user
-        )
-        notification.delete()
-
+    """AJAX view to delete a notification"""
+    deleted = notification_utils.delete_notifications(
+        Notification.objects.filter(pk=pk, recipient=request.user)
+    )
+    if not deleted:
         return JsonResponse({
-            'status': 'success',
-            'message': 'Notification deleted'
-        })
-    except Notification.DoesNotExist:
+            'status': 'error',
+            'message': 'Notification not found'
+        }, status=404)
+
+    return JsonResponse({
+        'status': 'success',
+        'message': 'Notification deleted'
+    })
+
+
+@login_required(login_url='/')
+@require_POST
+def delete_broadcast(request, pk):
+    """AJAX view to delete a sent notification for all of its recipients"""
+    with transaction.atomic():
+        broadcasts = Broadcast.objects.filter(pk=pk, sender=request.user)
+        # Through delete_notifications, so the unread ones come off their recipients' counts
+        notification_utils.delete_notifications(Notification.objects.filter(broadcast__in=broadcasts))
+        deleted, _ = broadcasts.delete()
+    if not deleted:
         return JsonResponse({
             'status': 'error',
             'message': 'Notification not found'
         }, status=404)
 
+    return JsonResponse({
+        'status': 'success',
+        'message': 'Notification deleted'
+    })
+
 
 @login_required(login_url='/')
 def get_unread_count(request):
     """AJAX view to get unread notification count"""
-    unread_count = Notification.objects.filter(
-        recipient=request.user,
-        is_read=False
-    ).count()
-
     return JsonResponse({
-        'unread_count': unread_count
+        'unread_count': notification_utils.unread_count(request.user)
     })
 
 
@@ -287,7 +322,7 @@ def get_recent_notifications(request):
 
     notifications = Notification.objects.filter(
         recipient=request.user
-    ).select_related('sender')[:limit]
+    ).select_related('sender', 'broadcast')[:limit]
 
     notifications_data = []
     for notification in notifications:
@@ -331,13 +366,12 @@ def quick_send_notification(request):
         recipient = CustomUser.objects.get(id=recipient_id, is_active=True)
         
         # Create notification
-        notification = Notification.objects.create(
+        notification = notification_utils.send_notification(
             sender=request.user,
             recipient=recipient,
             title=f"Message from {request.user.get_full_name() or request.user.username}",
             message=message,
-            notification_type='info',
-            is_active=True
+            notification_type='info'
         )
         
         return JsonResponse({
@@ -362,6 +396,13 @@ def quick_send_notification(request):
 def get_users_for_notification(request):
     """AJAX view to get list of users for notification dropdown"""
     users = CustomUser.objects.filter(is_active=True).exclude(id=request.user.id).order_by('first_name', 'last_name')
+    # The bulk notification page searches rather than listing everyone
+    query = request.GET.get('q', '').strip()
+    if query:
+        users = users.filter(
+            Q(first_name__icontains=query) | Q(last_name__icontains=query)
+            | Q(username__icontains=query) | Q(email__icontains=query)
+        )[:20]
     
     user_type_map = {
         '1': 'Admin',
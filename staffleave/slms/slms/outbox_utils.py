@@ -0,0 +1,176 @@
+"""
+Outbox of notifications and emails
+
+Views call enqueue_notification / enqueue_email inside the transaction
+that changes the data, which only inserts an OutboxMessage. The
+process_outbox command delivers due messages in batches: every email of
+a batch goes through one mail connection, and a failed delivery is
+retried with exponential backoff until OUTBOX_MAX_ATTEMPTS is reached.
+
+Several workers may run at once: each claims its batch by moving the
+messages' next attempt OUTBOX_LEASE into the future before delivering,
+so a message is only picked up again if its worker died meanwhile. A
+notification is marked sent in the transaction that creates it, so it is
+never delivered twice; emails are marked at the end of the batch, so a
+worker dying mid-batch may send some of its emails again.
+
+An email's body (which may hold a password reset code) is only kept while
+the email may still be delivered: it is cleared from the payload once the
+email is sent or given up on. Sent messages are deleted by purge_outbox
+after OUTBOX_RETENTION; failed ones stay for inspection.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+from slmsapp.models import CustomUser, OutboxMessage
+from .notification_utils import send_notification
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF = timedelta(minutes=1)  # Doubled after every failed attempt
+OUTBOX_LEASE = timedelta(minutes=5)
+OUTBOX_RETENTION = timedelta(days=7)  # How long sent messages are kept
+
+
+def enqueue_notification(sender, recipient, title, message, notification_type='info'):
+    """
+    Queue an in-app notification; see notification_utils.send_notification
+
+    Returns:
+        OutboxMessage: The queued message
+    """
+    return OutboxMessage.objects.create(kind='notification', payload={
+        'sender': sender.pk,
+        'recipient': recipient.pk,
+        'title': title,
+        'message': message,
+        'notification_type': notification_type,
+    })
+
+
+def enqueue_email(subject, message, recipient_list, from_email=None):
+    """
+    Queue an email
+
+    Returns:
+        OutboxMessage: The queued message
+    """
+    return OutboxMessage.objects.create(kind='email', payload={
+        'subject': subject,
+        'message': message,
+        'from_email': from_email or settings.DEFAULT_FROM_EMAIL,
+        'to': list(recipient_list),
+    })
+
+
+def _claim_batch(batch_size, now):
+    """Due messages, leased to this worker"""
+    with transaction.atomic():
+        due = OutboxMessage.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        batch = list(due[:batch_size])
+        OutboxMessage.objects.filter(pk__in=[item.pk for item in batch]).update(next_attempt_at=now + OUTBOX_LEASE)
+    return batch
+
+
+def _deliver_notification(item):
+    """Create the notification and mark the message sent in one transaction"""
+    payload = item.payload
+    users = CustomUser.objects.in_bulk([payload['sender'], payload['recipient']])
+    if payload['sender'] not in users or payload['recipient'] not in users:
+        raise ValueError('Sender or recipient no longer exists')
+    with transaction.atomic():
+        send_notification(
+            sender=users[payload['sender']],
+            recipient=users[payload['recipient']],
+            title=payload['title'],
+            message=payload['message'],
+            notification_type=payload['notification_type'],
+        )
+        item.sent_at = timezone.now()
+        OutboxMessage.objects.filter(pk=item.pk).update(
+            status='sent', attempts=item.attempts, last_error='', sent_at=item.sent_at
+        )
+
+
+def process_outbox(batch_size=OUTBOX_BATCH_SIZE, now=None):
+    """
+    Deliver one batch of due messages
+
+    Args:
+        batch_size: Most messages to deliver
+        now: Current time (for tests)
+
+    Returns:
+        tuple: (messages sent, messages that failed this time)
+    """
+    now = now or timezone.now()
+    batch = _claim_batch(batch_size, now)
+    if not batch:
+        return 0, 0
+
+    mail_connection = None
+    sent = failed = 0
+    try:
+        for item in batch:
+            item.attempts += 1
+            try:
+                if item.kind == 'email':
+                    if mail_connection is None:
+                        # Opened once and reused by every email in the batch
+                        mail_connection = get_connection()
+                        mail_connection.open()
+                    payload = item.payload
+                    EmailMessage(
+                        payload['subject'], payload['message'], payload['from_email'], payload['to'],
+                        connection=mail_connection,
+                    ).send()
+                elif item.kind == 'notification':
+                    _deliver_notification(item)
+                else:
+                    raise ValueError(f'Unknown outbox message kind "{item.kind}"')
+            except Exception as e:
+                failed += 1
+                item.last_error = f'{type(e).__name__}: {e}'
+                if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    item.status = 'failed'
+                else:
+                    item.next_attempt_at = now + OUTBOX_BACKOFF * 2 ** (item.attempts - 1)
+                if mail_connection is not None and item.kind == 'email':
+                    # The connection may be broken; open a fresh one for the next email
+                    try:
+                        mail_connection.close()
+                    except Exception:
+                        pass
+                    mail_connection = None
+            else:
+                sent += 1
+                item.status = 'sent'
+                item.sent_at = item.sent_at or timezone.now()
+                item.last_error = ''
+            if item.kind == 'email' and item.status != 'pending':
+                # Not needed any more, and may hold a password reset code
+                item.payload['message'] = ''
+    finally:
+        if mail_connection is not None:
+            mail_connection.close()
+        OutboxMessage.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at', 'payload'], batch_size=500
+        )
+    return sent, failed
+
+
+def purge_outbox(now=None, retention=OUTBOX_RETENTION):
+    """
+    Delete messages sent more than retention ago
+
+    Returns:
+        int: Messages deleted
+    """
+    now = now or timezone.now()
+    deleted, _ = OutboxMessage.objects.filter(status='sent', sent_at__lt=now - retention).delete()
+    return deleted
@@ -8,12 +8,12 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.forms import SetPasswordForm
 from django.core.cache import cache
-from django.core.mail import send_mail
 from django.shortcuts import redirect, render
 from django.utils import timezone
 from django.views import View
 
 from .auth_utils import validate_password
+from .outbox_utils import enqueue_email
 
 User = get_user_model()
 
@@ -93,12 +93,12 @@ class OTPPasswordResetView(View):
             f"This code expires in {OTP_EXPIRY_MINUTES} minutes.\n\n"
             f"If you did not request this, you can ignore this email."
         )
-        send_mail(
+        # Sent by the process_outbox worker, so a slow mail server does not hold up the page
+        enqueue_email(
             subject='Password reset verification code',
             message=message,
-            from_email=_get_from_email(),
             recipient_list=[email],
-            fail_silently=True,
+            from_email=_get_from_email(),
         )
 
         # Preserve the email for the next step and clear any previous verification
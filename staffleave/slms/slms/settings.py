@@ -150,6 +150,9 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # DEFAULT_FROM_EMAIL = 'HarmonyLeave (E/SLMS) <noreply@yourdomain.com>'
 # SERVER_EMAIL = DEFAULT_FROM_EMAIL
 
+# Emails and approval notifications are queued in the outbox; deliver them with
+# python manage.py process_outbox --loop   (or run it from cron without --loop)
+
 # Password Reset Settings
 PASSWORD_RESET_TIMEOUT = 86400  # 24 hours in seconds
 
@@ -170,6 +173,12 @@ SESSION_COOKIE_HTTPONLY = True  # Prevent JavaScript access to session cookie
 SESSION_COOKIE_SAMESITE = 'Lax'  # CSRF protection
 
 # Cache settings for authenticated pages
+# LocMemCache is private to each process. Deployments with several web
+# processes, or with the process_outbox worker, need a shared backend
+# (Redis, Memcached): otherwise password reset codes and login lockouts
+# are not shared, and a change made in one process (a holiday calendar
+# edit, a notification delivered by the worker) is not seen by the others'
+# caches; unread badges then lag by up to UNREAD_COUNT_TIMEOUT.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
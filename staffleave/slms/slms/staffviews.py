@@ -3,12 +3,13 @@ from slmsapp.EmailBackEnd import EmailBackEnd
 from django.contrib.auth import logout, login
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from slmsapp.models import CustomUser, Employee, Employee_Leave, LeaveType, LeaveBalance, PublicHoliday, CalendarEvent
+from slmsapp.models import CustomUser, Employee, Employee_Leave, LeaveType, LeaveBalance, CalendarEvent
 from django.db.models import Q
 from datetime import date, datetime, timedelta
 from calendar import monthrange
 from .decorators import employee_required
-from .leave_utils import calculate_working_days, check_overlapping_leave
+from .leave_utils import calculate_working_days_by_year, check_overlapping_leave
+from .calendar_utils import calendar_for_employee, get_month_holidays
 import logging
 
 logger = logging.getLogger(__name__)
@@ -105,7 +106,7 @@ def STAFF_APPLY_LEAVE_SAVE(request):
         try:
             from datetime import date, datetime, timedelta
             from django.db.models import Q
-            from slmsapp.models import LeaveBalance, PublicHoliday
+            from slmsapp.models import LeaveBalance
             
             employee = Employee.objects.get(admin=request.user.id)
             
@@ -146,8 +147,10 @@ def STAFF_APPLY_LEAVE_SAVE(request):
                 messages.error(request, 'Leave end date must be after or equal to the start date.')
                 return redirect('staff_apply_leave')
             
-            # Calculate number of working days (excluding weekends and public holidays)
-            working_days = calculate_working_days(from_date, to_date, employee)
+            # Calculate number of working days (excluding weekends and public holidays),
+            # split by year: a leave over New Year draws on both years' balances
+            working_days_by_year = calculate_working_days_by_year(from_date, to_date, employee)
+            working_days = sum(working_days_by_year.values())
             
             # Get leave type
             leave_type = None
@@ -168,27 +171,29 @@ def STAFF_APPLY_LEAVE_SAVE(request):
                     leave_type_name = str(leave_type_id) if leave_type_id else 'Other'
                     messages.warning(request, f'Leave type not found in system. Using "{leave_type_name}" as leave type name.')
             
-            # Check leave balance if leave type is specified
+            # Check the leave balance of every year the leave falls in
             if leave_type:
-                current_year = date.today().year
-                try:
-                    leave_balance = LeaveBalance.objects.get(
+                balances = {
+                    balance.year: balance
+                    for balance in LeaveBalance.objects.filter(
                         employee=employee,
                         leave_type=leave_type,
-                        year=current_year
+                        year__in=working_days_by_year
                     )
-                    
+                }
+                for year, days in sorted(working_days_by_year.items()):
+                    leave_balance = balances.get(year)
                     # Check if sufficient balance
-                    if leave_balance.days_remaining < working_days:
+                    if leave_balance is not None and leave_balance.days_remaining < days:
                         messages.error(
                             request, 
-                            f'Insufficient leave balance. You have {leave_balance.days_remaining} days remaining, but requested {working_days} days.'
+                            f'Insufficient {year} leave balance. You have {leave_balance.days_remaining} days remaining, but requested {days} days in {year}.'
                         )
                         return redirect('staff_apply_leave')
-                except LeaveBalance.DoesNotExist:
+                for year in sorted(set(working_days_by_year) - set(balances)):
                     messages.warning(
                         request, 
-                        f'No leave balance found for {leave_type_name}. Leave application submitted, but approval may require HR setup of entitlements.'
+                        f'No {year} leave balance found for {leave_type_name}. Leave application submitted, but approval may require HR setup of entitlements.'
                     )
             
             # Check for overlapping leave requests
@@ -222,6 +227,7 @@ def STAFF_APPLY_LEAVE_SAVE(request):
                 leave_type_name=leave_type_name,
                 from_date=from_date,
                 to_date=to_date,
+                working_days=working_days,
                 message=message,
                 supporting_document=supporting_document,
             )
@@ -305,7 +311,7 @@ def VIEW_LEAVE_BALANCE(request):
         leave_balances = LeaveBalance.objects.filter(
             employee=employee,
             year=year
-        ).order_by('leave_type__name')
+        ).select_related('leave_type').order_by('leave_type__name')
         
         # Calculate totals
         total_entitled = sum(balance.days_entitled for balance in leave_balances)
@@ -419,12 +425,8 @@ def STAFF_CALENDAR(request):
             from_date__month=month
         )
         
-        # Get public holidays for the month
-        public_holidays = PublicHoliday.objects.filter(
-            date__year=year,
-            date__month=month,
-            is_active=True
-        )
+        # Get public holidays for the month from the employee's calendar
+        public_holidays = get_month_holidays(year, month, calendar_for_employee(employee))
         
         # Get calendar events for the month
         # region agent log
@@ -56,6 +56,7 @@ urlpatterns = [
     path('Admin/Events/Update/<str:id>', adminviews.UPDATE_EVENT, name='admin_update_event'),
     path('Admin/Events/Delete/<str:id>', adminviews.DELETE_EVENT, name='admin_delete_event'),
     path('Admin/Analytics', hrviews.ADMIN_ANALYTICS_DASHBOARD, name='admin_analytics'),
+    path('Admin/Analytics/Charts/<str:chart>', hrviews.ADMIN_ANALYTICS_CHART, name='admin_analytics_chart'),
     
     # Legacy Super Admin routes (redirect to admin routes for backward compatibility)
     path('SuperAdmin/Home', adminviews.HOME, name='superadmin_home'),
@@ -85,6 +86,7 @@ urlpatterns = [
     path('HR/Calendar', hrviews.HR_CALENDAR, name='hr_calendar'),
     path('HR/Employee/Manage', hrviews.MANAGE_STAFF, name='hr_manage_staff'),
     path('HR/Employee/Add', hrviews.ADD_STAFF, name='hr_add_staff'),
+    path('HR/Employee/Import', hrviews.IMPORT_STAFF, name='hr_import_staff'),
     path('HR/Employee/Update/<str:id>', hrviews.UPDATE_STAFF, name='hr_update_staff'),
     path('HR/LeaveTypes/Manage', hrviews.MANAGE_LEAVE_TYPES, name='hr_manage_leave_types'),
     path('HR/LeaveTypes/Update/<str:id>', hrviews.UPDATE_LEAVE_TYPE, name='hr_update_leave_type'),
@@ -95,6 +97,11 @@ urlpatterns = [
     path('HR/Leave/Approve/<str:id>', hrviews.HR_APPROVE_LEAVE, name='hr_approve_leave_action'),
     path('HR/Leave/Reject/<str:id>', hrviews.HR_REJECT_LEAVE, name='hr_reject_leave'),
     path('HR/Analytics', hrviews.ANALYTICS_DASHBOARD, name='hr_analytics'),
+    path('HR/Analytics/Charts/<str:chart>', hrviews.ANALYTICS_CHART, name='hr_analytics_chart'),
+    path('HR/Reports/Absence', hrviews.ABSENCE_REPORT, name='hr_absence_report'),
+    path('HR/Export/Leaves', hrviews.EXPORT_LEAVES, name='hr_export_leaves'),
+    path('HR/Export/Balances', hrviews.EXPORT_BALANCES, name='hr_export_balances'),
+    path('HR/Export/Entitlements', hrviews.EXPORT_ENTITLEMENTS, name='hr_export_entitlements'),
     path('HR/Holidays/Manage', hrviews.MANAGE_PUBLIC_HOLIDAYS, name='hr_manage_holidays'),
     path('HR/Holidays/Update/<str:id>', hrviews.UPDATE_HOLIDAY, name='hr_update_holiday'),
     path('HR/Holidays/Delete/<str:id>', hrviews.DELETE_HOLIDAY, name='hr_delete_holiday'),
@@ -104,6 +111,7 @@ urlpatterns = [
     path('API/LoadFilter/<int:filter_id>', hrviews.load_filter, name='api_load_filter'),
     path('API/DeleteFilter/<int:filter_id>', hrviews.delete_filter, name='api_delete_filter'),
     path('API/ListFilters', hrviews.list_saved_filters, name='api_list_filters'),
+    path('API/Changes/<str:feed>', hrviews.CHANGE_FEED, name='api_change_feed'),
 
     # Employee Panel
     path('Employee/Home', staffviews.HOME, name='staff_home'),
@@ -132,6 +140,7 @@ urlpatterns = [
     path('Notifications/Send/Bulk', notificationviews.send_bulk_notification, name='notification_send_bulk'),
     path('Notifications', notificationviews.notification_list, name='notification_list'),
     path('Notifications/Sent', notificationviews.sent_notifications, name='notification_sent_list'),
+    path('Notifications/Sent/<int:pk>/Delete', notificationviews.delete_broadcast, name='notification_delete_sent'),
     path('Notifications/<int:pk>', notificationviews.notification_detail, name='notification_detail'),
     path('Notifications/<int:pk>/MarkRead', notificationviews.mark_as_read, name='notification_mark_read'),
     path('Notifications/MarkMultipleRead', notificationviews.mark_multiple_as_read, name='notification_mark_multiple_read'),
@@ -134,6 +134,7 @@ def PROFILE(request):
     user = CustomUser.objects.get(id = request.user.id)
     context = {
         "user":user,
+        "digest_choices": CustomUser.DIGEST_FREQUENCY_CHOICES,
     }
     return render(request,'profile.html',context)
 @login_required(login_url = '/')
@@ -148,6 +149,11 @@ def PROFILE_UPDATE(request):
             customuser.last_name = last_name
             if profile_pic !=None and profile_pic != "":
                customuser.profile_pic = profile_pic
+            digest_frequency = request.POST.get('digest_frequency')
+            if digest_frequency in dict(CustomUser.DIGEST_FREQUENCY_CHOICES) and digest_frequency != customuser.digest_frequency:
+                customuser.digest_frequency = digest_frequency
+                # Start from the current period rather than everything unread since the last digest
+                customuser.digest_sent_through = None
             customuser.save()
             from django.contrib.auth import update_session_auth_hash
             update_session_auth_hash(request, customuser)
@@ -12,22 +12,31 @@ class UserModel(UserAdmin):
         ('Permissions', {'fields': ('is_active', 'is_staff', 'is_superuser')}),
         ('Advanced', {'fields': ('user_type',)}),
     )
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ['title', 'sender', 'notification_type', 'created_at']
+    list_filter = ['notification_type', 'created_at']
+    search_fields = ['title', 'message', 'sender__username']
+    readonly_fields = ['created_at']
+    ordering = ['-created_at']
+
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ['title', 'sender', 'recipient', 'notification_type', 'is_read', 'is_active', 'created_at']
     list_filter = ['notification_type', 'is_read', 'is_active', 'created_at', 'updated_at']
-    search_fields = ['title', 'message', 'sender__username', 'recipient__username']
-    readonly_fields = ['created_at', 'updated_at']
+    search_fields = ['broadcast__title', 'broadcast__message', 'sender__username', 'recipient__username']
+    readonly_fields = ['created_at', 'updated_at', 'read_at']
+    raw_id_fields = ['broadcast', 'sender', 'recipient']
+    list_select_related = ['broadcast', 'sender', 'recipient']
     ordering = ['-created_at']
 
     fieldsets = (
         ('Basic Information', {
-            'fields': ('title', 'message', 'notification_type')
+            'fields': ('broadcast', 'notification_type')
         }),
         ('Users', {
             'fields': ('sender', 'recipient')
         }),
         ('Status', {
-            'fields': ('is_read', 'is_active')
+            'fields': ('is_read', 'read_at', 'is_active')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -35,7 +44,38 @@ class NotificationAdmin(admin.ModelAdmin):
         }),
     )
 
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['kind', 'status']
+    search_fields = ['last_error']
+    readonly_fields = ['created_at', 'sent_at']
+    ordering = ['-created_at']
+
+class HolidayCalendarAdmin(admin.ModelAdmin):
+    list_display = ['name', 'working_days_per_week', 'is_active', 'updated_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'description']
+
+class LeaveLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ['employee', 'leave_type', 'year', 'entry_type', 'days', 'leave', 'created_at']
+    list_filter = ['entry_type', 'year', 'leave_type']
+    readonly_fields = ['created_at']
+
+    # Entries are posted through leave_utils so balances stay in step
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 admin.site.register(CustomUser,UserModel)
 admin.site.register(Employee)
 admin.site.register(Employee_Leave)
+admin.site.register(Broadcast, BroadcastAdmin)
 admin.site.register(Notification, NotificationAdmin)
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
+admin.site.register(HolidayCalendar, HolidayCalendarAdmin)
+admin.site.register(LeaveLedgerEntry, LeaveLedgerEntryAdmin)
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth import get_user_model
-from .models import Notification
+from slms.notification_utils import AUDIENCE_CHOICES, audience_recipients
+from .models import Broadcast, CustomUser, Department
 
 User = get_user_model()
 
@@ -8,9 +9,17 @@ User = get_user_model()
 class NotificationForm(forms.ModelForm):
     """Form for sending notifications"""
 
+    recipient = forms.ModelChoiceField(
+        queryset=User.objects.filter(is_active=True),
+        widget=forms.Select(attrs={
+            'class': 'form-select',
+            'id': 'recipient-select'
+        })
+    )
+
     class Meta:
-        model = Notification
-        fields = ['title', 'message', 'notification_type', 'recipient']
+        model = Broadcast
+        fields = ['title', 'message', 'notification_type']
         widgets = {
             'title': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -23,10 +32,6 @@ class NotificationForm(forms.ModelForm):
             }),
             'notification_type': forms.Select(attrs={
                 'class': 'form-select'
-            }),
-            'recipient': forms.Select(attrs={
-                'class': 'form-select',
-                'id': 'recipient-select'
             })
         }
         labels = {
@@ -55,15 +60,40 @@ class NotificationForm(forms.ModelForm):
 
 
 class BulkNotificationForm(forms.Form):
-    """Form for sending bulk notifications to multiple recipients"""
+    """
+    Form for sending bulk notifications to multiple recipients
+
+    Recipients are either picked one by one or given as an audience (a
+    role, a department, everyone) that the database resolves when sending,
+    so the page never lists every user.
+    """
 
+    audience = forms.ChoiceField(
+        choices=AUDIENCE_CHOICES,
+        initial='selected',
+        widget=forms.RadioSelect,
+        label="Send To"
+    )
+    role = forms.ChoiceField(
+        choices=[('', 'Select a role')] + sorted(CustomUser.USER, key=lambda choice: int(choice[0])),
+        required=False,
+        widget=forms.Select(attrs={
+            'class': 'form-select'
+        })
+    )
+    department = forms.ModelChoiceField(
+        queryset=Department.objects.order_by('name'),
+        required=False,
+        empty_label='Select a department',
+        widget=forms.Select(attrs={
+            'class': 'form-select'
+        })
+    )
+    # Picked through the user search; only the chosen ids are rendered
     recipients = forms.ModelMultipleChoiceField(
         queryset=User.objects.filter(is_active=True),
-        widget=forms.SelectMultiple(attrs={
-            'class': 'form-select',
-            'id': 'recipients-select'
-        }),
-        required=True,
+        widget=forms.MultipleHiddenInput,
+        required=False,
         label="Select Recipients"
     )
     title = forms.CharField(
@@ -105,3 +135,24 @@ class BulkNotificationForm(forms.Form):
             self.fields['recipients'].queryset = User.objects.filter(
                 is_active=True
             ).exclude(id=self.sender.id)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        audience = cleaned_data.get('audience')
+        if audience == 'role' and not cleaned_data.get('role'):
+            self.add_error('role', 'Please select a role')
+        elif audience == 'department' and not cleaned_data.get('department'):
+            self.add_error('department', 'Please select a department')
+        elif audience == 'selected' and not cleaned_data.get('recipients'):
+            self.add_error('recipients', 'Please select at least one recipient')
+        return cleaned_data
+
+    def get_recipients(self):
+        """The chosen recipients, as a queryset"""
+        return audience_recipients(
+            self.cleaned_data['audience'],
+            sender=self.sender,
+            role=self.cleaned_data.get('role'),
+            department=self.cleaned_data.get('department'),
+            recipients=self.cleaned_data.get('recipients'),
+        )
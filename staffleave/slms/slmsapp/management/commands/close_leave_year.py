@@ -0,0 +1,178 @@
+"""
+Management command to open next year's leave entitlements and balances
+Run once the leave year has ended (safe to re-run if interrupted):
+python manage.py close_leave_year --year 2025
+python manage.py close_leave_year --year 2025 --dry-run
+"""
+from collections import defaultdict
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from slms.auth_utils import get_int_setting
+from slms.leave_utils import post_ledger_entries
+from slmsapp.models import Employee, LeaveBalance, LeaveEntitlement, LeaveLedgerEntry, LeaveType
+
+
+def entitlement_key(year, employee_id, leave_type_id):
+    return f'entitlement:{year}:{employee_id}:{leave_type_id}'
+
+
+def carryover_key(year, employee_id, leave_type_id):
+    return f'carryover:{year}:{employee_id}:{leave_type_id}'
+
+
+class Command(BaseCommand):
+    help = 'Create next year\'s leave entitlements and balances, carrying over unused days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--year',
+            type=int,
+            default=date.today().year - 1,
+            help='Leave year being closed (default: last year)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of employees processed per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be created without actually creating it',
+        )
+
+    def handle(self, *args, **options):
+        closing_year = options['year']
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        leave_types = list(LeaveType.objects.filter(is_active=True))
+        if not leave_types:
+            raise CommandError('There are no active leave types')
+
+        default_cap = get_int_setting('leave_carryover_days', 0)
+        caps = {
+            leave_type.id: default_cap if leave_type.max_carryover_days is None else leave_type.max_carryover_days
+            for leave_type in leave_types
+        }
+        self.stdout.write(f'Closing leave year {closing_year} into {closing_year + 1}')
+        for leave_type in leave_types:
+            self.stdout.write(f'  {leave_type.name}: carry over up to {caps[leave_type.id]} day(s)')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
+
+        totals = defaultdict(int)
+        employees = Employee.objects.filter(admin__is_active=True)
+        last_pk = 0
+        while True:
+            employee_ids = list(
+                employees.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not employee_ids:
+                break
+            last_pk = employee_ids[-1]
+
+            # Each chunk commits on its own; a re-run skips employees whose
+            # entitlements for the new year already exist
+            with transaction.atomic():
+                for name, count in self.open_year(closing_year, employee_ids, leave_types, caps, dry_run).items():
+                    totals[name] += count
+
+        verb = 'Would create' if dry_run else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {totals["entitlements"]} entitlement(s) for {closing_year + 1}, '
+            f'carrying over {totals["carried_days"]} day(s); '
+            f'{totals["skipped"]} already existed'
+        ))
+
+    def open_year(self, closing_year, employee_ids, leave_types, caps, dry_run):
+        """Create the new year's rows for one chunk of employees"""
+        year = closing_year + 1
+        counts = defaultdict(int)
+
+        already_open = set(
+            LeaveEntitlement.objects.filter(employee_id__in=employee_ids, year=year)
+            .values_list('employee_id', 'leave_type_id')
+        )
+        closing_entitlements = dict(
+            ((employee_id, leave_type_id), days) for employee_id, leave_type_id, days in
+            LeaveEntitlement.objects.filter(employee_id__in=employee_ids, year=closing_year)
+            .values_list('employee_id', 'leave_type_id', 'days_entitled')
+        )
+        unused_days = dict(
+            ((employee_id, leave_type_id), days) for employee_id, leave_type_id, days in
+            LeaveBalance.objects.filter(employee_id__in=employee_ids, year=closing_year)
+            .values_list('employee_id', 'leave_type_id', 'days_remaining')
+        )
+        # Days carried into the closing year are not part of its base entitlement
+        carried_in = dict(
+            ((employee_id, leave_type_id), days) for employee_id, leave_type_id, days in
+            LeaveLedgerEntry.objects.filter(
+                employee_id__in=employee_ids, year=closing_year, key__startswith='carryover:'
+            ).values_list('employee_id', 'leave_type_id', 'days')
+        )
+        # Balances may exist already, e.g. for leave approved early in the new year
+        open_balances = set(
+            LeaveBalance.objects.filter(employee_id__in=employee_ids, year=year)
+            .values_list('employee_id', 'leave_type_id')
+        )
+
+        entitlements = []
+        balances = []
+        entries = []
+        existing_balance_entries = []
+        for employee_id in employee_ids:
+            for leave_type in leave_types:
+                key = (employee_id, leave_type.id)
+                if key in already_open:
+                    counts['skipped'] += 1
+                    continue
+
+                if key in closing_entitlements:
+                    base = max(0, closing_entitlements[key] - carried_in.get(key, 0))
+                else:
+                    base = leave_type.max_days_per_year
+                carried = min(caps[leave_type.id], max(0, unused_days.get(key, 0)))
+
+                entitlements.append(LeaveEntitlement(
+                    employee_id=employee_id, leave_type_id=leave_type.id, year=year,
+                    days_entitled=base + carried
+                ))
+                new_entries = [LeaveLedgerEntry(
+                    employee_id=employee_id, leave_type_id=leave_type.id, year=year,
+                    entry_type=LeaveLedgerEntry.ACCRUAL, days=base,
+                    key=entitlement_key(year, employee_id, leave_type.id)
+                )]
+                if carried:
+                    new_entries.append(LeaveLedgerEntry(
+                        employee_id=employee_id, leave_type_id=leave_type.id, year=year,
+                        entry_type=LeaveLedgerEntry.ACCRUAL, days=carried,
+                        key=carryover_key(year, employee_id, leave_type.id)
+                    ))
+
+                if key in open_balances:
+                    existing_balance_entries.extend(new_entries)
+                else:
+                    balances.append(LeaveBalance(
+                        employee_id=employee_id, leave_type_id=leave_type.id, year=year,
+                        days_entitled=base + carried, days_used=0, days_remaining=base + carried
+                    ))
+                    entries.extend(new_entries)
+
+                counts['entitlements'] += 1
+                counts['carried_days'] += carried
+
+        if not dry_run:
+            LeaveEntitlement.objects.bulk_create(entitlements)
+            LeaveBalance.objects.bulk_create(balances)
+            LeaveLedgerEntry.objects.bulk_create(entries)
+            # Rare: add to the existing balances with single-row F() updates
+            if existing_balance_entries and not post_ledger_entries(existing_balance_entries):
+                raise CommandError('Ledger entries for the new year were posted concurrently; re-run the command')
+        return counts
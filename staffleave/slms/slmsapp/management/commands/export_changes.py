@@ -0,0 +1,103 @@
+"""
+Management command to write leave, balance and employee changes as JSONL
+The state file keeps each feed's cursor, so a nightly run sends only what
+changed since the previous one:
+python manage.py export_changes --state payroll_sync.json --output changes.jsonl
+python manage.py export_changes leaves --since 1760745600000000-42
+"""
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from slms.changefeed_utils import (
+    CHANGE_FEED_PAGE_SIZE, CHANGE_FEED_SETTLE_TIME, CHANGE_FEEDS, change_line, decode_cursor, iter_changes
+)
+
+
+class Command(BaseCommand):
+    help = 'Write rows changed since the last sync as JSON lines, one feed after another'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'feeds',
+            nargs='*',
+            help=f'Feeds to export (default: all). Available: {", ".join(CHANGE_FEEDS)}',
+        )
+        parser.add_argument(
+            '--state',
+            help='JSON file holding the cursor of each feed; read at the start and updated once the export is written',
+        )
+        parser.add_argument(
+            '--since',
+            help='Cursor to start from, overriding the state file (single feed only)',
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write the changes to (default: standard output)',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=CHANGE_FEED_PAGE_SIZE,
+            help=f'Rows read per query (default: {CHANGE_FEED_PAGE_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        feeds = options['feeds'] or list(CHANGE_FEEDS)
+        unknown = [feed for feed in feeds if feed not in CHANGE_FEEDS]
+        if unknown:
+            raise CommandError(f'Unknown feed(s): {", ".join(unknown)}')
+        if options['page_size'] < 1:
+            raise CommandError('--page-size must be at least 1')
+
+        cursors = self.read_state(options['state'])
+        if options['since']:
+            if len(feeds) != 1:
+                raise CommandError('--since needs exactly one feed')
+            cursors[feeds[0]] = options['since']
+        for feed in feeds:
+            if cursors.get(feed):
+                try:
+                    decode_cursor(cursors[feed])
+                except ValueError as e:
+                    raise CommandError(str(e))
+
+        # Every feed stops at the same moment, so one run is a consistent cut
+        until = timezone.now() - CHANGE_FEED_SETTLE_TIME
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        counts = {}
+        try:
+            for feed in feeds:
+                counts[feed] = 0
+                for row, cursor in iter_changes(feed, cursors.get(feed), options['page_size'], until):
+                    output.write(change_line(feed, row, cursor))
+                    cursors[feed] = cursor
+                    counts[feed] += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        # Cursors only move once every change before them has been written
+        if options['state']:
+            self.write_state(options['state'], cursors)
+        self.stderr.write(self.style.SUCCESS(
+            'Exported ' + ', '.join(f'{count} {feed}' for feed, count in counts.items())
+        ))
+
+    def read_state(self, path):
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding='utf-8') as state:
+                return json.load(state)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read state file "{path}": {e}')
+
+    def write_state(self, path, cursors):
+        # Written aside and renamed, so a crash never leaves half a file
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as state:
+            json.dump(cursors, state, indent=2, sort_keys=True)
+        os.replace(temporary, path)
@@ -0,0 +1,64 @@
+"""
+Management command to create employee accounts in bulk from a CSV or JSON file
+Every row is validated first; rejected rows are listed with their problems
+and the valid ones are still imported:
+python manage.py import_employees new_staff.csv
+python manage.py import_employees new_staff.json --dry-run
+"""
+from django.core.management.base import BaseCommand, CommandError
+from slms.import_utils import IMPORT_CHUNK_SIZE, import_employees, read_import_file
+
+
+class Command(BaseCommand):
+    help = 'Create employee accounts from a CSV or JSON file, reporting every rejected row'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='CSV file with a header row, or JSON file holding a list of objects',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only validate the file; nothing is created',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=IMPORT_CHUNK_SIZE,
+            help=f'Rows inserted per transaction (default: {IMPORT_CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Processes hashing passwords (default: one per CPU)',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        try:
+            with open(options['path'], 'rb') as import_file:
+                rows = read_import_file(import_file.read(), options['path'])
+        except OSError as e:
+            raise CommandError(f'Cannot read "{options["path"]}": {e}')
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        result = import_employees(
+            rows,
+            dry_run=options['dry_run'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+        )
+
+        for row_number, messages in result.error_rows:
+            for message in messages:
+                self.stdout.write(self.style.WARNING(f'Row {row_number}: {message}'))
+
+        verb = 'would be created' if options['dry_run'] else 'created'
+        summary = f'{len(result.created)} of {len(rows)} employee(s) {verb}'
+        if result.errors:
+            raise CommandError(f'{summary}; {len(result.errors)} row(s) rejected')
+        self.stdout.write(self.style.SUCCESS(summary))
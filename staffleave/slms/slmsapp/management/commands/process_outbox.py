@@ -0,0 +1,64 @@
+"""
+Management command to deliver queued notifications and emails
+Run it from cron to drain the outbox, or keep it running as a worker.
+Messages sent more than a week ago are deleted on every run, and hourly
+by a worker:
+python manage.py process_outbox
+python manage.py process_outbox --loop --interval 5
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from slms.outbox_utils import OUTBOX_BATCH_SIZE, process_outbox, purge_outbox
+
+PURGE_INTERVAL = 60 * 60  # Seconds between purges of sent messages, with --loop
+
+
+class Command(BaseCommand):
+    help = 'Deliver due notifications and emails from the outbox, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=OUTBOX_BATCH_SIZE,
+            help=f'Messages delivered per batch (default: {OUTBOX_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running, checking for new messages every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait when the outbox is empty, with --loop (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        total_sent = total_failed = 0
+        purged_at = None
+        try:
+            while True:
+                if purged_at is None or time.monotonic() - purged_at >= PURGE_INTERVAL:
+                    purged = purge_outbox()
+                    purged_at = time.monotonic()
+                    if purged:
+                        self.stdout.write(f'Deleted {purged} old sent message(s)')
+                sent, failed = process_outbox(options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f'Delivered {sent} message(s), {failed} failed')
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'Outbox processed: {total_sent} sent, {total_failed} failed'))
@@ -0,0 +1,253 @@
+"""
+Management command to recompute leave balances from approved leaves
+Report differences without changing anything, or rebuild everything:
+python manage.py rebuild_leave_balances --check
+python manage.py rebuild_leave_balances
+python manage.py rebuild_leave_balances --department Finance --year 2025
+"""
+from collections import defaultdict
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from slms.leave_utils import working_days_by_balance
+from slmsapp.models import Department, Employee, Employee_Leave, LeaveBalance, LeaveEntitlement, LeaveLedgerEntry
+
+
+class Command(BaseCommand):
+    help = 'Recompute days used on every leave balance from approved leaves'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Report balances that differ from approved leaves without changing them',
+        )
+        parser.add_argument(
+            '--department',
+            help='Only rebuild balances of employees in this department (name or ID)',
+        )
+        parser.add_argument(
+            '--year',
+            type=int,
+            help='Only rebuild balances for this year',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of balances read and written per batch (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        leaves = Employee_Leave.objects.filter(status=1)
+        balances = LeaveBalance.objects.all()
+        employees = Employee.objects.all()
+
+        if options['department']:
+            department = self.get_department(options['department'])
+            leaves = leaves.filter(employee_id__department=department)
+            balances = balances.filter(employee__department=department)
+            employees = employees.filter(department=department)
+            self.stdout.write(f'Limited to department {department.name}')
+
+        year = options['year']
+        if year:
+            leaves = leaves.filter(from_date__lte=date(year, 12, 31), to_date__gte=date(year, 1, 1))
+            balances = balances.filter(year=year)
+
+        if options['check']:
+            expected = working_days_by_balance(leaves)
+            if year:
+                # Leaves spanning New Year also count towards the neighbouring year
+                expected = {key: days for key, days in expected.items() if key[2] == year}
+            self.stdout.write(f'Computed days used for {len(expected)} balance(s) from approved leaves')
+            self.check_balances(balances, expected, employees, chunk_size)
+        else:
+            self.rebuild_balances(balances, leaves, year, chunk_size)
+
+    def get_department(self, value):
+        lookup = {'id': value} if value.isdigit() else {'name__iexact': value}
+        try:
+            return Department.objects.get(**lookup)
+        except Department.DoesNotExist:
+            raise CommandError(f'Department "{value}" does not exist')
+
+    def iter_balance_chunks(self, balances, chunk_size, fields):
+        """Yield balances in primary key order, one chunk per query"""
+        last_pk = 0
+        while True:
+            chunk = list(balances.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *fields)[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1][0]
+
+    def check_balances(self, balances, expected, employees, chunk_size):
+        """Stream one line per balance that does not match approved leaves"""
+        checked = differences = 0
+        fields = (
+            'employee_id', 'leave_type_id', 'year', 'days_entitled', 'days_used', 'days_remaining',
+            'employee__admin__username', 'leave_type__name'
+        )
+        for chunk in self.iter_balance_chunks(balances, chunk_size, fields):
+            for pk, employee_id, leave_type_id, year, entitled, used, remaining, username, leave_type in chunk:
+                checked += 1
+                days_used = expected.pop((employee_id, leave_type_id, year), 0)
+                days_remaining = max(0, entitled - days_used)
+                if used != days_used or remaining != days_remaining:
+                    differences += 1
+                    self.stdout.write(
+                        f'{username} - {leave_type} ({year}): '
+                        f'days used {used} -> {days_used}, days remaining {remaining} -> {days_remaining}'
+                    )
+
+        # Approved leaves whose balance row was never created
+        missing = {key: days for key, days in expected.items() if days}
+        if missing:
+            usernames = dict(
+                employees.filter(id__in={key[0] for key in missing}).values_list('id', 'admin__username')
+            )
+            for (employee_id, leave_type_id, year), days_used in sorted(missing.items()):
+                differences += 1
+                self.stdout.write(
+                    f'{usernames.get(employee_id, employee_id)} - leave type {leave_type_id} ({year}): '
+                    f'no balance, days used 0 -> {days_used}'
+                )
+
+        summary = f'Checked {checked} balance(s), {differences} difference(s) found'
+        if differences:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def rebuild_balances(self, balances, leaves, year, chunk_size):
+        """Write the recomputed values in chunks, logging each correction in the ledger"""
+        updated = created = 0
+        # Days counted for keys that have no balance row, as far as seen yet
+        seen = set()
+        uncovered = {}
+
+        for chunk in self.iter_balance_chunks(balances, chunk_size, ('employee_id',)):
+            with transaction.atomic():
+                keys, counted, changed = self.correct_balances(
+                    LeaveBalance.objects.filter(pk__in=[pk for pk, _ in chunk]),
+                    leaves.filter(employee_id__in={employee_id for _, employee_id in chunk})
+                )
+            updated += changed
+            seen.update(keys)
+            for key in keys:
+                uncovered.pop(key, None)
+            uncovered.update((key, days) for key, days in counted.items() if key not in seen)
+
+        # Approved leaves whose balance row was never created, including
+        # those of employees without any balance
+        uncovered.update(working_days_by_balance(leaves.exclude(employee_id__in=balances.values('employee_id'))))
+        missing = sorted(
+            key for key, days in uncovered.items()
+            # Leaves spanning New Year also count towards the neighbouring year
+            if days and key not in seen and (not year or key[2] == year)
+        )
+        for start in range(0, len(missing), chunk_size):
+            batch = missing[start:start + chunk_size]
+            employee_ids = {key[0] for key in batch}
+            entitlements = self.get_entitlements(batch)
+            rows = LeaveBalance.objects.filter(
+                employee_id__in=employee_ids,
+                leave_type_id__in={key[1] for key in batch},
+                year__in={key[2] for key in batch}
+            )
+            with transaction.atomic():
+                # An approval may create some of these rows meanwhile: they
+                # are skipped here, and the days are then applied below as
+                # differences to whatever the row holds
+                existing = set(rows.values_list('employee_id', 'leave_type_id', 'year'))
+                LeaveBalance.objects.bulk_create([
+                    LeaveBalance(
+                        employee_id=employee_id,
+                        leave_type_id=leave_type_id,
+                        year=balance_year,
+                        days_entitled=entitlements.get((employee_id, leave_type_id, balance_year), 0),
+                        days_remaining=entitlements.get((employee_id, leave_type_id, balance_year), 0)
+                    )
+                    for employee_id, leave_type_id, balance_year in batch
+                    if (employee_id, leave_type_id, balance_year) not in existing
+                ], ignore_conflicts=True)
+                self.correct_balances(rows, leaves.filter(employee_id__in=employee_ids), keys=set(batch))
+            created += len(set(batch) - existing)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt leave balances: {updated} updated, {created} created'
+        ))
+
+    def correct_balances(self, rows, leaves, keys=None):
+        """
+        Set days used on some balances to the working days of their approved leaves
+
+        Must run in a transaction: the balances are locked and their leaves
+        recounted while holding the lock, so an approval that commits during
+        the run is counted rather than overwritten.
+
+        Args:
+            rows: LeaveBalance queryset to correct
+            leaves: Approved leaves, covering at least those of the rows
+            keys: Only correct balances with these (employee, leave type, year) keys
+
+        Returns:
+            tuple: (keys of the rows, {key: working days} counted from
+                leaves, number of balances changed)
+        """
+        now = timezone.now()
+        fields = ('employee_id', 'leave_type_id', 'year', 'days_entitled', 'days_used', 'days_remaining')
+        rows = list(rows.select_for_update().values_list('pk', *fields))
+        counted = working_days_by_balance(leaves)
+
+        # Balances needing the same correction are written with one
+        # UPDATE; corrections repeat a lot, so a chunk needs few statements
+        changed = defaultdict(list)
+        adjustments = []
+        row_keys = set()
+        for pk, employee_id, leave_type_id, year, entitled, used, remaining in rows:
+            key = (employee_id, leave_type_id, year)
+            if keys is not None and key not in keys:
+                continue
+            row_keys.add(key)
+            days_used = counted.get(key, 0)
+            days_remaining = max(0, entitled - days_used)
+            if used == days_used and remaining == days_remaining:
+                continue
+            changed[days_used - used].append(pk)
+            if used != days_used:
+                adjustments.append(LeaveLedgerEntry(
+                    employee_id=employee_id,
+                    leave_type_id=leave_type_id,
+                    year=year,
+                    entry_type=LeaveLedgerEntry.ADJUSTMENT,
+                    days=days_used - used
+                ))
+        # Applied as differences, like approvals, so the update can
+        # never undo one; days_remaining is listed first as MySQL
+        # reads columns already assigned in the same statement
+        for delta, pks in changed.items():
+            LeaveBalance.objects.filter(pk__in=pks).update(
+                days_remaining=Greatest(F('days_entitled') - F('days_used') - delta, 0),
+                days_used=F('days_used') + delta,
+                updated_at=now
+            )
+        LeaveLedgerEntry.objects.bulk_create(adjustments)
+        return row_keys, counted, sum(len(pks) for pks in changed.values())
+
+    def get_entitlements(self, keys):
+        """Days entitled for a batch of (employee, leave type, year) keys"""
+        keys = list(keys)
+        rows = LeaveEntitlement.objects.filter(
+            employee_id__in={key[0] for key in keys},
+            year__in={key[2] for key in keys}
+        ).values_list('employee_id', 'leave_type_id', 'year', 'days_entitled')
+        return {(employee_id, leave_type_id, year): days for employee_id, leave_type_id, year, days in rows}
@@ -0,0 +1,119 @@
+"""
+Management command to recompute the monthly leave rollups from the leaves
+Leaves saved before working days were stored get them counted first, so
+run it once after upgrading a database with such leaves (no migration does
+this: counting needs the live holiday calendars). Schedule nightly to
+repair any drift, or run by hand:
+python manage.py rebuild_leave_rollups --check
+python manage.py rebuild_leave_rollups
+python manage.py rebuild_leave_rollups --year 2025
+"""
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from slms.analytics_utils import compute_leave_rollups
+from slms.leave_utils import working_days_by_leave
+from slmsapp.models import Employee_Leave, LeaveMonthlyRollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute the monthly leave rollups used by the analytics dashboards'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Report rollups that differ from the leaves without changing them',
+        )
+        parser.add_argument(
+            '--year',
+            type=int,
+            help='Only rebuild rollups for leaves applied for in this year',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of leaves written per UPDATE when counting working days (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        leaves = Employee_Leave.objects.all()
+        rollups = LeaveMonthlyRollup.objects.all()
+        year = options['year']
+        if year:
+            leaves = leaves.filter(created_at__year=year)
+            rollups = rollups.filter(month__year=year)
+
+        uncounted = 0
+        if options['check']:
+            uncounted = leaves.filter(working_days__isnull=True).count()
+            if uncounted:
+                self.stdout.write(f'{uncounted} leave(s) without working days')
+        else:
+            self.count_working_days(leaves.filter(working_days__isnull=True), options['chunk_size'])
+
+        expected = compute_leave_rollups(leaves)
+        current = {
+            (month, department_id, leave_type_id, status): (count, days, working_days)
+            for month, department_id, leave_type_id, status, count, days, working_days in rollups.values_list(
+                'month', 'department_id', 'leave_type_id', 'status', 'leaves', 'days', 'working_days'
+            )
+            if count or days or working_days
+        }
+        # Leaves without a department or leave type are listed first
+        differences = sorted((
+            (key, current.get(key, (0, 0, 0)), expected.get(key, (0, 0, 0)))
+            for key in current.keys() | expected.keys()
+            if current.get(key) != expected.get(key)
+        ), key=lambda difference: [part or 0 for part in difference[0]])
+
+        if options['check']:
+            for (month, department_id, leave_type_id, status), old, new in differences:
+                self.stdout.write(
+                    f'{month:%b %Y} department {department_id} leave type {leave_type_id} status {status}: '
+                    f'leaves {old[0]} -> {new[0]}, days {old[1]} -> {new[1]}, working days {old[2]} -> {new[2]}'
+                )
+            summary = f'Checked {len(current)} rollup(s), {len(differences) + uncounted} difference(s) found'
+            if differences or uncounted:
+                raise CommandError(summary)
+            self.stdout.write(self.style.SUCCESS(summary))
+            return
+
+        # Rollups are small (months x departments x leave types x statuses),
+        # so they are simply replaced
+        with transaction.atomic():
+            rollups.delete()
+            LeaveMonthlyRollup.objects.bulk_create([
+                LeaveMonthlyRollup(
+                    month=month, department_id=department_id, leave_type_id=leave_type_id,
+                    status=status, leaves=count, days=days, working_days=working_days
+                )
+                for (month, department_id, leave_type_id, status), (count, days, working_days) in expected.items()
+            ], batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(expected)} leave rollup(s), {len(differences)} corrected'
+        ))
+
+    def count_working_days(self, leaves, chunk_size):
+        """Store the working days of leaves saved before they were counted at submission"""
+        # Leaves with the same count are written together, chunk_size per UPDATE
+        by_days = defaultdict(list)
+        for leave_id, days in working_days_by_leave(leaves).items():
+            by_days[days].append(leave_id)
+        if not by_days:
+            return
+        now = timezone.now()
+        with transaction.atomic():
+            for days, leave_ids in by_days.items():
+                for start in range(0, len(leave_ids), chunk_size):
+                    Employee_Leave.objects.filter(pk__in=leave_ids[start:start + chunk_size]).update(
+                        working_days=days, updated_at=now
+                    )
+        self.stdout.write(f'Counted working days of {sum(len(ids) for ids in by_days.values())} leave(s)')
@@ -0,0 +1,17 @@
+"""
+Management command to recount every user's unread notifications
+The counts are kept in step as notifications are sent, read and deleted;
+run this after removing notifications another way (deleting a user who
+sent some, the admin site) or nightly to repair any drift:
+python manage.py rebuild_unread_counts
+"""
+from django.core.management.base import BaseCommand
+from slms.notification_utils import rebuild_unread_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount the unread notifications shown in the header badge of every user'
+
+    def handle(self, *args, **options):
+        updated = rebuild_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f'Recounted unread notifications for {updated} user(s).'))
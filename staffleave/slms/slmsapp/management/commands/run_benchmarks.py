@@ -0,0 +1,444 @@
+"""
+Management command to time the leave engine against its performance targets
+Run all suites or pick some by name:
+python manage.py run_benchmarks
+python manage.py run_benchmarks working_days
+Suites that need data create it inside a transaction that is rolled back.
+"""
+import random
+import time
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+
+def bench_working_days(stdout, size=None):
+    """calculate_working_days_bulk over 100k ranges spread across three years"""
+    from slms.leave_utils import calculate_working_days_bulk
+
+    size = size or 100_000
+    rng = random.Random(42)
+    origin = date(2024, 1, 1)
+    ranges = []
+    for _ in range(size):
+        start = origin + timedelta(days=rng.randrange(0, 3 * 365))
+        ranges.append((start, start + timedelta(days=rng.randrange(0, 30))))
+
+    # Warm the holiday load so the timing reflects steady-state requests
+    calculate_working_days_bulk(ranges[:1])
+
+    started = time.perf_counter()
+    counts = calculate_working_days_bulk(ranges)
+    elapsed = time.perf_counter() - started
+
+    stdout.write(f'  {len(counts)} ranges, {int(counts.sum())} working days in total')
+    return elapsed, 1.0
+
+
+def bench_rebuild_balances(stdout, size=None):
+    """rebuild_leave_balances over 50k employees with two approved leaves each"""
+    from slmsapp.models import CustomUser, Employee, Employee_Leave, LeaveBalance, LeaveType
+
+    size = size or 50_000
+    rng = random.Random(42)
+    year = date.today().year
+    origin = date(year, 1, 1)
+
+    with transaction.atomic():
+        leave_type = LeaveType.objects.create(name='Benchmark leave')
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'bench_{i}', password='!', user_type=2) for i in range(size)],
+            batch_size=2000
+        )
+        employees = Employee.objects.bulk_create(
+            [Employee(admin=user, address='-', gender='-', employee_id=f'BENCH{i}') for i, user in enumerate(users)],
+            batch_size=2000
+        )
+        # Older backends do not return primary keys from bulk_create
+        employee_ids = list(Employee.objects.filter(employee_id__startswith='BENCH').values_list('id', flat=True))
+
+        leaves = []
+        for employee_id in employee_ids:
+            for _ in range(2):
+                start = origin + timedelta(days=rng.randrange(0, 330))
+                leaves.append(Employee_Leave(
+                    employee_id_id=employee_id, leave_type=leave_type, message='-', status=1,
+                    from_date=start, to_date=start + timedelta(days=rng.randrange(0, 10))
+                ))
+        Employee_Leave.objects.bulk_create(leaves, batch_size=2000)
+        LeaveBalance.objects.bulk_create(
+            [LeaveBalance(employee_id=employee_id, leave_type=leave_type, year=year, days_entitled=25)
+             for employee_id in employee_ids],
+            batch_size=2000
+        )
+
+        started = time.perf_counter()
+        call_command('rebuild_leave_balances', stdout=StringIO())
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {len(employees)} employees, {len(leaves)} approved leaves')
+        transaction.set_rollback(True)
+
+    # Every chunk of balances is locked and its leaves recounted under the
+    # lock, so approvals made during the run are kept; that costs about two
+    # seconds over a single up-front count
+    return elapsed, 12.0
+
+
+def bench_close_year(stdout, size=None):
+    """close_leave_year for 20k employees across two leave types"""
+    from slmsapp.models import CustomUser, Employee, LeaveBalance, LeaveType
+
+    size = size or 20_000
+    rng = random.Random(42)
+    closing_year = date.today().year - 1
+
+    with transaction.atomic():
+        leave_types = [
+            LeaveType.objects.create(name='Benchmark annual', max_days_per_year=25, max_carryover_days=5),
+            LeaveType.objects.create(name='Benchmark sick', max_days_per_year=10, max_carryover_days=0),
+        ]
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'bench_{i}', password='!', user_type=2) for i in range(size)],
+            batch_size=2000
+        )
+        Employee.objects.bulk_create(
+            [Employee(admin=user, address='-', gender='-', employee_id=f'BENCH{i}') for i, user in enumerate(users)],
+            batch_size=2000
+        )
+        employee_ids = list(Employee.objects.filter(employee_id__startswith='BENCH').values_list('id', flat=True))
+        LeaveBalance.objects.bulk_create(
+            [LeaveBalance(employee_id=employee_id, leave_type=leave_type, year=closing_year,
+                          days_entitled=leave_type.max_days_per_year, days_remaining=rng.randrange(0, 10))
+             for employee_id in employee_ids for leave_type in leave_types],
+            batch_size=2000
+        )
+        # Close the year for the benchmark employees only
+        LeaveType.objects.exclude(pk__in=[leave_type.pk for leave_type in leave_types]).update(is_active=False)
+
+        started = time.perf_counter()
+        call_command('close_leave_year', year=closing_year, stdout=StringIO())
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {len(employee_ids)} employees, {len(employee_ids) * len(leave_types)} new balances')
+        transaction.set_rollback(True)
+
+    return elapsed, 20.0
+
+
+def bench_analytics(stdout, size=None):
+    """Analytics dashboard figures over 200k leaves read from the monthly rollups"""
+    from slms.analytics_utils import build_leave_analytics
+    from slmsapp.models import CustomUser, Department, Employee, Employee_Leave, LeaveType
+
+    size = size or 200_000
+    rng = random.Random(42)
+    year = date.today().year
+    origin = date(year, 1, 1)
+
+    with transaction.atomic():
+        departments = [Department.objects.create(name=f'Benchmark department {i}') for i in range(20)]
+        leave_types = [LeaveType.objects.create(name=f'Benchmark leave {i}') for i in range(5)]
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'bench_{i}', password='!', user_type=2) for i in range(size // 20)],
+            batch_size=2000
+        )
+        Employee.objects.bulk_create(
+            [Employee(admin=user, address='-', gender='-', employee_id=f'BENCH{i}', department=rng.choice(departments))
+             for i, user in enumerate(users)],
+            batch_size=2000
+        )
+        employee_ids = list(Employee.objects.filter(employee_id__startswith='BENCH').values_list('id', flat=True))
+
+        leaves = []
+        for _ in range(size):
+            start = origin + timedelta(days=rng.randrange(0, 330))
+            leaves.append(Employee_Leave(
+                employee_id_id=rng.choice(employee_ids), leave_type=rng.choice(leave_types), message='-',
+                status=rng.randrange(0, 3), from_date=start, to_date=start + timedelta(days=rng.randrange(0, 10))
+            ))
+        # bulk_create skips the signals, so count the leaves in with a rebuild
+        Employee_Leave.objects.bulk_create(leaves, batch_size=2000)
+        call_command('rebuild_leave_rollups', stdout=StringIO())
+
+        started = time.perf_counter()
+        analytics = build_leave_analytics(year)
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {analytics["total_leaves_applied"]} leaves, {len(analytics["dept_labels"])} departments')
+        transaction.set_rollback(True)
+
+    return elapsed, 0.5
+
+
+def bench_headcount(stdout, size=None):
+    """Daily headcount on leave for a year of 10k employees with four approved leaves each"""
+    from slms.analytics_utils import headcount_on_leave
+    from slmsapp.models import CustomUser, Department, Employee, Employee_Leave
+
+    size = size or 10_000
+    rng = random.Random(42)
+    year = date.today().year
+    origin = date(year, 1, 1)
+
+    with transaction.atomic():
+        departments = [Department.objects.create(name=f'Benchmark department {i}') for i in range(20)]
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'bench_{i}', password='!', user_type=2) for i in range(size)],
+            batch_size=2000
+        )
+        Employee.objects.bulk_create(
+            [Employee(admin=user, address='-', gender='-', employee_id=f'BENCH{i}', department=rng.choice(departments))
+             for i, user in enumerate(users)],
+            batch_size=2000
+        )
+        employee_ids = list(Employee.objects.filter(employee_id__startswith='BENCH').values_list('id', flat=True))
+
+        leaves = []
+        for employee_id in employee_ids:
+            for _ in range(4):
+                start = origin + timedelta(days=rng.randrange(-10, 365))
+                leaves.append(Employee_Leave(
+                    employee_id_id=employee_id, message='-', status=1,
+                    from_date=start, to_date=start + timedelta(days=rng.randrange(0, 15))
+                ))
+        Employee_Leave.objects.bulk_create(leaves, batch_size=2000)
+
+        started = time.perf_counter()
+        headcount = headcount_on_leave(year)
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {len(leaves)} leaves, peak of {max(headcount["total"])} employees on leave')
+        transaction.set_rollback(True)
+
+    return elapsed, 0.5
+
+
+def bench_absence(stdout, size=None):
+    """Absence pattern metrics for a year of 10k employees with eight approved leaves each"""
+    from slms.absence_utils import absence_metrics
+    from slmsapp.models import CustomUser, Department, Employee, Employee_Leave
+
+    size = size or 10_000
+    rng = random.Random(42)
+    year = date.today().year
+    origin = date(year, 1, 1)
+
+    with transaction.atomic():
+        departments = [Department.objects.create(name=f'Benchmark department {i}') for i in range(20)]
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'bench_{i}', password='!', user_type=2) for i in range(size)],
+            batch_size=2000
+        )
+        Employee.objects.bulk_create(
+            [Employee(admin=user, address='-', gender='-', employee_id=f'BENCH{i}', department=rng.choice(departments))
+             for i, user in enumerate(users)],
+            batch_size=2000
+        )
+        employee_ids = list(Employee.objects.filter(employee_id__startswith='BENCH').values_list('id', flat=True))
+
+        leaves = []
+        for employee_id in employee_ids:
+            for _ in range(8):
+                start = origin + timedelta(days=rng.randrange(-10, 365))
+                leaves.append(Employee_Leave(
+                    employee_id_id=employee_id, message='-', status=1,
+                    from_date=start, to_date=start + timedelta(days=rng.randrange(0, 5))
+                ))
+        Employee_Leave.objects.bulk_create(leaves, batch_size=2000)
+
+        started = time.perf_counter()
+        metrics = absence_metrics(year)
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {len(leaves)} leaves, highest Bradford factor {metrics["bradford"].max()}')
+        transaction.set_rollback(True)
+
+    return elapsed, 1.0
+
+
+def bench_export(stdout, size=None):
+    """Streaming CSV export of 200k leave applications, and how soon the first row is ready"""
+    from slms.export_utils import LEAVE_HEADER, csv_response, leave_rows
+    from slmsapp.models import CustomUser, Department, Employee, Employee_Leave, LeaveType
+
+    size = size or 200_000
+    rng = random.Random(42)
+    origin = date(date.today().year, 1, 1)
+
+    with transaction.atomic():
+        departments = [Department.objects.create(name=f'Benchmark department {i}') for i in range(20)]
+        leave_types = [LeaveType.objects.create(name=f'Benchmark leave {i}') for i in range(5)]
+        users = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'bench_{i}', password='!', user_type=2) for i in range(size // 20)],
+            batch_size=2000
+        )
+        Employee.objects.bulk_create(
+            [Employee(admin=user, address='-', gender='-', employee_id=f'BENCH{i}', department=rng.choice(departments))
+             for i, user in enumerate(users)],
+            batch_size=2000
+        )
+        employee_ids = list(Employee.objects.filter(employee_id__startswith='BENCH').values_list('id', flat=True))
+        Employee_Leave.objects.bulk_create([
+            Employee_Leave(
+                employee_id_id=rng.choice(employee_ids), leave_type=rng.choice(leave_types), message='-',
+                status=rng.randrange(0, 3), from_date=origin, to_date=origin + timedelta(days=rng.randrange(0, 10))
+            )
+            for _ in range(size)
+        ], batch_size=2000)
+
+        started = time.perf_counter()
+        lines = iter(csv_response('leaves.csv', LEAVE_HEADER, leave_rows()).streaming_content)
+        exported = len(next(lines)) + len(next(lines))
+        first_row = time.perf_counter() - started
+        exported += sum(len(line) for line in lines)
+        elapsed = time.perf_counter() - started
+
+        stdout.write(
+            f'  {size} leaves, {exported / 1e6:.1f} MB of CSV, first row after {first_row * 1000:.0f} ms'
+        )
+        transaction.set_rollback(True)
+
+    # SQLite truncates timestamps to dates in a Python function, about half the time
+    return elapsed, 5.0
+
+
+def bench_import(stdout, size=None):
+    """Validating and creating 10k employees from an import file"""
+    from slms.import_utils import import_employees, read_import_file
+    from slmsapp.models import Department
+
+    size = size or 10_000
+    rng = random.Random(42)
+
+    with transaction.atomic():
+        departments = [Department.objects.create(name=f'Benchmark department {i}').name for i in range(20)]
+        content = StringIO()
+        content.write('first_name,last_name,email,username,gender,department,date_of_joining\n')
+        for i in range(size):
+            # Rows without a password, so the timing is not all password hashing
+            content.write(
+                f'Bench,{i},bench_{i}@example.com,bench_{i},{rng.choice("MF")},{rng.choice(departments)},2025-01-06\n'
+            )
+        rows = read_import_file(content.getvalue(), 'bench.csv')
+
+        started = time.perf_counter()
+        result = import_employees(rows)
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {len(result.created)} of {size} employees created, {len(result.errors)} rows rejected')
+        transaction.set_rollback(True)
+
+    return elapsed, 5.0
+
+
+def bench_notifications(stdout, size=None):
+    """Notification to every active user, 20k of them"""
+    from slms.notification_utils import audience_recipients, send_notifications
+    from slmsapp.models import CustomUser, Notification
+
+    size = size or 20_000
+
+    with transaction.atomic():
+        CustomUser.objects.bulk_create(
+            [CustomUser(username=f'bench_{i}', password='!', user_type=2) for i in range(size)],
+            batch_size=2000
+        )
+        sender = CustomUser.objects.create(username='bench_sender', password='!', user_type=4)
+
+        started = time.perf_counter()
+        sent = send_notifications(sender, audience_recipients('everyone', sender=sender), 'Benchmark', 'Hello everyone')
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {sent} notifications sent, {Notification.objects.count()} stored')
+        transaction.set_rollback(True)
+
+    # Mostly Django compiling the INSERT values; one create() per user took over 30s
+    return elapsed, 2.5
+
+
+def bench_digests(stdout, size=None):
+    """Daily digest run for 50k subscribers with one unread notification each"""
+    from datetime import timedelta
+    from django.test import override_settings
+    from django.utils import timezone
+    from slms.digest_utils import send_digests
+    from slms.notification_utils import audience_recipients, send_notifications
+    from slmsapp.models import CustomUser
+
+    size = size or 50_000
+
+    with transaction.atomic():
+        CustomUser.objects.bulk_create(
+            [
+                CustomUser(username=f'bench_{i}', email=f'bench_{i}@example.com', password='!', user_type=2, digest_frequency='daily')
+                for i in range(size)
+            ],
+            batch_size=2000
+        )
+        sender = CustomUser.objects.create(username='bench_sender', password='!', user_type=4)
+        send_notifications(sender, audience_recipients('everyone', sender=sender), 'Benchmark', 'Hello everyone')
+
+        started = time.perf_counter()
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.dummy.EmailBackend'):
+            checked, sent = send_digests('daily', now=timezone.now() + timedelta(days=1))
+        elapsed = time.perf_counter() - started
+
+        stdout.write(f'  {sent} digests sent to {checked} subscribers')
+        transaction.set_rollback(True)
+
+    # Building the emails dominates; rendering them with the template engine took 35s
+    return elapsed, 15.0
+
+
+SUITES = {
+    'working_days': bench_working_days,
+    'rebuild_balances': bench_rebuild_balances,
+    'close_year': bench_close_year,
+    'analytics': bench_analytics,
+    'headcount': bench_headcount,
+    'absence': bench_absence,
+    'export': bench_export,
+    'import': bench_import,
+    'notifications': bench_notifications,
+    'digests': bench_digests,
+}
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks for the leave engine and compare them with their targets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'suites',
+            nargs='*',
+            help=f'Benchmarks to run (default: all). Available: {", ".join(SUITES)}',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            help='Override the default workload size of each benchmark',
+        )
+
+    def handle(self, *args, **options):
+        names = options['suites'] or list(SUITES)
+        unknown = [name for name in names if name not in SUITES]
+        if unknown:
+            raise CommandError(f'Unknown benchmark(s): {", ".join(unknown)}')
+
+        failures = 0
+        for name in names:
+            self.stdout.write(f'Running {name}...')
+            elapsed, target = SUITES[name](self.stdout, options['size'])
+            line = f'{name}: {elapsed:.3f}s (target < {target:.1f}s)'
+            if elapsed < target:
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                failures += 1
+                self.stdout.write(self.style.ERROR(line))
+
+        if failures:
+            raise CommandError(f'{failures} benchmark(s) missed their target')
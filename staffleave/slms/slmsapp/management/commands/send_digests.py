@@ -0,0 +1,35 @@
+"""
+Management command to email unread-notification digests
+Run it from cron just after every hour and just after midnight:
+python manage.py send_digests --frequency hourly
+python manage.py send_digests --frequency daily
+"""
+from django.core.management.base import BaseCommand, CommandError
+from slms.digest_utils import DIGEST_BATCH_SIZE, DIGEST_PERIODS, digest_period, send_digests
+
+
+class Command(BaseCommand):
+    help = 'Email users who opted in a digest of their unread notifications for the last hour or day'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--frequency',
+            choices=sorted(DIGEST_PERIODS),
+            default='daily',
+            help='Which subscribers to email (default: daily)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DIGEST_BATCH_SIZE,
+            help=f'Users read and emails sent at a time (default: {DIGEST_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        start, end = digest_period(options['frequency'])
+        self.stdout.write(f'Sending {options["frequency"]} digests for {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}...')
+        checked, sent = send_digests(options['frequency'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} digest(s) to {checked} subscriber(s) checked.'))
@@ -4,7 +4,9 @@ Run this once to update all existing staff records:
 python manage.py update_employee_ids
 """
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 from slmsapp.models import Employee
 
 
@@ -22,76 +24,65 @@ class Command(BaseCommand):
             action='store_true',
             help='Force update even if employee_id already exists',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Records written per UPDATE statement (default: 1000)',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         force = options['force']
-        
+
         # Get all staff records
-        staff_without_id = Employee.objects.filter(
-            Q(employee_id__isnull=True) | Q(employee_id='')
-        )
-        staff_with_id = Employee.objects.exclude(
-            Q(employee_id__isnull=True) | Q(employee_id='')
-        )
-        
-        total_without = staff_without_id.count()
-        total_with = staff_with_id.count()
-        
+        without_id = Q(employee_id__isnull=True) | Q(employee_id='')
+        total_without = Employee.objects.filter(without_id).count()
+        total_with = Employee.objects.exclude(without_id).count()
+
         self.stdout.write(f'Found {total_without} staff records without employee ID')
         self.stdout.write(f'Found {total_with} staff records with existing employee ID')
-        
+
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be made'))
-        
-        updated_count = 0
-        skipped_count = 0
-        
-        # Update staff without employee IDs
-        for staff in staff_without_id:
-            new_id = Employee.generate_employee_id()
-            if dry_run:
-                self.stdout.write(
-                    f'Would update: {employee.admin.username} -> {new_id}'
-                )
-            else:
-                employee.employee_id = new_id
-                staff.save(update_fields=['employee_id'])
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Updated: {employee.admin.username} -> {new_id}'
-                    )
-                )
-            updated_count += 1
-        
-        # Optionally update staff with existing IDs (if force flag is set)
+
+        staff = Employee.objects.select_related('admin').order_by('id')
         if force:
             self.stdout.write(self.style.WARNING('Force mode: Updating all staff records...'))
-            for staff in staff_with_id:
-                new_id = Employee.generate_employee_id()
-                if dry_run:
-                    self.stdout.write(
-                        f'Would update: {employee.admin.username} ({employee.employee_id}) -> {new_id}'
-                    )
-                else:
-                    old_id = employee.employee_id
-                    employee.employee_id = new_id
-                    staff.save(update_fields=['employee_id'])
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Updated: {employee.admin.username} ({old_id}) -> {new_id}'
-                        )
-                    )
-                updated_count += 1
+            skipped_count = 0
         else:
+            staff = staff.filter(without_id)
             skipped_count = total_with
+        staff = list(staff.only('id', 'employee_id', 'admin__username'))
+
+        now = timezone.now()
+        with transaction.atomic():
+            # One block of IDs for every record; a dry run rolls the reservation back
+            new_ids = Employee.generate_employee_ids(len(staff))
+            for employee, new_id in zip(staff, new_ids):
+                old_id = f' ({employee.employee_id})' if employee.employee_id else ''
+                if dry_run:
+                    self.stdout.write(f'Would update: {employee.admin.username}{old_id} -> {new_id}')
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'Updated: {employee.admin.username}{old_id} -> {new_id}'))
+                employee.employee_id = new_id
+                # bulk_update skips auto_now; the change feed needs the new stamp
+                employee.updated_at = now
+
+            if dry_run:
+                transaction.set_rollback(True)
+            else:
+                Employee.objects.bulk_update(staff, ['employee_id', 'updated_at'], batch_size=options['batch_size'])
+        updated_count = len(staff)
+
+        if skipped_count > 0:
             self.stdout.write(
                 self.style.WARNING(
                     f'Skipped {skipped_count} staff records with existing IDs. '
                     f'Use --force to update them as well.'
                 )
             )
-        
+
         if dry_run:
             self.stdout.write(
                 self.style.WARNING(
@@ -110,4 +101,3 @@ class Command(BaseCommand):
                         f'Skipped {skipped_count} record(s) with existing IDs'
                     )
                 )
-
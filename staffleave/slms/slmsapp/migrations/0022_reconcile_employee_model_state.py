@@ -0,0 +1,68 @@
+# Bring the migration state in line with the Staff -> Employee rename.
+#
+# The models were renamed in code (keeping their tables and columns via
+# db_table / db_column) without a matching migration, so the database is
+# already correct and only Django's recorded state needs to move.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0021_add_approval_comments_and_saved_filters'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[],
+            state_operations=[
+                migrations.RenameModel('Staff', 'Employee'),
+                migrations.AlterModelTable('employee', 'slmsapp_staff'),
+                migrations.RenameField('employee', 'staff_type', 'employee_type'),
+                migrations.AlterField(
+                    model_name='employee',
+                    name='employee_type',
+                    field=models.CharField(blank=True, choices=[('Full-time', 'Full-time'), ('Part-time', 'Part-time'), ('Contract', 'Contract'), ('Temporary', 'Temporary'), ('Intern', 'Intern')], db_column='staff_type', default='Full-time', max_length=50, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='employee',
+                    name='department',
+                    field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='employee_members', to='slmsapp.department'),
+                ),
+                migrations.RenameModel('Staff_Leave', 'Employee_Leave'),
+                migrations.AlterModelTable('employee_leave', 'slmsapp_staff_leave'),
+                migrations.AlterModelOptions(
+                    name='employee_leave',
+                    options={'ordering': ['-created_at'], 'verbose_name': 'Employee Leave', 'verbose_name_plural': 'Employee Leaves'},
+                ),
+                migrations.RenameField('employee_leave', 'staff_id', 'employee_id'),
+                migrations.AlterField(
+                    model_name='employee_leave',
+                    name='employee_id',
+                    field=models.ForeignKey(db_column='staff_id_id', on_delete=django.db.models.deletion.CASCADE, related_name='leave_applications', to='slmsapp.employee'),
+                ),
+                migrations.RenameField('leavebalance', 'staff', 'employee'),
+                migrations.AlterField(
+                    model_name='leavebalance',
+                    name='employee',
+                    field=models.ForeignKey(db_column='staff_id', on_delete=django.db.models.deletion.CASCADE, related_name='leave_balances', to='slmsapp.employee'),
+                ),
+                migrations.RenameField('leaveentitlement', 'staff', 'employee'),
+                migrations.AlterField(
+                    model_name='leaveentitlement',
+                    name='employee',
+                    field=models.ForeignKey(db_column='staff_id', on_delete=django.db.models.deletion.CASCADE, related_name='leave_entitlements', to='slmsapp.employee'),
+                ),
+                migrations.RemoveConstraint(
+                    model_name='savedfilter',
+                    name='unique_user_filter_name',
+                ),
+                migrations.AlterUniqueTogether(
+                    name='savedfilter',
+                    unique_together={('user', 'name')},
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:04
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0022_reconcile_employee_model_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HolidayCalendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('working_days_per_week', models.IntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(7)])),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Holiday Calendar',
+                'verbose_name_plural': 'Holiday Calendars',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='holiday_calendar',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='departments', to='slmsapp.holidaycalendar'),
+        ),
+        migrations.AddField(
+            model_name='publicholiday',
+            name='calendar',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holidays', to='slmsapp.holidaycalendar'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0023_holiday_calendars'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaveLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('entry_type', models.CharField(choices=[('accrual', 'Accrual'), ('debit', 'Debit'), ('reversal', 'Reversal'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('days', models.IntegerField()),
+                ('cycle', models.PositiveIntegerField(default=0)),
+                ('key', models.CharField(blank=True, max_length=100, null=True, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='slmsapp.employee')),
+                ('leave', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='slmsapp.employee_leave')),
+                ('leave_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='slmsapp.leavetype')),
+            ],
+            options={
+                'verbose_name': 'Leave Ledger Entry',
+                'verbose_name_plural': 'Leave Ledger Entries',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['employee', 'leave_type', 'year'], name='ledger_balance_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:17
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0024_leave_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leavetype',
+            name='max_carryover_days',
+            field=models.IntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
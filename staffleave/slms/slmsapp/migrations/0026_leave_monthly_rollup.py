@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:26
+
+from django.db import migrations, models
+from django.db.models import Count, DateField, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def populate_rollups(apps, schema_editor):
+    """Count the leaves applied for so far into the new rollup table"""
+    Employee_Leave = apps.get_model('slmsapp', 'Employee_Leave')
+    LeaveMonthlyRollup = apps.get_model('slmsapp', 'LeaveMonthlyRollup')
+    rows = (
+        Employee_Leave.objects.order_by()
+        .values(
+            'leave_type_id', 'status',
+            month=TruncMonth('created_at', output_field=DateField()),
+            department_id=F('employee_id__department_id'),
+        )
+        .annotate(
+            leaves=Count('id'),
+            span=Sum(ExpressionWrapper(F('to_date') - F('from_date'), output_field=DurationField())),
+        )
+    )
+    LeaveMonthlyRollup.objects.bulk_create([
+        LeaveMonthlyRollup(
+            month=row['month'], department_id=row['department_id'], leave_type_id=row['leave_type_id'],
+            status=row['status'], leaves=row['leaves'], days=row['span'].days + row['leaves'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0025_leave_type_carryover_cap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaveMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Approved'), (2, 'Rejected')])),
+                ('leaves', models.IntegerField(default=0)),
+                ('days', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leave_rollups', to='slmsapp.department')),
+                ('leave_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leave_rollups', to='slmsapp.leavetype')),
+            ],
+            options={
+                'verbose_name': 'Leave Monthly Rollup',
+                'verbose_name_plural': 'Leave Monthly Rollups',
+                'ordering': ['month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='leavemonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('month', 'department', 'leave_type', 'status'), name='leave_rollup_key'),
+        ),
+        migrations.AddIndex(
+            model_name='employee_leave',
+            index=models.Index(fields=['status', 'created_at', 'employee_id'], name='leave_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee_leave',
+            index=models.Index(fields=['status', 'to_date'], name='leave_status_to_date_idx'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0026_leave_monthly_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee_leave',
+            name='working_days',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='leavemonthlyrollup',
+            name='working_days',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0027_leave_working_days'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['updated_at', 'id'], name='employee_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee_leave',
+            index=models.Index(fields=['updated_at', 'id'], name='leave_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leavebalance',
+            index=models.Index(fields=['updated_at', 'id'], name='balance_updated_idx'),
+        ),
+    ]
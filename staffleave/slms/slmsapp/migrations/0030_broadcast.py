@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Notifications with the same sender and content created this close together
+# were sent by one bulk send, one row per recipient
+BULK_SEND_WINDOW = timedelta(minutes=1)
+
+
+def group_into_broadcasts(apps, schema_editor):
+    Broadcast = apps.get_model('slmsapp', 'Broadcast')
+    Notification = apps.get_model('slmsapp', 'Notification')
+
+    groups = []
+    rows = Notification.objects.order_by('sender_id', 'title', 'message', 'notification_type', 'created_at', 'id').values_list(
+        'id', 'sender_id', 'title', 'message', 'notification_type', 'created_at'
+    )
+    for pk, sender_id, title, message, notification_type, created_at in rows.iterator():
+        content = (sender_id, title, message, notification_type)
+        if not groups or groups[-1][0] != content or created_at - groups[-1][1] > BULK_SEND_WINDOW:
+            groups.append((content, created_at, []))
+        groups[-1][2].append(pk)
+
+    for (sender_id, title, message, notification_type), created_at, ids in groups:
+        broadcast = Broadcast.objects.create(
+            sender_id=sender_id, title=title, message=message, notification_type=notification_type
+        )
+        Broadcast.objects.filter(pk=broadcast.pk).update(created_at=created_at)
+        for start in range(0, len(ids), 500):
+            Notification.objects.filter(pk__in=ids[start:start + 500]).update(broadcast=broadcast)
+
+    # Best estimate of when older notifications were read
+    Notification.objects.filter(is_read=True).update(read_at=models.F('updated_at'))
+
+
+def copy_content_back(apps, schema_editor):
+    Notification = apps.get_model('slmsapp', 'Notification')
+    for notification in Notification.objects.select_related('broadcast').exclude(broadcast=None).iterator():
+        notification.title = notification.broadcast.title
+        notification.message = notification.broadcast.message
+        notification.save(update_fields=['title', 'message'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('slmsapp', '0029_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('notification_type', models.CharField(choices=[('info', 'Information'), ('warning', 'Warning'), ('success', 'Success'), ('error', 'Error'), ('reminder', 'Reminder')], default='info', max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcasts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Broadcast',
+                'verbose_name_plural': 'Broadcasts',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['sender', '-created_at'], name='broadcast_sender_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='broadcast',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='slmsapp.broadcast'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(group_into_broadcasts, copy_content_back),
+    ]
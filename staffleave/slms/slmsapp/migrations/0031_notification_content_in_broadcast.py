@@ -0,0 +1,36 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0030_broadcast'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='broadcast',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='slmsapp.broadcast'),
+        ),
+        # Defaults only so that migrating back can add the columns again
+        migrations.AlterField(
+            model_name='notification',
+            name='message',
+            field=models.TextField(default=''),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='title',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='notification',
+            name='message',
+        ),
+        migrations.RemoveField(
+            model_name='notification',
+            name='title',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:31
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_unread(apps, schema_editor):
+    CustomUser = apps.get_model('slmsapp', 'CustomUser')
+    Notification = apps.get_model('slmsapp', 'Notification')
+    unread = (
+        Notification.objects.filter(recipient=models.OuterRef('pk'), is_read=False)
+        .order_by().values('recipient').annotate(count=models.Count('id')).values('count')
+    )
+    CustomUser.objects.update(unread_notifications=Coalesce(models.Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0033_digest_preferences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:41
+
+from django.db import migrations, models
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    # Rows without a department or leave type were not kept unique, so the
+    # same key may have several; fold each group into its first row
+    LeaveMonthlyRollup = apps.get_model('slmsapp', 'LeaveMonthlyRollup')
+    duplicates = (
+        LeaveMonthlyRollup.objects.filter(models.Q(department__isnull=True) | models.Q(leave_type__isnull=True))
+        .values('month', 'department', 'leave_type', 'status')
+        .annotate(rows=models.Count('id'), leaves=models.Sum('leaves'), days=models.Sum('days'), working_days=models.Sum('working_days'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        rows = LeaveMonthlyRollup.objects.filter(
+            month=group['month'], department=group['department'], leave_type=group['leave_type'], status=group['status']
+        ).order_by('id')
+        keep = rows.first()
+        rows.exclude(pk=keep.pk).delete()
+        LeaveMonthlyRollup.objects.filter(pk=keep.pk).update(
+            leaves=group['leaves'], days=group['days'], working_days=group['working_days']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slmsapp', '0034_unread_notification_counter'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='leavemonthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('department__isnull', True), ('leave_type__isnull', False)), fields=('month', 'leave_type', 'status'), name='leave_rollup_no_department_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='leavemonthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('department__isnull', False), ('leave_type__isnull', True)), fields=('month', 'department', 'status'), name='leave_rollup_no_leave_type_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='leavemonthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('department__isnull', True), ('leave_type__isnull', True)), fields=('month', 'status'), name='leave_rollup_unassigned_key'),
+        ),
+    ]
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractUser
-from django.core.validators import MinValueValidator
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 
 class CustomUser(AbstractUser):
     USER ={
@@ -12,15 +13,52 @@ class CustomUser(AbstractUser):
     user_type = models.CharField(choices=USER,max_length=50,default=2)
     # is_active is already in AbstractUser, no need to redefine
 
+    DIGEST_FREQUENCY_CHOICES = [
+        ('off', 'Off'),
+        ('hourly', 'Hourly'),
+        ('daily', 'Daily'),
+    ]
+
     profile_pic = models.ImageField(upload_to='media/profile_pic', blank=True, null=True)
+    # Opt-in email digest of unread notifications, see slms.digest_utils
+    digest_frequency = models.CharField(max_length=10, choices=DIGEST_FREQUENCY_CHOICES, default='off')
+    digest_sent_through = models.DateTimeField(blank=True, null=True)  # End of the period the last digest covered
+    # Kept in step by slms.notification_utils and cached there, so the header badge never counts notifications
+    unread_notifications = models.PositiveIntegerField(default=0)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Digest runs page through subscribers by id
+            models.Index(fields=['digest_frequency', 'id'], name='user_digest_idx'),
+        ]
 
     def __str__(self):
         return self.username
 
 
+class HolidayCalendar(models.Model):
+    """Holidays and work week for a site; assigned to departments"""
+    name = models.CharField(max_length=200, unique=True)
+    description = models.TextField(blank=True, null=True)
+    # Working days counted from Monday; blank falls back to the working_days_per_week setting
+    working_days_per_week = models.IntegerField(blank=True, null=True, validators=[MinValueValidator(0), MaxValueValidator(7)])
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "Holiday Calendar"
+        verbose_name_plural = "Holiday Calendars"
+        ordering = ['name']
+
+
 class Department(models.Model):
     name = models.CharField(max_length=200, unique=True)
     description = models.TextField(blank=True, null=True)
+    holiday_calendar = models.ForeignKey(HolidayCalendar, on_delete=models.SET_NULL, null=True, blank=True, related_name='departments')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -55,35 +93,43 @@ class Employee(models.Model):
     def __str__(self):
         return self.admin.username
     
+    # Generated IDs: EMP001, EMP002, ... EMP999, EMP1000
+    EMPLOYEE_ID_FORMAT = 'EMP{:03d}'
+    EMPLOYEE_ID_SEQUENCE = 'employee_id'
+
+    @staticmethod
+    def last_employee_number():
+        """Highest number among the generated-style IDs (EMP followed by digits) in use"""
+        numbers = Employee.objects.filter(employee_id__regex=r'^EMP[0-9]+$').values_list('employee_id', flat=True)
+        # Compared as numbers: as strings EMP1000 would sort before EMP999
+        return max((int(employee_id[3:]) for employee_id in numbers), default=0)
+
+    @staticmethod
+    def generate_employee_ids(count, taken=()):
+        """
+        Allocate unique employee IDs in the format EMP001, EMP002, etc.
+
+        Numbers come from the employee_id sequence, so concurrent requests
+        never get the same ID. IDs already in use (or listed in taken, e.g.
+        IDs given in an import file) are skipped.
+        """
+        taken = set(taken)
+        employee_ids = []
+        while len(employee_ids) < count:
+            needed = count - len(employee_ids)
+            first = Sequence.reserve(Employee.EMPLOYEE_ID_SEQUENCE, needed, initial=Employee.last_employee_number)
+            candidates = [Employee.EMPLOYEE_ID_FORMAT.format(number) for number in range(first, first + needed)]
+            for start in range(0, needed, 500):
+                taken.update(Employee.objects.filter(
+                    employee_id__in=candidates[start:start + 500]
+                ).values_list('employee_id', flat=True))
+            employee_ids.extend(employee_id for employee_id in candidates if employee_id not in taken)
+        return employee_ids
+
     @staticmethod
     def generate_employee_id():
-        """Generate a unique employee ID in the format EMP001, EMP002, etc."""
-        # Get the highest existing employee ID number
-        last_employee = Employee.objects.filter(employee_id__isnull=False).exclude(employee_id='').order_by('employee_id').last()
-        
-        if last_employee and last_employee.employee_id:
-            # Try to extract number from existing IDs (handle formats like EMP001, EMP1, etc.)
-            import re
-            match = re.search(r'(\d+)', last_employee.employee_id)
-            if match:
-                last_num = int(match.group(1))
-                new_num = last_num + 1
-            else:
-                # If no number found, start from 1
-                new_num = 1
-        else:
-            # No existing IDs, start from 1
-            new_num = 1
-        
-        # Format as EMP001, EMP002, etc. (3-digit padding)
-        employee_id = f"EMP{new_num:03d}"
-        
-        # Ensure uniqueness (in case of gaps or manual entries)
-        while Employee.objects.filter(employee_id=employee_id).exists():
-            new_num += 1
-            employee_id = f"EMP{new_num:03d}"
-        
-        return employee_id
+        """Allocate one unique employee ID in the format EMP001, EMP002, etc."""
+        return Employee.generate_employee_ids(1)[0]
     
     def save(self, *args, **kwargs):
         """Override save to auto-generate employee_id if not provided"""
@@ -93,6 +139,10 @@ class Employee(models.Model):
 
     class Meta:
         db_table = 'slmsapp_staff'  # Keep using existing table name
+        indexes = [
+            # Keyset pagination of the change feed
+            models.Index(fields=['updated_at', 'id'], name='employee_updated_idx'),
+        ]
 
 
 class DepartmentHead(models.Model):
@@ -113,6 +163,8 @@ class LeaveType(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     max_days_per_year = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Unused days that may roll into the next year; blank falls back to the leave_carryover_days setting
+    max_carryover_days = models.IntegerField(blank=True, null=True, validators=[MinValueValidator(0)])
     requires_approval = models.BooleanField(default=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -157,6 +209,10 @@ class LeaveBalance(models.Model):
         unique_together = ['employee', 'leave_type', 'year']
         verbose_name = "Leave Balance"
         verbose_name_plural = "Leave Balances"
+        indexes = [
+            # Keyset pagination of the change feed
+            models.Index(fields=['updated_at', 'id'], name='balance_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.employee.admin.username} - {self.leave_type.name} ({self.year})"
@@ -179,6 +235,7 @@ class Employee_Leave(models.Model):
     leave_type_name = models.CharField(max_length=100, blank=True, null=True)  # Keep for backward compatibility
     from_date = models.DateField()
     to_date = models.DateField()
+    working_days = models.IntegerField(null=True, blank=True)  # Counted by the working-day engine when submitted
     message = models.TextField()
     supporting_document = models.FileField(upload_to='leave_documents/', null=True, blank=True)
     status = models.IntegerField(choices=STATUS_CHOICES, default=0)
@@ -200,11 +257,115 @@ class Employee_Leave(models.Model):
             return self.supporting_document.name.split('/')[-1]
         return None
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'from_date', 'to_date'} & set(update_fields):
+            # New dates are recounted before saving (see signals), so store the count too
+            kwargs['update_fields'] = {*update_fields, 'working_days'}
+        super().save(*args, **kwargs)
+
     class Meta:
         db_table = 'slmsapp_staff_leave'  # Keep using existing table name
         verbose_name = "Employee Leave"
         verbose_name_plural = "Employee Leaves"
         ordering = ['-created_at']
+        indexes = [
+            # Analytics counts that the monthly rollups cannot answer
+            models.Index(fields=['status', 'created_at', 'employee_id'], name='leave_status_created_idx'),
+            models.Index(fields=['status', 'to_date'], name='leave_status_to_date_idx'),
+            # Keyset pagination of the change feed
+            models.Index(fields=['updated_at', 'id'], name='leave_updated_idx'),
+        ]
+
+
+class LeaveLedgerEntry(models.Model):
+    """
+    Append-only record of every change to a leave balance
+
+    Accruals move days_entitled; debits, reversals and adjustments move
+    days_used. Entries that must only ever be posted once carry a unique key
+    (e.g. the debit for a leave approval), so a repeated post is rejected by
+    the database instead of changing the balance twice.
+    """
+    ACCRUAL = 'accrual'
+    DEBIT = 'debit'
+    REVERSAL = 'reversal'
+    ADJUSTMENT = 'adjustment'
+    ENTRY_TYPES = [
+        (ACCRUAL, 'Accrual'),
+        (DEBIT, 'Debit'),
+        (REVERSAL, 'Reversal'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
+
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='ledger_entries')
+    leave_type = models.ForeignKey(LeaveType, on_delete=models.CASCADE)
+    year = models.IntegerField()
+    leave = models.ForeignKey(Employee_Leave, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    # Signed change to the balance column the entry type moves
+    days = models.IntegerField()
+    # Approval round of the leave; re-approving after a reversal starts a new one
+    cycle = models.PositiveIntegerField(default=0)
+    key = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Leave Ledger Entry"
+        verbose_name_plural = "Leave Ledger Entries"
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['employee', 'leave_type', 'year'], name='ledger_balance_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_entry_type_display()} {self.days} ({self.year})"
+
+
+class LeaveMonthlyRollup(models.Model):
+    """
+    Number of leave applications and their calendar and working days per month
+
+    Keyed by the month the leave was applied for, the employee's department,
+    the leave type and the status. Signals on Employee_Leave keep the counts
+    current; the rebuild_leave_rollups command recomputes them from scratch.
+    When a department or leave type is deleted its rows are merged into the
+    matching unassigned ones (see slmsapp.signals), so the foreign keys are
+    only set to NULL here as a fallback.
+    """
+    month = models.DateField()  # First day of the month the leave was applied in
+    department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True, related_name='leave_rollups')
+    leave_type = models.ForeignKey(LeaveType, on_delete=models.SET_NULL, null=True, blank=True, related_name='leave_rollups')
+    status = models.IntegerField(choices=Employee_Leave.STATUS_CHOICES)
+    leaves = models.IntegerField(default=0)
+    days = models.IntegerField(default=0)
+    working_days = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Leave Monthly Rollup"
+        verbose_name_plural = "Leave Monthly Rollups"
+        ordering = ['month']
+        # NULLs never compare equal in a unique index, so each combination of
+        # missing department and leave type gets its own partial constraint
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'department', 'leave_type', 'status'], name='leave_rollup_key'),
+            models.UniqueConstraint(
+                fields=['month', 'leave_type', 'status'], name='leave_rollup_no_department_key',
+                condition=models.Q(department__isnull=True, leave_type__isnull=False),
+            ),
+            models.UniqueConstraint(
+                fields=['month', 'department', 'status'], name='leave_rollup_no_leave_type_key',
+                condition=models.Q(department__isnull=False, leave_type__isnull=True),
+            ),
+            models.UniqueConstraint(
+                fields=['month', 'status'], name='leave_rollup_unassigned_key',
+                condition=models.Q(department__isnull=True, leave_type__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%b %Y} - {self.get_status_display()}: {self.leaves}"
 
 
 class PublicHoliday(models.Model):
@@ -213,6 +374,8 @@ class PublicHoliday(models.Model):
     description = models.TextField(blank=True, null=True)
     is_recurring = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
+    # Empty for holidays observed everywhere
+    calendar = models.ForeignKey(HolidayCalendar, on_delete=models.CASCADE, null=True, blank=True, related_name='holidays')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -259,7 +422,11 @@ class CalendarEvent(models.Model):
         return f"{self.title} - {self.event_date}"
 
 
-class Notification(models.Model):
+class Broadcast(models.Model):
+    """
+    A notification as its sender wrote it, stored once however many
+    people it went to; each recipient has a Notification pointing here
+    """
     NOTIFICATION_TYPE_CHOICES = [
         ('info', 'Information'),
         ('warning', 'Warning'),
@@ -271,9 +438,37 @@ class Notification(models.Model):
     title = models.CharField(max_length=255)
     message = models.TextField()
     notification_type = models.CharField(max_length=50, choices=NOTIFICATION_TYPE_CHOICES, default='info')
+    sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='broadcasts')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Broadcast"
+        verbose_name_plural = "Broadcasts"
+        ordering = ['-created_at']
+        indexes = [
+            # Sent notifications page
+            models.Index(fields=['sender', '-created_at'], name='broadcast_sender_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sender.username}: {self.title}"
+
+
+class Notification(models.Model):
+    """
+    Delivery of a broadcast to one recipient, with its read state
+
+    The sender and type are copied from the broadcast so an inbox can be
+    filtered and listed without reading the broadcasts.
+    """
+    NOTIFICATION_TYPE_CHOICES = Broadcast.NOTIFICATION_TYPE_CHOICES
+
+    broadcast = models.ForeignKey(Broadcast, on_delete=models.CASCADE, related_name='deliveries')
+    notification_type = models.CharField(max_length=50, choices=NOTIFICATION_TYPE_CHOICES, default='info')
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='sent_notifications')
     recipient = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='received_notifications')
     is_read = models.BooleanField(default=False)
+    read_at = models.DateTimeField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -286,15 +481,25 @@ class Notification(models.Model):
     def __str__(self):
         return f"{self.sender.username} -> {self.recipient.username}: {self.title}"
 
+    @property
+    def title(self):
+        return self.broadcast.title
+
+    @property
+    def message(self):
+        return self.broadcast.message
+
     def mark_as_read(self):
-        """Mark notification as read"""
-        self.is_read = True
-        self.save(update_fields=['is_read', 'updated_at'])
+        """Mark notification as read, updating the recipient's unread count"""
+        from slms.notification_utils import set_notifications_read
+        set_notifications_read(self.recipient_id, Notification.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['is_read', 'read_at', 'updated_at'])
 
     def mark_as_unread(self):
-        """Mark notification as unread"""
-        self.is_read = False
-        self.save(update_fields=['is_read', 'updated_at'])
+        """Mark notification as unread, updating the recipient's unread count"""
+        from slms.notification_utils import set_notifications_read
+        set_notifications_read(self.recipient_id, Notification.objects.filter(pk=self.pk), is_read=False)
+        self.refresh_from_db(fields=['is_read', 'read_at', 'updated_at'])
 
 
 class SystemSettings(models.Model):
@@ -312,6 +517,90 @@ class SystemSettings(models.Model):
         return self.key
 
 
+class Sequence(models.Model):
+    """
+    Named counter handing out numbers, e.g. for employee IDs
+
+    Numbers are reserved with a single UPDATE, which locks the row until the
+    reserving transaction ends, so no two callers ever get the same number.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Sequence"
+        verbose_name_plural = "Sequences"
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+
+    @classmethod
+    def reserve(cls, name, count=1, initial=None):
+        """
+        Reserve a block of consecutive numbers
+
+        Args:
+            name: Sequence name; the sequence is created on first use
+            count: How many numbers to reserve
+            initial: Callable returning the last number already used, for a
+                sequence taking over from existing data (default: 0)
+
+        Returns:
+            int: The first number of the block
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(name=name).update(last_value=models.F('last_value') + count):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(name=name, last_value=(initial() if initial else 0) + count)
+                except IntegrityError:
+                    # Created by a concurrent caller meanwhile
+                    cls.objects.filter(name=name).update(last_value=models.F('last_value') + count)
+            last_value = cls.objects.filter(name=name).values_list('last_value', flat=True).get()
+        return last_value - count + 1
+
+
+class OutboxMessage(models.Model):
+    """
+    A notification or email waiting to be delivered
+
+    Views write these in the same transaction as the change they report,
+    and the process_outbox command delivers them, so a slow mail server
+    never holds up a request and nothing is sent for a change that was
+    rolled back.
+    """
+    KIND_CHOICES = [
+        ('notification', 'Notification'),
+        ('email', 'Email'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = models.JSONField()  # Arguments of the delivery, see slms.outbox_utils
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Outbox Message"
+        verbose_name_plural = "Outbox Messages"
+        ordering = ['id']
+        indexes = [
+            # Messages due for delivery
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.status})"
+
+
 class SavedFilter(models.Model):
     """Save and reuse common filter combinations"""
     FILTER_TYPE_CHOICES = [
@@ -0,0 +1,135 @@
+"""
+Model signal handlers that keep derived data in step with its sources
+"""
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import (
+    CustomUser, Department, Employee, Employee_Leave, HolidayCalendar, LeaveType, PublicHoliday, SystemSettings
+)
+
+
+@receiver(post_save, sender=PublicHoliday)
+@receiver(post_delete, sender=PublicHoliday)
+@receiver(post_save, sender=HolidayCalendar)
+@receiver(post_delete, sender=HolidayCalendar)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def holiday_changed(sender, **kwargs):
+    """Drop compiled working-day calendars when holidays or calendar assignments change"""
+    from slms.calendar_utils import schedule_calendar_invalidation
+    schedule_calendar_invalidation()
+
+
+@receiver(post_save, sender=SystemSettings)
+@receiver(post_delete, sender=SystemSettings)
+def work_week_changed(sender, instance, **kwargs):
+    """Recompile calendars when the default work week is changed"""
+    if instance.key == 'working_days_per_week':
+        from slms.calendar_utils import schedule_calendar_invalidation
+        schedule_calendar_invalidation()
+
+
+@receiver(pre_save, sender=Employee_Leave)
+def leave_about_to_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Note which rollup row a leave is counted in before it is changed, and
+    count its working days when it has none yet or its dates change
+    """
+    if raw:
+        return
+    from slms.analytics_utils import stored_rollup_entry, stored_rollup_row
+    stored = stored_rollup_row(instance.pk) if instance.pk else None
+    instance._rollup_entry = stored_rollup_entry(stored)
+
+    # Employee_Leave.save() adds working_days to update_fields with the dates
+    if update_fields is not None and 'working_days' not in update_fields:
+        return
+    from_date = sender._meta.get_field('from_date').to_python(instance.from_date)
+    to_date = sender._meta.get_field('to_date').to_python(instance.to_date)
+    if instance.working_days is not None and (stored is None or stored[4:6] == (from_date, to_date)):
+        return
+    from slms.leave_utils import calculate_working_days
+    instance.working_days = calculate_working_days(from_date, to_date, instance.employee_id)
+
+
+@receiver(post_save, sender=Employee_Leave)
+def leave_saved(sender, instance, raw=False, **kwargs):
+    """Count a new or changed leave in the monthly rollups"""
+    if raw:
+        return
+    from slms.analytics_utils import leave_rollup_entry, move_rollup_entry
+    move_rollup_entry(getattr(instance, '_rollup_entry', None), leave_rollup_entry(instance))
+
+
+@receiver(post_delete, sender=Employee_Leave)
+def leave_deleted(sender, instance, **kwargs):
+    """Take a deleted leave out of the monthly rollups"""
+    from slms.analytics_utils import leave_rollup_entry, move_rollup_entry
+    move_rollup_entry(leave_rollup_entry(instance), None)
+
+
+@receiver(pre_save, sender=Employee)
+def remember_employee_department(sender, instance, raw=False, **kwargs):
+    """Note an employee's department before it is changed"""
+    if raw or not instance.pk:
+        return
+    instance._previous_department_id = (
+        Employee.objects.filter(pk=instance.pk).values_list('department_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Employee)
+def employee_department_changed(sender, instance, created, raw=False, **kwargs):
+    """Move an employee's leaves to their new department in the monthly rollups"""
+    if raw or created:
+        return
+    previous = getattr(instance, '_previous_department_id', instance.department_id)
+    if previous != instance.department_id:
+        from slms.analytics_utils import move_employee_rollups
+        move_employee_rollups(instance.pk, previous, instance.department_id)
+
+
+@receiver(pre_delete, sender=Department)
+def department_deleted(sender, instance, **kwargs):
+    """Count a deleted department's leaves as leaves without a department"""
+    from slms.analytics_utils import merge_rollups
+    merge_rollups(instance.leave_rollups.all(), department=True)
+
+
+@receiver(pre_delete, sender=LeaveType)
+def leave_type_deleted(sender, instance, **kwargs):
+    """Count a deleted leave type's leaves as leaves without a leave type"""
+    from slms.analytics_utils import merge_rollups
+    merge_rollups(instance.leave_rollups.all(), leave_type=True)
+
+
+@receiver(post_save, sender=CustomUser)
+def employee_account_changed(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Stamp the employee record when its account changes, so the change feed sends it again"""
+    if raw or created:
+        return
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    Employee.objects.filter(admin=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Employee_Leave)
+@receiver(post_delete, sender=Employee_Leave)
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_save, sender=LeaveType)
+@receiver(post_delete, sender=LeaveType)
+@receiver(post_save, sender=PublicHoliday)
+@receiver(post_delete, sender=PublicHoliday)
+def analytics_source_changed(sender, update_fields=None, **kwargs):
+    """Drop the cached dashboard figures when anything they count changes"""
+    # Logging in only stamps last_login, which no dashboard shows
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    from slms.analytics_utils import schedule_analytics_invalidation
+    schedule_analytics_invalidation()
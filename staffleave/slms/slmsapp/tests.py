@@ -1,5 +1,50 @@
-from django.test import TestCase
-from .models import CustomUser
+import csv
+from datetime import date, datetime, timedelta
+from io import StringIO
+import json
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+
+from django.apps import apps
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from slms import notification_utils, outbox_utils
+from slms.absence_utils import absence_metrics
+from slms.analytics_utils import (
+	build_leave_analytics, get_dashboard_analytics, headcount_on_leave, invalidate_analytics
+)
+from slms.calendar_utils import (
+	calendar_for_department, count_working_days, get_month_holidays, invalidate_holiday_calendar
+)
+from slms.changefeed_utils import read_changes
+from slms.digest_utils import send_digests
+from slms.import_utils import import_employees, read_import_file
+from slms.leave_utils import (
+	calculate_working_days, calculate_working_days_bulk, revert_leave_balance_on_rejection,
+	set_balance_entitlement, update_leave_balance_on_approval, working_days_by_balance
+)
+from slms.notification_utils import audience_recipients, send_notification, send_notifications
+from slms.outbox_utils import (
+	OUTBOX_MAX_ATTEMPTS, OUTBOX_RETENTION, enqueue_email, process_outbox, purge_outbox
+)
+
+from slmsapp.management.commands.rebuild_leave_balances import Command
+from .models import (
+	Broadcast, CustomUser, Department, DepartmentHead, Employee, Employee_Leave, HolidayCalendar,
+	LeaveBalance, LeaveEntitlement, LeaveLedgerEntry, LeaveMonthlyRollup, LeaveType, Notification,
+	OutboxMessage, PublicHoliday, Sequence, SystemSettings
+)
 
 
 class GoogleLoginFlagTests(TestCase):
@@ -10,3 +55,994 @@ class GoogleLoginFlagTests(TestCase):
 	def test_google_login_flag_can_be_set(self):
 		user = CustomUser.objects.create(username='guser', email='guser@example.com', google_login_enabled=True)
 		self.assertTrue(user.google_login_enabled)
+
+
+class WorkingDayCalendarTests(TestCase):
+	def setUp(self):
+		invalidate_holiday_calendar()
+
+	def _naive_count(self, from_date, to_date, holidays=()):
+		count = 0
+		current = from_date
+		while current <= to_date:
+			if current.weekday() < 5 and current not in holidays:
+				count += 1
+			current += timedelta(days=1)
+		return count
+
+	def test_matches_day_by_day_count(self):
+		PublicHoliday.objects.create(name='Christmas', date=date(2025, 12, 25))
+		PublicHoliday.objects.create(name='New Year', date=date(2026, 1, 1))
+		holidays = {date(2025, 12, 25), date(2026, 1, 1)}
+		ranges = [
+			(date(2025, 12, 22), date(2025, 12, 26)),
+			(date(2025, 12, 29), date(2026, 1, 5)),
+			(date(2024, 2, 28), date(2027, 3, 1)),
+			(date(2025, 6, 7), date(2025, 6, 8)),
+		]
+		for from_date, to_date in ranges:
+			self.assertEqual(
+				calculate_working_days(from_date, to_date),
+				self._naive_count(from_date, to_date, holidays),
+			)
+		self.assertEqual(calculate_working_days(date(2025, 1, 2), date(2025, 1, 1)), 0)
+
+	def test_holiday_changes_invalidate_compiled_year(self):
+		self.assertEqual(calculate_working_days(date(2025, 3, 3), date(2025, 3, 7)), 5)
+		holiday = PublicHoliday.objects.create(name='Founders Day', date=date(2025, 3, 5))
+		self.assertEqual(calculate_working_days(date(2025, 3, 3), date(2025, 3, 7)), 4)
+		holiday.is_active = False
+		holiday.save()
+		self.assertEqual(calculate_working_days(date(2025, 3, 3), date(2025, 3, 7)), 5)
+
+	def test_bulk_matches_single_range_calculation(self):
+		PublicHoliday.objects.create(name='Christmas', date=date(2025, 12, 25))
+		PublicHoliday.objects.create(name='New Year', date=date(2026, 1, 1))
+		ranges = [
+			(date(2025, 12, 22), date(2025, 12, 26)),
+			(date(2025, 12, 29), date(2026, 1, 5)),
+			(date(2025, 6, 7), date(2025, 6, 8)),
+			(date(2025, 1, 2), date(2025, 1, 1)),
+		]
+		counts = calculate_working_days_bulk(ranges)
+		self.assertEqual(list(counts), [calculate_working_days(a, b) for a, b in ranges])
+		self.assertEqual(len(calculate_working_days_bulk([])), 0)
+
+	def test_recurring_holidays_expand_into_later_years(self):
+		PublicHoliday.objects.create(name='Christmas', date=date(2024, 12, 25), is_recurring=True)
+		PublicHoliday.objects.create(name='Office Party', date=date(2024, 12, 20))
+		# Thursday 25 December 2025 is a weekday
+		self.assertEqual(calculate_working_days(date(2025, 12, 22), date(2025, 12, 26)), 4)
+		self.assertEqual(
+			[(h.date, h.name) for h in get_month_holidays(2026, 12)],
+			[(date(2026, 12, 25), 'Christmas')],
+		)
+		self.assertEqual(len(get_month_holidays(2024, 12)), 2)
+		self.assertEqual(get_month_holidays(2023, 12), [])
+
+	def test_department_calendar_overrides_work_week_and_holidays(self):
+		site = HolidayCalendar.objects.create(name='Site A', working_days_per_week=6)
+		plant = Department.objects.create(name='Plant', holiday_calendar=site)
+		office = Department.objects.create(name='Office')
+		PublicHoliday.objects.create(name='Site Day', date=date(2025, 3, 5), calendar=site)
+		PublicHoliday.objects.create(name='National Day', date=date(2025, 3, 6))
+		week = (date(2025, 3, 3), date(2025, 3, 9))
+		site_id = calendar_for_department(plant.id)
+		self.assertEqual(site_id, site.id)
+		self.assertIsNone(calendar_for_department(office.id))
+		# Site A works Monday to Saturday and observes both holidays
+		self.assertEqual(count_working_days(*week, site_id), 4)
+		# Everyone else works Monday to Friday and only observes the national one
+		self.assertEqual(count_working_days(*week, calendar_for_department(office.id)), 4)
+		self.assertEqual(count_working_days(date(2025, 3, 10), date(2025, 3, 16), site_id), 6)
+		self.assertEqual(count_working_days(date(2025, 3, 10), date(2025, 3, 16)), 5)
+		np.testing.assert_array_equal(
+			calculate_working_days_bulk([week, (date(2025, 3, 5), date(2025, 3, 5))], site_id),
+			[4, 0],
+		)
+		np.testing.assert_array_equal(
+			calculate_working_days_bulk([(date(2025, 3, 5), date(2025, 3, 5))]),
+			[1],
+		)
+		site.is_active = False
+		site.save()
+		self.assertIsNone(calendar_for_department(plant.id))
+
+
+class LeaveLedgerTests(TestCase):
+	def setUp(self):
+		user = CustomUser.objects.create_user(username='ledger', password='x', user_type=2)
+		self.employee = Employee.objects.create(admin=user, address='a', gender='F')
+		self.leave_type = LeaveType.objects.create(name='Annual')
+		# Monday to Friday, no holidays
+		self.leave = Employee_Leave.objects.create(
+			employee_id=self.employee, leave_type=self.leave_type,
+			from_date=date(2025, 6, 2), to_date=date(2025, 6, 6), message='trip', status=1,
+		)
+
+	def balance(self, year=2025):
+		return LeaveBalance.objects.get(employee=self.employee, leave_type=self.leave_type, year=year)
+
+	def test_approving_twice_debits_once(self):
+		set_balance_entitlement(self.employee, self.leave_type, 2025, 20)
+		self.assertTrue(update_leave_balance_on_approval(self.leave))
+		self.assertFalse(update_leave_balance_on_approval(self.leave))
+		balance = self.balance()
+		self.assertEqual((balance.days_entitled, balance.days_used, balance.days_remaining), (20, 5, 15))
+		self.assertEqual(self.leave.ledger_entries.count(), 1)
+
+	def test_rejection_reverses_and_reapproval_debits_again(self):
+		update_leave_balance_on_approval(self.leave)
+		self.leave.status = 2
+		self.assertTrue(revert_leave_balance_on_rejection(self.leave))
+		self.assertFalse(revert_leave_balance_on_rejection(self.leave))
+		self.assertEqual(self.balance().days_used, 0)
+		self.leave.status = 1
+		self.assertTrue(update_leave_balance_on_approval(self.leave))
+		self.assertEqual(self.balance().days_used, 5)
+		self.assertEqual(
+			list(self.leave.ledger_entries.values_list('entry_type', 'days', 'cycle')),
+			[(LeaveLedgerEntry.DEBIT, 5, 1), (LeaveLedgerEntry.REVERSAL, -5, 1), (LeaveLedgerEntry.DEBIT, 5, 2)],
+		)
+
+	def test_leave_spanning_new_year_debits_both_years(self):
+		# Mon 29 Dec 2025 to Mon 5 Jan 2026
+		self.leave.from_date, self.leave.to_date = date(2025, 12, 29), date(2026, 1, 5)
+		self.leave.save()
+		self.assertTrue(update_leave_balance_on_approval(self.leave))
+		self.assertEqual((self.balance(2025).days_used, self.balance(2026).days_used), (3, 3))
+		self.assertEqual(
+			working_days_by_balance(Employee_Leave.objects.all()),
+			{(self.employee.id, self.leave_type.id, 2025): 3, (self.employee.id, self.leave_type.id, 2026): 3},
+		)
+		self.leave.status = 2
+		self.assertTrue(revert_leave_balance_on_rejection(self.leave))
+		self.assertEqual((self.balance(2025).days_used, self.balance(2026).days_used), (0, 0))
+
+	def test_apply_checks_the_balance_of_each_year(self):
+		# The last Monday of next December up to the Friday after New Year
+		year = date.today().year + 1
+		from_date = date(year, 12, 31) - timedelta(days=date(year, 12, 31).weekday())
+		to_date = from_date + timedelta(days=11)
+		set_balance_entitlement(self.employee, self.leave_type, year, 20)
+		set_balance_entitlement(self.employee, self.leave_type, year + 1, 1)
+		self.client.force_login(self.employee.admin)
+		response = self.client.post('/Employee/Apply_Leave_save', {
+			'leave_type': self.leave_type.id, 'from_date': from_date.isoformat(),
+			'to_date': to_date.isoformat(), 'message': 'holidays',
+		})
+		self.assertIn(f'Insufficient {year + 1} leave balance', [str(m) for m in get_messages(response.wsgi_request)][0])
+		self.assertFalse(Employee_Leave.objects.filter(from_date=from_date).exists())
+
+	def test_rejection_is_undone_when_the_reversal_fails(self):
+		set_balance_entitlement(self.employee, self.leave_type, 2025, 20)
+		self.client.force_login(CustomUser.objects.create_user(username='hr', password='x', user_type=4))
+		self.client.post(f'/HR/Leave/Approve/{self.leave.pk}')
+		self.assertEqual(self.balance().days_used, 5)
+		with mock.patch('slms.leave_utils.revert_leave_balance_on_rejection', side_effect=RuntimeError('ledger down')):
+			with self.assertRaises(RuntimeError):
+				self.client.post(f'/HR/Leave/Reject/{self.leave.pk}', {'rejection_reason': 'No cover'})
+		self.leave.refresh_from_db()
+		self.assertEqual((self.leave.status, self.balance().days_used), (1, 5))
+		self.client.post(f'/HR/Leave/Reject/{self.leave.pk}', {'rejection_reason': 'No cover'})
+		self.leave.refresh_from_db()
+		self.assertEqual((self.leave.status, self.balance().days_used), (2, 0))
+
+	def test_rebuild_command_repairs_drifted_balances(self):
+		year = self.leave.from_date.year
+		LeaveBalance.objects.create(
+			employee=self.employee, leave_type=self.leave_type, year=year, days_entitled=20, days_used=9
+		)
+		out = StringIO()
+		with self.assertRaises(CommandError):
+			call_command('rebuild_leave_balances', '--check', stdout=out)
+		self.assertIn('days used 9 -> 5', out.getvalue())
+		call_command('rebuild_leave_balances', stdout=StringIO())
+		balance = LeaveBalance.objects.get(employee=self.employee, leave_type=self.leave_type, year=year)
+		self.assertEqual((balance.days_used, balance.days_remaining), (5, 15))
+		self.assertEqual(
+			list(LeaveLedgerEntry.objects.values_list('entry_type', 'days')),
+			[(LeaveLedgerEntry.ADJUSTMENT, -4)],
+		)
+		call_command('rebuild_leave_balances', '--check', stdout=StringIO())
+
+	def test_rebuild_keeps_an_approval_made_while_it_runs(self):
+		update_leave_balance_on_approval(self.leave)
+		set_balance_entitlement(self.employee, self.leave_type, 2025, 20)
+		later = Employee_Leave.objects.create(
+			employee_id=self.employee, leave_type=self.leave_type,
+			from_date=date(2025, 7, 7), to_date=date(2025, 7, 8), message='short', status=0,
+		)
+		read_chunks = Command.iter_balance_chunks
+
+		def approve_then_read(command, *args):
+			# Another user approves a leave after the rebuild has started
+			later.status = 1
+			later.save()
+			update_leave_balance_on_approval(later)
+			yield from read_chunks(command, *args)
+
+		with mock.patch.object(Command, 'iter_balance_chunks', approve_then_read):
+			call_command('rebuild_leave_balances', stdout=StringIO())
+		balance = self.balance()
+		self.assertEqual((balance.days_used, balance.days_remaining), (7, 13))
+
+
+	def test_rebuild_keeps_a_balance_created_while_it_runs(self):
+		later = Employee_Leave.objects.create(
+			employee_id=self.employee, leave_type=self.leave_type,
+			from_date=date(2025, 7, 7), to_date=date(2025, 7, 8), message='short', status=1,
+		)
+		get_entitlements = Command.get_entitlements
+
+		def approve_then_get(command, keys):
+			# The approval creates the balance the rebuild is about to create
+			update_leave_balance_on_approval(later)
+			return get_entitlements(command, keys)
+
+		with mock.patch.object(Command, 'get_entitlements', approve_then_get):
+			call_command('rebuild_leave_balances', stdout=StringIO())
+		self.assertEqual(self.balance().days_used, 7)
+
+class EntitlementPageTests(TestCase):
+	def setUp(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		self.client.force_login(hr)
+		self.leave_type = LeaveType.objects.create(name='Annual')
+
+	def add_employee(self, name):
+		user = CustomUser.objects.create_user(username=name, password='x', user_type=2)
+		employee = Employee.objects.create(admin=user, address='a', gender='F')
+		LeaveEntitlement.objects.create(employee=employee, leave_type=self.leave_type, year=2025, days_entitled=20)
+		# Friday to Monday: two working days
+		Employee_Leave.objects.create(
+			employee_id=employee, leave_type=self.leave_type,
+			from_date=date(2025, 6, 6), to_date=date(2025, 6, 9), message='m', status=1,
+		)
+
+	def test_query_count_does_not_grow_with_entitlements(self):
+		self.add_employee('first')
+		# The first request also compiles the holiday calendar
+		self.client.get('/HR/Entitlements/Set?year=2025')
+		with CaptureQueriesContext(connection) as few:
+			response = self.client.get('/HR/Entitlements/Set?year=2025')
+		self.assertEqual(response.context['entitlements'][0].used_days, 2)
+		for i in range(5):
+			self.add_employee(f'more{i}')
+		with CaptureQueriesContext(connection) as many:
+			response = self.client.get('/HR/Entitlements/Set?year=2025')
+		self.assertEqual(len(many), len(few))
+		self.assertEqual([e.remaining_days for e in response.context['entitlements']], [18] * 6)
+
+
+class YearCloseTests(TestCase):
+	def test_carry_over_is_capped_and_rerun_is_a_no_op(self):
+		SystemSettings.objects.create(key='leave_carryover_days', value='3')
+		annual = LeaveType.objects.create(name='Annual', max_days_per_year=20, max_carryover_days=5)
+		sick = LeaveType.objects.create(name='Sick', max_days_per_year=10)
+		user = CustomUser.objects.create_user(username='closer', password='x', user_type=2)
+		employee = Employee.objects.create(admin=user, address='a', gender='F')
+		LeaveEntitlement.objects.create(employee=employee, leave_type=annual, year=2024, days_entitled=22)
+		LeaveBalance.objects.create(employee=employee, leave_type=annual, year=2024, days_entitled=22, days_used=14)
+		LeaveBalance.objects.create(employee=employee, leave_type=sick, year=2024, days_entitled=10, days_used=2)
+
+		call_command('close_leave_year', year=2024, stdout=StringIO())
+		call_command('close_leave_year', year=2024, stdout=StringIO())
+
+		opened = {
+			balance.leave_type.name: (balance.days_entitled, balance.days_remaining)
+			for balance in LeaveBalance.objects.filter(year=2025)
+		}
+		# Annual keeps the individual entitlement plus 5 of 8 unused days;
+		# sick falls back to the system-wide cap of 3
+		self.assertEqual(opened, {'Annual': (27, 27), 'Sick': (13, 13)})
+		self.assertEqual(LeaveEntitlement.objects.filter(year=2025).count(), 2)
+		self.assertEqual(LeaveLedgerEntry.objects.filter(year=2025).count(), 4)
+
+		# The next close removes the carried-in days from the base entitlement
+		call_command('close_leave_year', year=2025, stdout=StringIO())
+		self.assertEqual(
+			LeaveEntitlement.objects.get(leave_type=annual, year=2026).days_entitled, 27
+		)
+
+
+class AnalyticsDashboardTests(TestCase):
+	def setUp(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		self.client.force_login(hr)
+
+	def add_department(self, name):
+		department = Department.objects.create(name=name)
+		leave_type = LeaveType.objects.create(name=f'{name} leave')
+		user = CustomUser.objects.create_user(username=name, password='x', user_type=2)
+		employee = Employee.objects.create(admin=user, address='a', gender='F', department=department)
+		# One approved three-day leave, one pending, one rejected
+		for status in (1, 0, 2):
+			Employee_Leave.objects.create(
+				employee_id=employee, leave_type=leave_type,
+				from_date=date(2025, 6, 2), to_date=date(2025, 6, 4), message='m', status=status,
+			)
+
+	def test_query_count_does_not_grow_with_departments_or_leave_types(self):
+		year = date.today().year
+		self.add_department('Finance')
+		self.client.get(f'/HR/Analytics?year={year}')
+		# Compare cold loads, not cached ones
+		invalidate_analytics()
+		with CaptureQueriesContext(connection) as few:
+			self.client.get(f'/HR/Analytics?year={year}')
+		for i in range(5):
+			self.add_department(f'Dept{i}')
+		invalidate_analytics()
+		with CaptureQueriesContext(connection) as many:
+			response = self.client.get(f'/HR/Analytics?year={year}')
+		self.assertEqual(len(many), len(few))
+
+		context = response.context
+		self.assertEqual(context['status_data'], [6, 6, 6])
+		self.assertEqual(context['total_leave_days'], 18)
+		self.assertEqual(context['employees_with_leave'], 6)
+		self.assertEqual(sum(context['monthly_data']), 18)
+		self.assertEqual(context['dept_labels'], ['Finance'] + [f'Dept{i}' for i in range(5)])
+		self.assertEqual(context['dept_approved'], [1] * 6)
+		self.assertEqual(context['leave_type_data'], [3] * 6)
+		self.assertEqual(len(context['top_leave_types']), 5)
+
+	def test_rollups_follow_leave_changes_and_match_rebuild(self):
+		self.add_department('Finance')
+		leave = Employee_Leave.objects.filter(status=0).get()
+		leave.status = 1
+		leave.to_date = date(2025, 6, 6)
+		leave.save()
+		Employee_Leave.objects.filter(status=2).get().delete()
+		employee = Employee.objects.get()
+		employee.department = Department.objects.create(name='Audit')
+		employee.save()
+
+		rollups = {
+			(rollup.department.name, rollup.status): (rollup.leaves, rollup.days, rollup.working_days)
+			for rollup in LeaveMonthlyRollup.objects.exclude(leaves=0)
+		}
+		self.assertEqual(rollups, {('Audit', 1): (2, 8, 8)})
+		call_command('rebuild_leave_rollups', check=True, stdout=StringIO())
+
+	def test_deleted_departments_and_leave_types_share_one_unassigned_rollup(self):
+		self.add_department('Finance')
+		self.add_department('Audit')
+		Department.objects.all().delete()
+		LeaveType.objects.get(name='Audit leave').delete()
+		# More leaves for employees who no longer have a department
+		for employee in Employee.objects.all():
+			Employee_Leave.objects.create(
+				employee_id=employee, leave_type=None,
+				from_date=date(2025, 6, 9), to_date=date(2025, 6, 9), message='m', status=1,
+			)
+
+		unassigned = LeaveMonthlyRollup.objects.filter(department__isnull=True, leave_type__isnull=True, status=1)
+		self.assertEqual(unassigned.values_list('leaves', flat=True).get(), 3)
+		self.assertEqual(LeaveMonthlyRollup.objects.filter(department__isnull=True, leave_type__isnull=False).count(), 3)
+		call_command('rebuild_leave_rollups', check=True, stdout=StringIO())
+
+	def test_working_days_are_stored_per_leave_and_summed_from_rollups(self):
+		self.add_department('Finance')
+		# Friday to Monday: four calendar days, two working days
+		leave = Employee_Leave.objects.create(
+			employee_id=Employee.objects.get(), leave_type_id=None,
+			from_date=date(2025, 6, 6), to_date=date(2025, 6, 9), message='m', status=1,
+		)
+		self.assertEqual(leave.working_days, 2)
+		leave.to_date = date(2025, 6, 10)
+		leave.save()
+		self.assertEqual(Employee_Leave.objects.get(pk=leave.pk).working_days, 3)
+		# Saving only the dates stores the new count too, so the rollups still match
+		leave.to_date = date(2025, 6, 11)
+		leave.save(update_fields=['to_date'])
+		self.assertEqual(Employee_Leave.objects.get(pk=leave.pk).working_days, 4)
+		call_command('rebuild_leave_rollups', check=True, stdout=StringIO())
+		leave.to_date = date(2025, 6, 10)
+		leave.save(update_fields=['to_date'])
+
+		year = leave.created_at.year
+		analytics = build_leave_analytics(year)
+		self.assertEqual((analytics['total_leave_days'], analytics['total_working_days']), (8, 6))
+		self.assertEqual(analytics['avg_working_days_per_employee'], 6)
+
+		# Leaves saved before the column existed are counted by the rebuild
+		Employee_Leave.objects.update(working_days=None)
+		with self.assertRaises(CommandError):
+			call_command('rebuild_leave_rollups', check=True, stdout=StringIO())
+		call_command('rebuild_leave_rollups', chunk_size=1, stdout=StringIO())
+		self.assertEqual(
+			sorted(Employee_Leave.objects.values_list('working_days', flat=True)), [3, 3, 3, 3]
+		)
+		self.assertEqual(build_leave_analytics(year)['total_working_days'], 6)
+		call_command('rebuild_leave_rollups', check=True, stdout=StringIO())
+
+	def test_dashboards_are_cached_until_leaves_change(self):
+		year = date.today().year
+		self.add_department('Finance')
+		self.assertEqual(get_dashboard_analytics(year)['total_leaves_applied'], 3)
+		self.assertEqual(get_dashboard_analytics(year, scope='admin')['employee_count'], 1)
+		with self.assertNumQueries(0):
+			get_dashboard_analytics(year)
+			get_dashboard_analytics(year, scope='admin')
+
+		Employee_Leave.objects.filter(status=2).delete()
+		self.assertEqual(get_dashboard_analytics(year)['total_leaves_applied'], 2)
+		self.assertEqual(get_dashboard_analytics(year, scope='admin')['status_data'], [1, 1, 0])
+
+	def test_chart_endpoints_answer_repeat_requests_with_not_modified(self):
+		url = f'/HR/Analytics/Charts/status?year={date.today().year}'
+		self.add_department('Finance')
+		response = self.client.get(url)
+		self.assertEqual(response.json()['data'], [1, 1, 1])
+		self.assertEqual(response['Cache-Control'], 'private, no-cache')
+		# A year that is not a number falls back to this year
+		self.assertEqual(self.client.get('/HR/Analytics/Charts/status?year=abc').json()['data'], [1, 1, 1])
+		etag = response['ETag']
+
+		self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		leave = Employee_Leave.objects.get(status=0)
+		leave.status = 1
+		leave.save()
+		Employee_Leave.objects.filter(status=2).delete()
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.json()['data'], [2, 0, 0])
+		self.assertEqual(self.client.get('/HR/Analytics/Charts/user-types').status_code, 404)
+
+	def test_headcount_counts_each_employee_once_per_day(self):
+		self.add_department('Finance')
+		self.add_department('Audit')
+		finance, audit = Employee.objects.order_by('id')
+		for employee, start, end, status in [
+			(finance, date(2024, 12, 30), date(2025, 1, 1), 1),
+			(finance, date(2025, 1, 1), date(2025, 1, 3), 1),
+			(finance, date(2025, 1, 2), date(2025, 1, 5), 1),
+			(finance, date(2025, 1, 6), date(2025, 1, 9), 0),
+			(audit, date(2025, 12, 31), date(2026, 1, 2), 1),
+		]:
+			Employee_Leave.objects.create(
+				employee_id=employee, leave_type_id=None, from_date=start, to_date=end, message='m', status=status,
+			)
+
+		headcount = headcount_on_leave(2025)
+		self.assertEqual(len(headcount['labels']), 365)
+		self.assertEqual(headcount['total'][:7], [1, 1, 1, 1, 1, 0, 0])
+		self.assertEqual(headcount['total'][-1], 1)
+		# Both also have the June leave from add_department
+		self.assertEqual(sum(headcount['total']), 5 + 1 + 3 + 3)
+		self.assertEqual([d['name'] for d in headcount['departments']], ['Audit', 'Finance'])
+
+	def test_absence_metrics_merge_spells_across_weekends(self):
+		self.add_department('Finance')
+		employee = Employee.objects.get()
+		# Already off Mon 2 - Wed 4 June from add_department
+		for start, end in [
+			(date(2025, 6, 6), date(2025, 6, 6)),    # Friday...
+			(date(2025, 6, 9), date(2025, 6, 10)),   # ...running on after the weekend
+			(date(2025, 6, 14), date(2025, 6, 15)),  # Weekend only, not an absence
+			(date(2025, 6, 18), date(2025, 6, 18)),
+			(date(2025, 6, 27), date(2025, 6, 27)),  # Friday
+		]:
+			Employee_Leave.objects.create(
+				employee_id=employee, leave_type_id=None, from_date=start, to_date=end, message='m', status=1,
+			)
+
+		metrics = absence_metrics(2025)
+		self.assertEqual(metrics['employee_id'].tolist(), [employee.id])
+		self.assertEqual(metrics['spells'].tolist(), [4])
+		self.assertEqual(metrics['days'].tolist(), [8])
+		self.assertEqual(metrics['bradford'].tolist(), [4 * 4 * 8])
+		self.assertEqual(metrics['longest_spell'].tolist(), [3])
+		self.assertEqual(metrics['monday_friday_spells'].tolist(), [2])
+		self.assertEqual(metrics['monday_friday_share'].tolist(), [50.0])
+
+		response = self.client.get('/HR/Reports/Absence', {'year': 2025, 'sort': 'spells'})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([row['bradford'] for row in response.context['rows']], [128])
+
+
+class CsvExportTests(TestCase):
+	def test_exports_stream_filtered_rows(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		self.client.force_login(hr)
+		finance = Department.objects.create(name='Finance')
+		annual = LeaveType.objects.create(name='Annual')
+		user = CustomUser.objects.create_user(username='ann', first_name='Ann', last_name='Lee', password='x', user_type=2)
+		employee = Employee.objects.create(admin=user, address='a', gender='F', department=finance, employee_id='E1')
+		for status, start in [(1, date(2025, 3, 3)), (0, date(2025, 4, 7)), (1, date(2024, 3, 4))]:
+			Employee_Leave.objects.create(
+				employee_id=employee, leave_type=annual, from_date=start, to_date=start, message='m', status=status,
+			)
+		LeaveBalance.objects.create(employee=employee, leave_type=annual, year=2025, days_entitled=20, days_used=1, days_remaining=19)
+
+		def download(url, params):
+			response = self.client.get(url, params)
+			self.assertEqual(response.status_code, 200)
+			self.assertTrue(response.streaming)
+			self.assertEqual(response['Content-Type'], 'text/csv')
+			return list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+		rows = download('/HR/Export/Leaves', {'status': 'approved', 'year': 2025, 'department': finance.id})
+		self.assertEqual(rows[0][:3], ['Leave ID', 'Employee ID', 'First Name'])
+		self.assertEqual(
+			[row[1:] for row in rows[1:]],
+			[['E1', 'Ann', 'Lee', 'Finance', 'Annual', '2025-03-03', '2025-03-03', '1', 'Approved', str(timezone.localdate())]]
+		)
+		self.assertEqual(len(download('/HR/Export/Leaves', {})), 4)
+		self.assertEqual(len(download('/HR/Export/Leaves', {'department': finance.id + 1})), 1)
+		self.assertEqual(
+			download('/HR/Export/Balances', {'year': 2025, 'leave_type': annual.id})[1],
+			['E1', 'Ann', 'Lee', 'Finance', 'Annual', '2025', '20', '1', '19']
+		)
+		self.assertEqual(len(download('/HR/Export/Entitlements', {'year': 2024})), 1)
+
+		# Text a spreadsheet would run as a formula is quoted
+		CustomUser.objects.filter(pk=user.pk).update(first_name='=HYPERLINK("http://x")', last_name='-2+3')
+		self.assertEqual(
+			download('/HR/Export/Balances', {'year': 2025})[1][:4],
+			['E1', '\'=HYPERLINK("http://x")', "'-2+3", 'Finance']
+		)
+
+
+class ChangeFeedTests(TestCase):
+	def setUp(self):
+		user = CustomUser.objects.create_user(username='ann', password='x', user_type=2)
+		self.employee = Employee.objects.create(admin=user, address='a', gender='F', department=Department.objects.create(name='Finance'))
+		self.leaves = [
+			Employee_Leave.objects.create(
+				employee_id=self.employee, from_date=date(2025, 6, day), to_date=date(2025, 6, day), message='m',
+			)
+			for day in (2, 3, 4)
+		]
+		# Two leaves share a timestamp, so the primary key has to break the tie
+		earlier = timezone.now() - timedelta(hours=1)
+		Employee_Leave.objects.filter(pk__in=[self.leaves[0].pk, self.leaves[1].pk]).update(updated_at=earlier)
+		Employee_Leave.objects.filter(pk=self.leaves[2].pk).update(updated_at=earlier + timedelta(minutes=1))
+
+	def test_pages_follow_the_cursor_and_hold_back_unsettled_rows(self):
+		rows, cursor, has_more = read_changes('leaves', limit=2)
+		self.assertEqual([row['id'] for row in rows], [self.leaves[0].pk, self.leaves[1].pk])
+		self.assertTrue(has_more)
+		rows, cursor, has_more = read_changes('leaves', cursor, limit=2)
+		self.assertEqual([row['id'] for row in rows], [self.leaves[2].pk])
+		self.assertFalse(has_more)
+		self.assertEqual(read_changes('leaves', cursor)[:2], ([], cursor))
+
+		# A fresh change is only sent once it has settled
+		self.leaves[0].status = 1
+		self.leaves[0].save()
+		self.assertEqual(read_changes('leaves', cursor)[0], [])
+		self.employee.admin.first_name = 'Ann'
+		self.employee.admin.save()
+		rows = read_changes('employees', until=timezone.now())[0]
+		self.assertEqual([(row['id'], row['first_name']) for row in rows], [(self.employee.pk, 'Ann')])
+
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		self.client.force_login(hr)
+		# The first leave has just changed, leaving two settled rows
+		response = self.client.get('/API/Changes/leaves', {'limit': 1})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(response.content.splitlines()), 1)
+		self.assertEqual(response['X-Has-More'], 'true')
+		response = self.client.get('/API/Changes/leaves', {'cursor': response['X-Next-Cursor']})
+		self.assertEqual(len(response.content.splitlines()), 1)
+		self.assertEqual(self.client.get('/API/Changes/leaves', {'cursor': 'nope'}).status_code, 400)
+		self.assertEqual(self.client.get('/API/Changes/holidays').status_code, 404)
+
+	def test_command_exports_only_rows_changed_since_the_stored_cursor(self):
+		with tempfile.TemporaryDirectory() as directory:
+			state = os.path.join(directory, 'state.json')
+			output = os.path.join(directory, 'changes.jsonl')
+
+			def export():
+				call_command('export_changes', 'leaves', state=state, output=output, page_size=2, stderr=StringIO())
+				with open(output) as changes:
+					return [json.loads(line) for line in changes]
+
+			self.assertEqual([change['data']['id'] for change in export()], [leave.pk for leave in self.leaves])
+			self.assertEqual(export(), [])
+			self.leaves[1].status = 2
+			self.leaves[1].save()
+			Employee_Leave.objects.filter(pk=self.leaves[1].pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+			changes = export()
+			self.assertEqual([(change['data']['id'], change['data']['status']) for change in changes], [(self.leaves[1].pk, 2)])
+			with open(state) as cursors:
+				self.assertEqual(json.load(cursors), {'leaves': changes[-1]['cursor']})
+
+
+class EmployeeImportTests(TestCase):
+	def setUp(self):
+		self.finance = Department.objects.create(name='Finance')
+		user = CustomUser.objects.create_user(username='ann', email='ann@example.com', password='x', user_type=2)
+		Employee.objects.create(admin=user, address='a', gender='F', employee_id='EMP007')
+
+	def test_valid_rows_are_created_and_rejected_rows_reported(self):
+		content = (
+			'first_name,last_name,email,username,gender,department,date_of_joining,password\n'
+			'Bob,Lee,bob@example.com,bob,M,finance,2025-01-06,\n'
+			'Cat,Kim,ANN@example.com,cat,F,,,\n'
+			'Dan,Roe,dan@example.com,bob,M,,,\n'
+			'Eve,Poe,eve@example.com,eve,F,Legal,06/01/2025,\n'
+			'Fay,Doe,fay@example.com,fay,F,Finance,,Secret123!\n'
+		)
+		rows = read_import_file(content.encode(), 'staff.csv')
+
+		result = import_employees(rows, dry_run=True)
+		self.assertEqual(len(result.created), 2)
+		self.assertFalse(CustomUser.objects.filter(username='bob').exists())
+
+		result = import_employees(rows)
+		self.assertEqual(dict(result.error_rows), {
+			3: ['Email ANN@example.com already exists'],
+			4: ['Username bob appears earlier in the file'],
+			5: ['Department Legal does not exist', 'date_of_joining must be a date in YYYY-MM-DD format'],
+		})
+		bob = Employee.objects.get(admin__username='bob')
+		self.assertEqual((bob.employee_id, bob.department, str(bob.date_of_joining)), ('EMP008', self.finance, '2025-01-06'))
+		self.assertFalse(bob.admin.has_usable_password())
+		self.assertTrue(Employee.objects.get(admin__username='fay').admin.check_password('Secret123!'))
+
+		# Importing the same file again rejects every row
+		self.assertEqual(import_employees(rows).created, [])
+
+	def test_import_leaves_the_same_rows_as_adding_staff(self):
+
+		def row_counts():
+			# Leaving out the employee ID counter, made by whichever comes first
+			return {
+				model.__name__: model.objects.count()
+				for model in apps.get_app_config('slmsapp').get_models() if model.__name__ != 'Sequence'
+			}
+
+		self.client.force_login(CustomUser.objects.create_user(username='hr', password='x', user_type=4))
+		before = row_counts()
+		self.client.post('/HR/Employee/Add', {
+			'first_name': 'Bob', 'last_name': 'Lee', 'email': 'bob@example.com', 'username': 'bob',
+			'password': 'Secret123!', 'gender': 'M', 'department': self.finance.pk, 'date_of_joining': '2025-01-06', 'address': 'a',
+		})
+		added = row_counts()
+		import_employees(read_import_file(
+			'first_name,last_name,email,username,gender,department,date_of_joining,password\n'
+			'Cat,Kim,cat@example.com,cat,F,Finance,2025-01-06,Secret123!\n'
+		))
+		imported = row_counts()
+		self.assertEqual(added['Employee'] - before['Employee'], 1)
+		self.assertEqual(
+			{name: added[name] - before[name] for name in before},
+			{name: imported[name] - added[name] for name in before},
+		)
+
+	def test_hr_can_import_a_json_file(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		self.client.force_login(hr)
+		upload = SimpleUploadedFile('staff.json', json.dumps([
+			{'first_name': 'Gil', 'last_name': 'Ray', 'email': 'gil@example.com', 'username': 'gil', 'gender': 'M', 'employee_id': 'X-1'},
+			{'first_name': 'Hal', 'last_name': 'Ray', 'email': 'hal@example.com', 'username': 'hal'},
+		]).encode())
+		response = self.client.post('/HR/Employee/Import', {'import_file': upload})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(len(response.context['result'].created), 1)
+		self.assertEqual(response.context['result'].error_rows, [(3, ['gender is required'])])
+		self.assertEqual(Employee.objects.get(admin__username='gil').employee_id, 'X-1')
+
+	def test_generated_ids_count_numerically_and_skip_ids_in_use(self):
+		for username, employee_id in (('bob', 'EMP999'), ('cat', 'EMP1001'), ('dan', None), ('eve', '')):
+			user = CustomUser.objects.create_user(username=username, password='x', user_type=2)
+			Employee.objects.create(admin=user, address='a', gender='F', employee_id=employee_id)
+		# The sequence takes over from EMP1001, which a string sort would put before EMP999
+		self.assertEqual(Employee.objects.get(admin__username='dan').employee_id, 'EMP1002')
+		self.assertEqual(Employee.objects.get(admin__username='eve').employee_id, 'EMP1003')
+		self.assertEqual(Employee.generate_employee_ids(2, taken=['EMP1004']), ['EMP1005', 'EMP1006'])
+
+		Employee.objects.filter(admin__username__in=['dan', 'eve']).update(employee_id=None)
+		call_command('update_employee_ids', '--dry-run', stdout=StringIO())
+		self.assertEqual(Employee.objects.filter(employee_id=None).count(), 2)
+		call_command('update_employee_ids', stdout=StringIO())
+		self.assertEqual(
+			list(Employee.objects.filter(admin__username__in=['dan', 'eve']).order_by('id').values_list('employee_id', flat=True)),
+			['EMP1007', 'EMP1008']
+		)
+		self.assertEqual(Sequence.objects.get(name='employee_id').last_value, 1008)
+
+
+class BulkNotificationTests(TestCase):
+	def test_audiences_are_resolved_by_the_database(self):
+		finance, legal = Department.objects.create(name='Finance'), Department.objects.create(name='Legal')
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		for username, department, is_active in (('ann', finance, True), ('bob', legal, True), ('cat', finance, False)):
+			user = CustomUser.objects.create_user(username=username, password='x', user_type=2, is_active=is_active)
+			Employee.objects.create(admin=user, address='a', gender='F', department=department)
+		head = CustomUser.objects.create_user(username='dee', password='x', user_type=3)
+		DepartmentHead.objects.create(admin=head, department=finance)
+		self.client.force_login(hr)
+
+		# The page searches for users instead of listing them all
+		response = self.client.get('/Notifications/Send/Bulk')
+		self.assertEqual(response.status_code, 200)
+		self.assertNotContains(response, 'bob')
+		response = self.client.get('/Notifications/API/Users', {'q': 'bo'})
+		self.assertEqual([user['name'] for user in response.json()['users']], ['bob'])
+
+		def recipients():
+			names = sorted(Notification.objects.values_list('recipient__username', flat=True))
+			Notification.objects.all().delete()
+			return names
+
+		message = {'title': 'Hello', 'message': 'Hi', 'notification_type': 'info'}
+		response = self.client.post('/Notifications/Send/Bulk', {'audience': 'department', 'department': finance.pk, **message})
+		self.assertRedirects(response, '/Notifications/Sent', fetch_redirect_response=False)
+		self.assertEqual(recipients(), ['ann', 'dee'])
+		self.client.post('/Notifications/Send/Bulk', {'audience': 'role', 'role': '2', **message})
+		self.assertEqual(recipients(), ['ann', 'bob'])
+		self.client.post('/Notifications/Send/Bulk', {'audience': 'everyone', **message})
+		self.assertEqual(recipients(), ['ann', 'bob', 'dee'])
+		self.client.post('/Notifications/Send/Bulk', {'audience': 'selected', 'recipients': [head.pk], **message})
+		self.assertEqual(recipients(), ['dee'])
+
+		response = self.client.post('/Notifications/Send/Bulk', {'audience': 'role', **message})
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('role', response.context['form'].errors)
+		self.assertEqual(recipients(), [])
+
+	def test_sent_page_shows_one_line_per_broadcast_with_read_counts(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		users = [CustomUser.objects.create_user(username=f'user{i}', password='x', user_type=2) for i in range(5)]
+		send_notifications(hr, audience_recipients('everyone', sender=hr), 'Office closed', 'Friday off')
+		send_notification(hr, users[0], 'Hello', 'Just you')
+		# The text is stored once per broadcast
+		self.assertEqual(Broadcast.objects.count(), 2)
+		self.assertEqual(Notification.objects.count(), 6)
+
+		self.client.force_login(users[1])
+		delivery = Notification.objects.get(recipient=users[1])
+		response = self.client.get(f'/Notifications/{delivery.pk}')
+		self.assertContains(response, 'Friday off')
+		delivery.refresh_from_db()
+		self.assertIsNotNone(delivery.read_at)
+
+		self.client.force_login(hr)
+		# However many recipients, the page runs the same queries
+		with self.assertNumQueries(8):
+			response = self.client.get('/Notifications/Sent')
+		rows = {broadcast.title: broadcast for broadcast in response.context['notifications']}
+		self.assertEqual((rows['Office closed'].recipient_count, rows['Office closed'].read_count), (5, 1))
+		self.assertIsNone(rows['Office closed'].recipient)
+		self.assertEqual(rows['Hello'].recipient, users[0])
+		self.assertEqual(response.context['delivery_counts'], {'recipient_count': 6, 'read_count': 1})
+
+		response = self.client.post(f'/Notifications/Sent/{rows["Office closed"].pk}/Delete')
+		self.assertEqual(response.json()['status'], 'success')
+		self.assertEqual(Notification.objects.count(), 1)
+
+
+class OutboxTests(TestCase):
+	def test_approval_queues_the_notification_until_the_worker_runs(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		user = CustomUser.objects.create_user(username='ann', password='x', user_type=2)
+		employee = Employee.objects.create(admin=user, address='a', gender='F')
+		leave = Employee_Leave.objects.create(
+			employee_id=employee, leave_type=LeaveType.objects.create(name='Annual'),
+			from_date=date(2025, 6, 2), to_date=date(2025, 6, 6), message='trip',
+		)
+		self.client.force_login(hr)
+		self.client.post(f'/HR/Leave/Approve/{leave.pk}')
+		self.assertEqual(OutboxMessage.objects.get().status, 'pending')
+		self.assertFalse(Notification.objects.exists())
+
+		call_command('process_outbox', stdout=StringIO())
+		self.assertEqual(OutboxMessage.objects.get().status, 'sent')
+		notification = Notification.objects.get()
+		self.assertEqual((notification.recipient, notification.sender), (user, hr))
+		self.assertTrue(notification.title.startswith('Leave Approved'))
+
+	def test_notifications_are_not_sent_twice_when_the_worker_dies(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		ann = CustomUser.objects.create_user(username='ann', password='x', user_type=2)
+		for title in ('First', 'Second'):
+			outbox_utils.enqueue_notification(hr, ann, title, 'Hello')
+
+		def die_on_second(**kwargs):
+			if kwargs['title'] == 'Second':
+				raise KeyboardInterrupt
+			return send_notification(**kwargs)
+
+		# The worker is killed while delivering the second message, before the batch is saved
+		with mock.patch.object(outbox_utils, 'send_notification', die_on_second), \
+				mock.patch.object(OutboxMessage.objects, 'bulk_update'):
+			with self.assertRaises(KeyboardInterrupt):
+				outbox_utils.process_outbox()
+		self.assertEqual(
+			list(OutboxMessage.objects.values_list('status', flat=True)), ['sent', 'pending']
+		)
+		# Once the lease runs out, only the second message is delivered
+		self.assertEqual(outbox_utils.process_outbox(now=timezone.now() + outbox_utils.OUTBOX_LEASE), (1, 0))
+		self.assertEqual(Notification.objects.filter(recipient=ann).count(), 2)
+
+	def test_failed_email_is_retried_with_backoff(self):
+		CustomUser.objects.create_user(username='ann', password='x', email='ann@example.com')
+		self.client.post('/password-reset/', {'email': 'ann@example.com'})
+		self.assertEqual(mail.outbox, [])
+		queued = OutboxMessage.objects.get()
+		self.assertEqual(queued.payload['to'], ['ann@example.com'])
+
+		with tempfile.NamedTemporaryFile() as not_a_directory:
+			# The file backend cannot write into a file, so every delivery fails
+			with override_settings(
+				EMAIL_BACKEND='django.core.mail.backends.filebased.EmailBackend',
+				EMAIL_FILE_PATH=not_a_directory.name,
+			):
+				now = timezone.now()
+				self.assertEqual(process_outbox(now=now), (0, 1))
+				queued.refresh_from_db()
+				self.assertEqual((queued.status, queued.attempts), ('pending', 1))
+				self.assertTrue(queued.last_error)
+				self.assertGreater(queued.next_attempt_at, now)
+				# Not due again until the backoff has passed
+				self.assertEqual(process_outbox(now=now), (0, 0))
+
+		later = queued.next_attempt_at
+		self.assertEqual(process_outbox(now=later), (1, 0))
+		queued.refresh_from_db()
+		self.assertEqual((queued.status, queued.attempts, queued.last_error), ('sent', 2, ''))
+		self.assertEqual(mail.outbox[0].to, ['ann@example.com'])
+
+		# Several emails in one batch share the connection; one bad message gives up after the last attempt
+		enqueue_email('Hello', 'Hi', ['bob@example.com'])
+		broken = enqueue_email('Broken', 'Hi', ['bob@example.com'])
+		OutboxMessage.objects.filter(pk=broken.pk).update(kind='fax')
+		for attempt in range(OUTBOX_MAX_ATTEMPTS):
+			later += timedelta(days=1)
+			process_outbox(now=later)
+		broken.refresh_from_db()
+		self.assertEqual((broken.status, broken.attempts), ('failed', OUTBOX_MAX_ATTEMPTS))
+		self.assertEqual(len(mail.outbox), 2)
+
+
+	def test_reset_code_is_cleared_once_sent_and_old_messages_are_purged(self):
+		CustomUser.objects.create_user(username='ann', password='x', email='ann@example.com')
+		self.client.post('/password-reset/', {'email': 'ann@example.com'})
+		call_command('process_outbox', stdout=StringIO())
+		self.assertIn('password reset code is', mail.outbox[0].body)
+		queued = OutboxMessage.objects.get()
+		self.assertEqual((queued.status, queued.payload['message']), ('sent', ''))
+
+		self.assertEqual(purge_outbox(now=queued.sent_at + OUTBOX_RETENTION - timedelta(minutes=1)), 0)
+		self.assertEqual(purge_outbox(now=queued.sent_at + OUTBOX_RETENTION + timedelta(minutes=1)), 1)
+		self.assertFalse(OutboxMessage.objects.exists())
+
+class DigestTests(TestCase):
+	def test_daily_digest_lists_unread_notifications_once(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4, first_name='Hana')
+		ann = CustomUser.objects.create_user(username='ann', password='x', email='ann@example.com', first_name='Ann')
+		bob = CustomUser.objects.create_user(username='bob', password='x', email='bob@example.com')
+		CustomUser.objects.create_user(username='cy', password='x', email='cy@example.com')  # Not opted in
+		self.client.force_login(ann)
+		self.client.post('/Profile/update', {'first_name': 'Ann', 'last_name': 'A', 'digest_frequency': 'daily'})
+		CustomUser.objects.filter(username='bob').update(digest_frequency='daily')
+
+		yesterday = timezone.make_aware(datetime(2025, 6, 2, 9, 30))
+		for user in (ann, bob, CustomUser.objects.get(username='cy')):
+			send_notification(hr, user, 'Policy update', 'Please read the new leave policy')
+		send_notification(hr, ann, 'Leave approved', 'Enjoy your trip')
+		Notification.objects.update(created_at=yesterday)
+		Notification.objects.filter(recipient=bob).update(is_read=True)
+		# Today's notifications wait for tomorrow's digest
+		send_notification(hr, ann, 'Too late', 'Sent today')
+		Notification.objects.filter(broadcast__title='Too late').update(created_at=yesterday + timedelta(days=1))
+
+		today = yesterday + timedelta(days=1)
+		self.assertEqual(send_digests('daily', now=today), (2, 1))
+		self.assertEqual(len(mail.outbox), 1)
+		digest = mail.outbox[0]
+		self.assertEqual(digest.to, ['ann@example.com'])
+		self.assertIn('2 unread notifications', digest.subject)
+		self.assertIn('Leave approved', digest.body)
+		self.assertIn('Policy update', digest.body)
+		self.assertNotIn('Too late', digest.body)
+		self.assertIn('Monday, June 2', digest.body)
+
+		# The same period is not sent twice
+		self.assertEqual(send_digests('daily', now=today + timedelta(hours=3)), (0, 0))
+		out = StringIO()
+		call_command('send_digests', '--frequency', 'hourly', stdout=out)
+		self.assertIn('Sent 0 digest(s)', out.getvalue())
+		self.assertEqual(send_digests('daily', now=today + timedelta(days=1), batch_size=1), (2, 1))
+		self.assertIn('Too late', mail.outbox[1].body)
+
+
+	def test_each_subscriber_gets_what_came_after_their_last_digest(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		ann = CustomUser.objects.create_user(username='ann', password='x', email='ann@example.com', digest_frequency='daily')
+		now = timezone.make_aware(datetime(2025, 6, 3, 0, 30))
+		# Ann last had a digest two days ago, Bob's ended after this morning's notification
+		CustomUser.objects.filter(pk=ann.pk).update(digest_sent_through=now - timedelta(days=2, minutes=30))
+		bob = CustomUser.objects.create_user(
+			username='bob', password='x', email='bob@example.com', digest_frequency='daily',
+			digest_sent_through=now - timedelta(hours=12),
+		)
+		for user in (ann, bob):
+			send_notification(hr, user, 'Morning', 'Sent in the morning')
+		Notification.objects.update(created_at=now - timedelta(hours=20))
+		send_notification(hr, ann, 'Missed', 'Sent before yesterday')
+		Notification.objects.filter(broadcast__title='Missed').update(created_at=now - timedelta(days=1, hours=12))
+		self.assertEqual(send_digests('daily', now=now), (2, 1))
+		self.assertEqual(mail.outbox[0].to, ['ann@example.com'])
+		self.assertIn('2 unread notifications', mail.outbox[0].subject)
+
+class UnreadCounterTests(TestCase):
+	def test_badge_count_follows_sends_reads_and_deletes_without_counting(self):
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		ann = CustomUser.objects.create_user(username='ann', password='x')
+		bob = CustomUser.objects.create_user(username='bob', password='x')
+		self.client.force_login(ann)
+
+		def badge():
+			with CaptureQueriesContext(connection) as queries:
+				count = self.client.get('/Notifications/API/UnreadCount').json()['unread_count']
+			self.assertFalse([query for query in queries if 'slmsapp_notification' in query['sql']])
+			return count
+
+		with self.captureOnCommitCallbacks(execute=True):
+			send_notifications(hr, audience_recipients('everyone', sender=hr), 'Office closed', 'Friday off')
+			first = send_notification(hr, ann, 'Hello', 'Just you')
+			send_notification(hr, ann, 'Again', 'Still you')
+		self.assertEqual(badge(), 3)
+		# A send that rolls back leaves the count alone
+		with transaction.atomic():
+			send_notification(hr, ann, 'Undone', 'Never sent')
+			transaction.set_rollback(True)
+		self.assertEqual(badge(), 3)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.get(f'/Notifications/{first.pk}')
+			# Reading it again changes nothing
+			self.client.post(f'/Notifications/{first.pk}/MarkRead')
+		self.assertEqual(badge(), 2)
+		with self.captureOnCommitCallbacks(execute=True):
+			first.mark_as_unread()
+		self.assertEqual(badge(), 3)
+
+		ids = list(Notification.objects.filter(recipient=ann).values_list('id', flat=True))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post('/Notifications/MarkMultipleRead', {'notification_ids[]': ids[:2]})
+		self.assertEqual(badge(), 1)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(f'/Notifications/{ids[2]}/Delete')
+		self.assertEqual(badge(), 0)
+		self.assertEqual(self.client.get('/Notifications').context['unread_count'], 0)
+
+		bob.refresh_from_db()
+		self.assertEqual(bob.unread_notifications, 1)
+		self.client.force_login(hr)
+		office_closed = Notification.objects.get(recipient=bob).broadcast
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(f'/Notifications/Sent/{office_closed.pk}/Delete')
+		bob.refresh_from_db()
+		self.assertEqual(bob.unread_notifications, 0)
+
+		# Notifications removed behind its back are picked up by the rebuild
+		send_notification(hr, bob, 'Hello', 'Hi')
+		CustomUser.objects.filter(pk=bob.pk).update(unread_notifications=7)
+		with self.captureOnCommitCallbacks(execute=True):
+			call_command('rebuild_unread_counts', stdout=StringIO())
+		bob.refresh_from_db()
+		self.assertEqual(bob.unread_notifications, 1)
+
+	def test_count_read_before_a_change_is_not_cached_after_it(self):
+		notification_utils.cache.clear()
+		hr = CustomUser.objects.create_user(username='hr', password='x', user_type=4)
+		ann = CustomUser.objects.create_user(username='ann', password='x')
+		add = notification_utils.cache.add
+
+		def send_then_add(key, value, *args):
+			# A notification is sent after the count was read from the database
+			if key.startswith('slms_unread_notifications_') and value == 0:
+				with self.captureOnCommitCallbacks(execute=True):
+					notification_utils.send_notification(hr, ann, 'Hello', 'Hi')
+			return add(key, value, *args)
+
+		with mock.patch.object(notification_utils.cache, 'add', send_then_add):
+			self.assertEqual(notification_utils.unread_count(ann), 0)
+		self.assertEqual(notification_utils.unread_count(ann), 1)